@@ -22,9 +22,17 @@ MOD_NAMES = [
     "thinc.extra.search",
     "thinc.layers.sparselinear",
 ]
+# GCC only vectorizes loops with float comparisons, like the activation
+# kernels in NumpyOps, if it can assume that they don't trap. This is also
+# clang's default.
 COMPILE_OPTIONS = {
     "msvc": ["/Ox", "/EHsc"],
-    "other": ["-O3", "-Wno-strict-prototypes", "-Wno-unused-function"],
+    "other": [
+        "-O3",
+        "-fno-trapping-math",
+        "-Wno-strict-prototypes",
+        "-Wno-unused-function",
+    ],
 }
 COMPILER_DIRECTIVES = {
     "language_level": -3,
@@ -33,6 +41,13 @@ COMPILER_DIRECTIVES = {
 }
 LINK_OPTIONS = {"msvc": [], "other": []}
 
+# The NumpyOps kernels can run over the batch with OpenMP. Apple's compiler
+# doesn't support it out of the box, so the kernels are built serially there.
+if sys.platform != "darwin":
+    COMPILE_OPTIONS["msvc"].append("/openmp")
+    COMPILE_OPTIONS["other"].append("-fopenmp")
+    LINK_OPTIONS["other"].append("-fopenmp")
+
 
 def is_new_osx():
     """Check whether we're on OSX >= 10.10"""
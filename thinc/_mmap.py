@@ -0,0 +1,109 @@
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Tuple
+from pathlib import Path
+import contextlib
+import os
+import struct
+import uuid
+import numpy
+import srsly
+
+from .backends import Ops
+from .util import convert_recursive, is_xp_array
+
+if TYPE_CHECKING:
+    from .model import Model
+
+
+# Files written by Model.to_disk(path, mmap=True) start with this magic string,
+# followed by the size of the msgpack header as a little-endian uint64, the
+# header itself, and the raw parameter arrays, each aligned to a page boundary.
+MMAP_MAGIC = b"\x93THINCMM"
+MMAP_ALIGN = 4096
+
+
+def write_mmap(model: "Model", path: Path) -> None:
+    header, arrays = get_mmap_layout(model)
+    with open_replacement(path) as file_:
+        file_.write(MMAP_MAGIC)
+        file_.write(struct.pack("<Q", len(header)))
+        file_.write(header)
+        position = len(MMAP_MAGIC) + 8 + len(header)
+        data_start = align(position)
+        for offset, array in arrays:
+            file_.write(b"\0" * (data_start + offset - position))
+            file_.write(array.reshape(-1).view("uint8").data)
+            position = data_start + offset + array.nbytes
+
+
+@contextlib.contextmanager
+def open_replacement(path: Path) -> Iterator[Any]:
+    # Write to a new file that then replaces the target, as the params of a
+    # model loaded with from_disk may be mapped from the target itself.
+    tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        with tmp_path.open("xb") as file_:
+            yield file_
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def get_mmap_layout(model: "Model") -> Tuple[bytes, List[Tuple[int, numpy.ndarray]]]:
+    msg = model.to_dict()
+    arrays = []
+    offset = 0
+    for params in msg["params"]:
+        for name, value in params.items():
+            if value is None:
+                continue
+            array = numpy.ascontiguousarray(model.ops.to_numpy(value))
+            params[name] = {
+                "offset": offset,
+                "shape": list(array.shape),
+                "dtype": array.dtype.str,
+            }
+            arrays.append((offset, array))
+            offset = align(offset + array.nbytes)
+    msg = convert_recursive(is_xp_array, model.ops.to_numpy, msg)
+    return srsly.msgpack_dumps(msg), arrays
+
+
+def read_mmap(path: Path, ops: Ops) -> Dict:
+    return read_mmap_data(numpy.memmap(path, dtype="uint8", mode="c"), ops)
+
+
+def read_mmap_data(data: numpy.ndarray, ops: Ops) -> Dict:
+    header_start = len(MMAP_MAGIC) + 8
+    (header_size,) = struct.unpack("<Q", bytes(data[len(MMAP_MAGIC) : header_start]))
+    msg = srsly.msgpack_loads(bytes(data[header_start : header_start + header_size]))
+    msg = convert_recursive(is_xp_array, ops.asarray, msg)
+    data_start = align(header_start + header_size)
+    for params in msg["params"]:
+        for name, info in params.items():
+            if info is None:
+                continue
+            dtype = numpy.dtype(info["dtype"])
+            shape = tuple(info["shape"])
+            start = data_start + info["offset"]
+            end = start + dtype.itemsize * int(numpy.prod(shape))
+            params[name] = data[start:end].view(dtype).reshape(shape)
+    return msg
+
+
+def unflatten_params(model: "Model") -> None:
+    for node in model.walk():
+        node._params.unflatten()
+
+
+def is_mmap_file(path: Path) -> bool:
+    if path.is_dir() or not path.exists():
+        return False
+    with path.open("rb") as file_:
+        return file_.read(len(MMAP_MAGIC)) == MMAP_MAGIC
+
+
+def align(offset: int) -> int:
+    return -(-offset // MMAP_ALIGN) * MMAP_ALIGN
+
+
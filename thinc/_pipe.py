@@ -0,0 +1,170 @@
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Iterator, List
+from typing import Optional, Tuple
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import io
+import itertools
+import multiprocessing
+import pickle
+
+from .backends import ParamServer
+from ._shared_memory import write_shared_memory
+from .util import get_array_module, is_xp_array
+
+if TYPE_CHECKING:
+    from .model import Model
+
+
+# The model used by Model.pipe in a worker process.
+_pipe_model: Optional["Model"] = None
+
+
+def pipe(
+    model: "Model",
+    stream: Iterable[Any],
+    *,
+    batch_size: int,
+    n_process: int,
+    n_threads: int,
+    by_length: bool,
+) -> Iterator[Any]:
+    """Predict over a stream of items for Model.pipe, in this process, in a
+    pool of threads or in a pool of worker processes."""
+    if batch_size < 1:
+        raise ValueError(f"Invalid batch size: {batch_size}")
+    if n_process > 1 and n_threads > 1:
+        raise ValueError("Cannot use both n_process and n_threads")
+    windows = _iter_pipe_windows(stream, batch_size, by_length)
+    if n_process > 1:
+        ctx = multiprocessing.get_context()
+        block = write_shared_memory(model, None)
+        try:
+            initargs = (_dumps_without_params(model), block.name)
+            with ctx.Pool(n_process, _init_pipe_worker, initargs) as pool:
+
+                def submit_to_process(batch: List[Any]) -> Callable:
+                    return pool.apply_async(_pipe_predict, (batch,)).get
+
+                yield from _iter_pipe_parallel(windows, submit_to_process, n_process)
+        finally:
+            block.close()
+            block.unlink()
+    elif n_threads > 1:
+        with ThreadPoolExecutor(n_threads) as executor:
+
+            def submit_to_thread(batch: List[Any]) -> Callable:
+                return executor.submit(predict_items, model, batch).result
+
+            yield from _iter_pipe_parallel(windows, submit_to_thread, n_threads)
+    else:
+        for batches, order in windows:
+            outputs = []
+            for batch in batches:
+                outputs.extend(predict_items(model, batch))
+            yield from _restore_order(outputs, order)
+
+
+class _NoParamsPickler(pickle.Pickler):
+    # The params are published in shared memory, so they're left out.
+    def persistent_id(self, obj: Any) -> Optional[str]:
+        return "params" if isinstance(obj, ParamServer) else None
+
+
+class _NoParamsUnpickler(pickle.Unpickler):
+    def persistent_load(self, pid: Any) -> ParamServer:
+        return ParamServer()
+
+
+def _dumps_without_params(model: "Model") -> bytes:
+    file_ = io.BytesIO()
+    _NoParamsPickler(file_).dump(model)
+    return file_.getvalue()
+
+
+def _init_pipe_worker(model_data: bytes, block_name: str) -> None:
+    global _pipe_model
+    model = _NoParamsUnpickler(io.BytesIO(model_data)).load()
+    _pipe_model = model.from_shared_memory(block_name)
+
+
+def _pipe_predict(batch: List[Any]) -> List[Any]:
+    assert _pipe_model is not None
+    return predict_items(_pipe_model, batch)
+
+
+def predict_items(model: "Model", items: List[Any]) -> List[Any]:
+    """Predict a batch of items with Model.predict, and return the output for
+    each item. If the items are one-dimensional arrays of the same length,
+    i.e. rows of a two-dimensional input, they're stacked into one array.
+    Otherwise, they're passed as a list.
+    """
+    Y = model.predict(_stack_rows(model, items))
+    return [Y[i] for i in range(len(items))]
+
+
+def _stack_rows(model: "Model", items: List[Any]) -> Any:
+    if not items or not all(is_xp_array(item) and item.ndim == 1 for item in items):
+        return items
+    if any(item.shape != items[0].shape for item in items):
+        return items
+    xp = get_array_module(items[0])
+    return model.ops.asarray(xp.stack(items))
+
+
+def _iter_pipe_parallel(
+    windows: Iterator[Tuple[List[List[Any]], Optional[List[int]]]],
+    submit: Callable[[List[Any]], Callable[[], List[Any]]],
+    n_workers: int,
+) -> Iterator[Any]:
+    # A bounded number of batches is in flight at any time, so the stream
+    # isn't read much further ahead than the workers can keep up with.
+    pending: deque = deque()
+    n_pending = 0
+    for batches, order in windows:
+        results = [submit(batch) for batch in batches]
+        pending.append((results, order))
+        n_pending += len(results)
+        while n_pending > n_workers * 2:
+            results, order = pending.popleft()
+            n_pending -= len(results)
+            yield from _restore_order(_get_pipe_results(results), order)
+    while pending:
+        results, order = pending.popleft()
+        yield from _restore_order(_get_pipe_results(results), order)
+
+
+def _get_pipe_results(results: List[Callable[[], List[Any]]]) -> List[Any]:
+    outputs = []
+    for get_result in results:
+        outputs.extend(get_result())
+    return outputs
+
+
+def _iter_pipe_windows(
+    stream: Iterable[Any], batch_size: int, by_length: bool
+) -> Iterator[Tuple[List[List[Any]], Optional[List[int]]]]:
+    # Yield groups of batches read from the stream, along with the order of
+    # the items in the stream if they were sorted by length.
+    window_size = batch_size * 16 if by_length else batch_size
+    items = iter(stream)
+    while True:
+        window = list(itertools.islice(items, window_size))
+        if not window:
+            break
+        order = None
+        if by_length:
+            order = sorted(range(len(window)), key=lambda i: len(window[i]))
+            window = [window[i] for i in order]
+        batches = [
+            window[i : i + batch_size] for i in range(0, len(window), batch_size)
+        ]
+        yield batches, order
+
+
+def _restore_order(outputs: List[Any], order: Optional[List[int]]) -> List[Any]:
+    if order is None:
+        return outputs
+    restored = [None] * len(outputs)
+    for output, i in zip(outputs, order):
+        restored[i] = output
+    return restored
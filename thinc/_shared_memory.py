@@ -0,0 +1,145 @@
+from typing import TYPE_CHECKING, Any, List, Optional
+import struct
+import sys
+import weakref
+import numpy
+
+from ._mmap import MMAP_MAGIC, align, get_mmap_layout, read_mmap_data
+from ._mmap import unflatten_params
+
+if TYPE_CHECKING:
+    from .model import Model
+
+
+# The shared memory blocks created or attached to by the models in this
+# process, while any of their params are in use.
+_shared_blocks: "weakref.WeakValueDictionary[str, _SharedBlockView]"
+_shared_blocks = weakref.WeakValueDictionary()
+
+
+def share_params(model: "Model", name: Optional[str]):
+    """Write the model to a new shared memory block and replace its params by
+    views of the block. Returns the block."""
+    block = write_shared_memory(model, name)
+    view = _SharedBlockView(block)
+    _shared_blocks[block.name] = view
+    _attach_shared_memory(model, view)
+    return block
+
+
+def attach_params(model: "Model", name: str) -> None:
+    """Load the model from a shared memory block, with its params as views of
+    the block."""
+    view = _shared_blocks.get(name)
+    if view is None:
+        view = _SharedBlockView(_open_shared_block(name))
+        _shared_blocks[name] = view
+    _attach_shared_memory(model, view)
+
+
+def release_params(model: "Model", *, unlink: bool = False) -> None:
+    """Replace the params that are views of shared memory by copies, and
+    optionally unlink their blocks."""
+    views = {}
+    for node in model.walk():
+        for name in node.param_names:
+            if node.has_param(name):
+                param = node.get_param(name)
+                view = get_shared_block_view(param)
+                if view is not None:
+                    views[id(view)] = view
+                    node.set_param(name, param.copy())
+    if unlink:
+        for view in views.values():
+            _shared_blocks.pop(view.block.name, None)
+            try:
+                view.block.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def _get_shared_memory_module():
+    if sys.version_info < (3, 8):
+        raise ValueError("Sharing models in shared memory requires Python 3.8+")
+    from multiprocessing import shared_memory
+
+    return shared_memory
+
+
+def write_shared_memory(model: "Model", name: Optional[str]):
+    shared_memory = _get_shared_memory_module()
+    header, arrays = get_mmap_layout(model)
+    data_start = align(len(MMAP_MAGIC) + 8 + len(header))
+    size = data_start
+    if arrays:
+        size += arrays[-1][0] + arrays[-1][1].nbytes
+    block = shared_memory.SharedMemory(name=name, create=True, size=size)
+    data = numpy.frombuffer(block.buf, dtype="uint8")
+    data[: len(MMAP_MAGIC)] = numpy.frombuffer(MMAP_MAGIC, dtype="uint8")
+    data[len(MMAP_MAGIC) : len(MMAP_MAGIC) + 8] = numpy.frombuffer(
+        struct.pack("<Q", len(header)), dtype="uint8"
+    )
+    data[len(MMAP_MAGIC) + 8 : len(MMAP_MAGIC) + 8 + len(header)] = numpy.frombuffer(
+        header, dtype="uint8"
+    )
+    for offset, array in arrays:
+        start = data_start + offset
+        data[start : start + array.nbytes] = array.reshape(-1).view("uint8")
+    return block
+
+
+def _open_shared_block(name: str):
+    shared_memory = _get_shared_memory_module()
+    try:
+        # The block belongs to the process that created it, so it shouldn't
+        # be cleaned up when this one exits.
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13
+        return shared_memory.SharedMemory(name=name)
+
+
+class _SharedBlockView:
+    """Expose a shared memory block to numpy as a read-only array. The arrays
+    keep this object alive, and the block is closed once it's collected.
+    """
+
+    def __init__(self, block):
+        self.block = block
+        buffers = [numpy.frombuffer(block.buf, dtype="uint8")]
+        self.__array_interface__ = {
+            "data": (buffers[0].ctypes.data, True),
+            "shape": (block.size,),
+            "typestr": "|u1",
+            "version": 3,
+        }
+        weakref.finalize(self, _close_shared_block, block, buffers)
+
+
+def _close_shared_block(block, buffers: List[numpy.ndarray]) -> None:
+    # The block can only be closed once its buffer is no longer exported.
+    buffers.clear()
+    block.close()
+
+
+def get_shared_block_view(array: Any) -> Optional[_SharedBlockView]:
+    base = getattr(array, "base", None)
+    while isinstance(base, numpy.ndarray):
+        base = base.base
+    return base if isinstance(base, _SharedBlockView) else None
+
+
+def _attach_shared_memory(model: "Model", view: _SharedBlockView) -> None:
+    data = numpy.asarray(view)
+    if bytes(data[: len(MMAP_MAGIC)]) != MMAP_MAGIC:
+        err = f"Shared memory block '{view.block.name}' doesn't hold a model"
+        raise ValueError(err)
+    msg = read_mmap_data(data, model.ops)
+    # The params are set directly, as Model.from_dict would copy them, and
+    # so would a flat parameter buffer.
+    params = msg["params"]
+    msg["params"] = [{} for _ in params]
+    model.from_dict(msg)
+    unflatten_params(model)
+    for node, node_params in zip(model.walk(), params):
+        for param_name, value in node_params.items():
+            node.set_param(param_name, value)
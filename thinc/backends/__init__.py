@@ -7,8 +7,10 @@ import threading
 from .ops import Ops
 from .cupy_ops import CupyOps, has_cupy
 from .numpy_ops import NumpyOps
+from .tracing_ops import TracingOps
 from ._cupy_allocators import cupy_tensorflow_allocator, cupy_pytorch_allocator
 from ._param_server import ParamServer
+from ._arena import BufferArena
 from ..util import assert_tensorflow_installed, assert_pytorch_installed
 from ..util import is_cupy_array, set_torch_tensor_type_for_ops, require_cpu
 from .. import registry
@@ -171,8 +173,10 @@ __all__ = [
     "get_current_ops",
     "use_ops",
     "ParamServer",
+    "BufferArena",
     "Ops",
     "CupyOps",
     "NumpyOps",
+    "TracingOps",
     "has_cupy",
 ]
@@ -0,0 +1,115 @@
+from typing import Dict, List
+import threading
+import weakref
+import numpy
+
+from ..types import Shape, DTypes, ArrayXd
+
+
+class BufferArena:
+    """Recycle the arrays allocated by an Ops object, to avoid churning the
+    allocator when the same shapes are requested over and over, e.g. on every
+    training step.
+
+    Buffers are bucketed by their size, rounded up to a power of two. Each
+    array is handed out through a lease object, which numpy keeps as the base
+    of the array and of all views of it. Once the lease is collected, nothing
+    uses the buffer any more, and the next call to `reset` makes it available
+    again. Arrays that are still in use (outputs returned to the caller,
+    gradients held by a backprop callback, views of either) are never handed
+    out twice.
+    """
+
+    min_size: int
+    bytes_reused: int
+    bytes_allocated: int
+    n_reused: int
+    n_allocated: int
+    _free: Dict[int, List[numpy.ndarray]]
+    _in_use: Dict[int, numpy.ndarray]
+    _released: List[numpy.ndarray]
+
+    def __init__(self, *, min_size: int = 256):
+        self.min_size = min_size
+        self._free = {}
+        self._in_use = {}
+        # Appended to by the finalizers of the leases, which may run at any
+        # time, so it's not guarded by the lock.
+        self._released = []
+        self._lock = threading.Lock()
+        self.bytes_reused = 0
+        self.bytes_allocated = 0
+        self.n_reused = 0
+        self.n_allocated = 0
+
+    @property
+    def bytes_reserved(self) -> int:
+        """The total size of the buffers owned by the arena."""
+        with self._lock:
+            buffers = list(self._in_use.values())
+            for free in self._free.values():
+                buffers.extend(free)
+        return sum(buffer.nbytes for buffer in buffers)
+
+    def alloc(self, shape: Shape, *, dtype: DTypes = "float32") -> ArrayXd:
+        """Allocate a zeroed array, reusing a free buffer if there is one."""
+        if isinstance(shape, int):
+            shape = (shape,)
+        dtype_ = numpy.dtype(dtype)
+        nbytes = dtype_.itemsize
+        for dim in shape:
+            nbytes *= dim
+        if nbytes == 0:
+            return numpy.zeros(shape, dtype=dtype_)
+        capacity = self.min_size
+        while capacity < nbytes:
+            capacity *= 2
+        with self._lock:
+            free = self._free.get(capacity)
+            if free:
+                buffer = free.pop()
+                self.bytes_reused += nbytes
+                self.n_reused += 1
+            else:
+                buffer = numpy.empty((capacity,), dtype="uint8")
+                self.bytes_allocated += capacity
+                self.n_allocated += 1
+            self._in_use[id(buffer)] = buffer
+        lease = _BufferLease(buffer, shape, dtype_)
+        weakref.finalize(lease, self._released.append, buffer)
+        array = numpy.asarray(lease)
+        array.fill(0)
+        return array
+
+    def reset(self) -> None:
+        """Make the buffers that are no longer used available again.
+        This is called at the end of Model.predict and Model.finish_update.
+        """
+        with self._lock:
+            while self._released:
+                buffer = self._released.pop()
+                del self._in_use[id(buffer)]
+                self._free.setdefault(buffer.shape[0], []).append(buffer)
+
+    def clear(self) -> None:
+        """Release the free buffers. Buffers that are still in use are kept
+        track of, and are released once they're no longer used.
+        """
+        with self._lock:
+            self._free = {}
+
+
+class _BufferLease:
+    """Expose the start of an arena buffer to numpy as an array of the given
+    shape and dtype. Numpy keeps this object as the base of the array and of
+    its views, so it's only collected once none of them are in use.
+    """
+
+    def __init__(self, buffer: numpy.ndarray, shape: Shape, dtype: numpy.dtype):
+        self.buffer = buffer
+        self.__array_interface__ = {
+            "data": (buffer.ctypes.data, False),
+            "shape": tuple(shape),
+            "typestr": dtype.str,
+            "version": 3,
+        }
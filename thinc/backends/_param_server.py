@@ -1,23 +1,34 @@
-from typing import Dict, Tuple, Optional, Any
+from typing import Dict, Tuple, Optional, Any, Union, Sequence, Set, Callable
+import threading
 
-from ..types import FloatsXd
+from ..types import FloatsXd, RowSparse
 from ..util import get_array_module
 
 
 KeyT = Tuple[int, str]
 
+# Held while a deferred parameter is filled in, so that concurrent calls to
+# get_param never see a parameter that's only partly initialized.
+_deferred_lock = threading.Lock()
+
 
 class ParamServer:
     """Serve parameters for a single process."""
 
     _params: Dict[KeyT, FloatsXd] = {}
-    _grads: Dict[KeyT, FloatsXd] = {}
+    _grads: Dict[KeyT, Union[FloatsXd, RowSparse]] = {}
     proxy: Optional[Any]
+    flat_key: Optional[KeyT]
+    flat_params: Optional[FloatsXd]
+    flat_grads: Optional[FloatsXd]
+    _flat_layout: Dict[KeyT, Tuple[int, Tuple[int, ...]]]
+    _deferred: Dict[KeyT, Callable[[], FloatsXd]]
+    version: int
 
     def __init__(
         self,
         params: Dict[KeyT, FloatsXd] = {},
-        grads: Dict[KeyT, FloatsXd] = {},
+        grads: Dict[KeyT, Union[FloatsXd, RowSparse]] = {},
         *,
         proxy=None
     ):
@@ -26,6 +37,11 @@ class ParamServer:
         # Allow a 'proxy' to be provided to support remote parameters. This
         # is experimental, it's the mechanism we use in the Ray integration.
         self.proxy = proxy
+        self._deferred = {}
+        # Incremented whenever parameters are set or updated, e.g. so that
+        # cached outputs can tell they're stale.
+        self.version = 0
+        self._unflatten()
 
     @property
     def param_keys(self) -> Tuple[KeyT, ...]:
@@ -36,6 +52,95 @@ class ParamServer:
     def grad_keys(self) -> Tuple[KeyT, ...]:
         return tuple([key for key in self.param_keys if self.has_grad(*key)])
 
+    @property
+    def deferred_keys(self) -> Tuple[KeyT, ...]:
+        """Get the keys of the parameters whose values haven't been filled in
+        yet, see ParamServer.defer_param.
+        """
+        return tuple(self._deferred.keys())
+
+    @property
+    def flat_keys(self) -> Set[KeyT]:
+        """Get the keys of the parameters stored in the flat buffer."""
+        return set(self._flat_layout)
+
+    def flatten(self, keys: Sequence[KeyT], flat_key: KeyT) -> None:
+        """Move the float32 parameters with the given keys into one contiguous
+        buffer, and their gradients into another, replacing the arrays by views
+        of the buffers. The flat_key identifies the buffers, e.g. as the key
+        to pass to the optimizer. Gradients of the flat parameters are zero-
+        initialized, so these parameters always have a gradient afterwards.
+        """
+        if self.proxy is not None:
+            raise ValueError("Cannot flatten parameters served by a proxy")
+        params = [(key, self._params[key]) for key in keys]
+        params = [(key, p) for key, p in params if p.dtype == "float32"]
+        if not params:
+            self._unflatten()
+            return
+        xp = get_array_module(params[0][1])
+        params = [(key, p) for key, p in params if get_array_module(p) is xp]
+        flat_params = xp.empty((sum(p.size for _, p in params),), dtype="float32")
+        flat_grads = xp.zeros(flat_params.shape, dtype="float32")
+        layout = {}
+        start = 0
+        for key, param in params:
+            layout[key] = (start, param.shape)
+            end = start + param.size
+            flat_params[start:end] = param.ravel()
+            grad = self._grads.get(key)
+            if isinstance(grad, RowSparse):
+                grad = grad.to_dense()
+            if grad is not None:
+                flat_grads[start:end] = grad.ravel()
+            start = end
+        self.flat_key = flat_key
+        self.flat_params = flat_params
+        self.flat_grads = flat_grads
+        self._flat_layout = layout
+        self._params.update(self.get_flat_views(flat_params))
+        self._grads.update(self.get_flat_views(flat_grads))
+
+    def get_flat_views(self, array: FloatsXd) -> Dict[KeyT, FloatsXd]:
+        """Split an array with the layout of the flat buffer into views, one
+        per parameter. This is useful for optimizer state such as averages.
+        """
+        views = {}
+        for key, (start, shape) in self._flat_layout.items():
+            size = 1
+            for dim in shape:
+                size *= dim
+            views[key] = array[start : start + size].reshape(shape)
+        return views
+
+    def unflatten(self) -> None:
+        """Stop storing the parameters in the flat buffer, so that setting a
+        parameter replaces its array instead of copying into the buffer.
+        """
+        self._unflatten()
+
+    def _unflatten(self) -> None:
+        # The arrays of the parameters stay views of the old buffer, but are
+        # otherwise handled like any other parameter.
+        self.flat_key = None
+        self.flat_params = None
+        self.flat_grads = None
+        self._flat_layout = {}
+
+    def _set_flat(self, table: Dict, key: KeyT, value: Any) -> bool:
+        if key not in self._flat_layout:
+            return False
+        current = table[key]
+        if (
+            type(value) is type(current)
+            and value.shape == current.shape
+            and value.dtype == current.dtype
+        ):
+            current[...] = value
+            return True
+        self._unflatten()
+        return False
+
     def has_param(self, model_id: int, name: str) -> bool:
         return (model_id, name) in self._params
 
@@ -46,24 +151,53 @@ class ParamServer:
         key = (model_id, name)
         if self.proxy is not None:
             self._params[key] = self.proxy.get_param(model_id, name)
+        elif self._deferred:
+            with _deferred_lock:
+                # The key is only removed once the values are filled in.
+                init = self._deferred.get(key)
+                if init is not None:
+                    value = init()
+                    if not self._set_flat(self._params, key, value):
+                        self._params[key] = value
+                    del self._deferred[key]
         return self._params[key]
 
-    def get_grad(self, model_id: int, name: str) -> FloatsXd:
+    def defer_param(
+        self, model_id: int, name: str, init: Callable[[], FloatsXd]
+    ) -> None:
+        """Replace the placeholder of a parameter by the result of init when
+        the parameter is first retrieved. If the parameter is set before then,
+        init is never called.
+        """
+        if (model_id, name) not in self._params:
+            raise KeyError(f"Cannot defer unallocated param: {(model_id, name)}")
+        if self.proxy is None:
+            self._deferred[(model_id, name)] = init
+
+    def get_grad(self, model_id: int, name: str) -> Union[FloatsXd, RowSparse]:
         key = (model_id, name)
         return self._grads[key]
 
     def set_param(self, model_id: int, name: str, value: FloatsXd) -> None:
+        self.version += 1
         if self.proxy is not None:
             self.proxy.set_param(model_id, name, value)
-        self._params[(model_id, name)] = value
-
-    def set_grad(self, model_id: int, name: str, value: FloatsXd) -> None:
+        if self._deferred:
+            self._deferred.pop((model_id, name), None)
+        if not self._set_flat(self._params, (model_id, name), value):
+            self._params[(model_id, name)] = value
+
+    def set_grad(
+        self, model_id: int, name: str, value: Union[FloatsXd, RowSparse]
+    ) -> None:
         if self.proxy is not None:
             self.proxy.set_grad(model_id, name, value)
-        else:
+        elif not self._set_flat(self._grads, (model_id, name), value):
             self._grads[(model_id, name)] = value
 
-    def inc_grad(self, model_id: int, name: str, value: FloatsXd) -> None:
+    def inc_grad(
+        self, model_id: int, name: str, value: Union[FloatsXd, RowSparse]
+    ) -> None:
         key = (model_id, name)
         if self.proxy is not None:
             self.proxy.inc_grad(model_id, name, value)
@@ -76,5 +210,19 @@ class ParamServer:
                 self._grads[(model_id, name)] = xp.ascontiguousarray(value)
             else:
                 self._grads[(model_id, name)] = value
+        elif isinstance(value, RowSparse) or isinstance(self._grads[key], RowSparse):
+            self._inc_sparse_grad(key, value)
         else:
             self._grads[(model_id, name)] += value
+
+    def _inc_sparse_grad(self, key: KeyT, value: Union[FloatsXd, RowSparse]) -> None:
+        # Row-sparse gradients are accumulated by appending rows, so that the
+        # cost stays proportional to the rows touched. If a dense gradient
+        # is mixed in for the same parameter, the result is dense.
+        grad = self._grads[key]
+        if isinstance(grad, RowSparse) and isinstance(value, RowSparse):
+            grad.append(value)
+        elif isinstance(grad, RowSparse):
+            self._grads[key] = grad.to_dense() + value
+        else:
+            self._grads[key] += value.to_dense()
@@ -6,22 +6,22 @@ from collections.abc import Sized
 import numpy
 
 cimport cython
+from cython.parallel cimport prange
 from libc.string cimport memcpy, memset
-from libc.stdlib cimport calloc, malloc, free
-from libc.stdint cimport uint32_t, uint64_t
+from libc.stdint cimport int8_t, int32_t, uint32_t, uint64_t
 from libc.string cimport memcpy
 from libc.math cimport isnan
-from cymem.cymem cimport Pool
 from preshed.maps cimport PreshMap
 from murmurhash.mrmr cimport hash64
 cimport numpy as np
 cimport blis.cy
 
 from .. import registry
-from ..util import copy_array, get_array_module
+from ..util import copy_array, get_array_module, get_numpy_rng
 from ..types import DeviceTypes, DTypes, Shape, ArrayXd
 from .linalg cimport VecVec, Vec
-from .ops import Ops
+from .ops import Ops, INT8_GEMM_CHUNK
+from ._arena import BufferArena
 
 try:
     import blis.py
@@ -34,6 +34,7 @@ ctypedef float weight_t
 
 
 cdef extern from "math.h":
+    double sqrt(double x) nogil
     float logf(float x) nogil
     float sqrtf(float x) nogil
     float expf(float x) nogil
@@ -52,13 +53,24 @@ class NumpyOps(Ops):
         device_type: DeviceTypes = "cpu",
         device_id: int = -1,
         *,
-        use_blis: bool = True
+        use_blis: bool = True,
+        n_threads: int = 1,
+        use_arena: bool = False
     ) -> None:
         self.device_type = device_type
         self.device_id = device_id
         self.use_blis = use_blis
         if self.use_blis and not has_blis:
             raise ValueError("BLIS support requires blis: pip install blis")
+        # Number of threads used by the kernels that can run in parallel over
+        # the batch (seq2col, reductions, maxout, mish). This has no effect
+        # if the extension was built without OpenMP.
+        if n_threads < 1:
+            raise ValueError(f"Invalid number of threads: {n_threads}")
+        self.n_threads = n_threads
+        # Recycle the buffers returned by alloc between batches. The arena is
+        # reset by Model.predict and Model.finish_update.
+        self.arena = BufferArena() if use_arena else None
 
     def asarray(self, data, dtype=None):
         if isinstance(data, self.xp.ndarray):
@@ -77,6 +89,8 @@ class NumpyOps(Ops):
             return self.xp.array(data)
 
     def alloc(self, shape: Shape, *, dtype: Optional[DTypes] = "float32") -> ArrayXd:
+        if self.arena is not None:
+            return self.arena.alloc(shape, dtype=dtype)
         return self.xp.zeros(shape, dtype=dtype)
 
     def gemm(self, np.ndarray x, np.ndarray y, *, np.ndarray out=None, trans1=False, trans2=False):
@@ -92,13 +106,47 @@ class NumpyOps(Ops):
             out = self.as_contig(out)
         return blis.py.gemm(x, y, out=out, trans1=trans1, trans2=trans2, beta=0.)
 
+    def gemm_int8(self, x, y, out=None, trans1=False, trans2=False):
+        if not self.use_blis or not _is_int8_2d(x) or not _is_int8_2d(y):
+            return Ops.gemm_int8(self, x, y, out=out, trans1=trans1, trans2=trans2)
+        cdef int M = x.shape[1] if trans1 else x.shape[0]
+        cdef int K = x.shape[0] if trans1 else x.shape[1]
+        cdef int N = y.shape[0] if trans2 else y.shape[1]
+        if (y.shape[1] if trans2 else y.shape[0]) != K:
+            raise ValueError(f"Cannot multiply int8 arrays of shapes {x.shape} and {y.shape}")
+        if out is None:
+            out = numpy.empty((M, N), dtype="int32")
+        elif not isinstance(out, numpy.ndarray) or out.dtype != numpy.int32 \
+                or out.shape != (M, N) or not out.flags.c_contiguous:
+            raise ValueError(f"Expected a contiguous int32 output array of shape {(M, N)}")
+        if M == 0 or N == 0:
+            return out
+        # The int8 chunks are converted to floats in these buffers.
+        cdef int chunk = min(K, INT8_GEMM_CHUNK)
+        cdef np.ndarray x_f = numpy.empty((M * chunk,), dtype="float32")
+        cdef np.ndarray y_f = numpy.empty((chunk * N,), dtype="float32")
+        cdef np.ndarray out_f = numpy.empty((M * N,), dtype="float32")
+        cdef np.ndarray x_arr = x
+        cdef np.ndarray y_arr = y
+        cdef np.ndarray out_arr = out
+        cdef bint c_trans1 = trans1
+        cdef bint c_trans2 = trans2
+        with nogil:
+            cpu_gemm_int8(<int32_t*>out_arr.data,
+                <const int8_t*>x_arr.data, x_arr.strides[0], x_arr.strides[1], c_trans1,
+                <const int8_t*>y_arr.data, y_arr.strides[0], y_arr.strides[1], c_trans2,
+                M, N, K, chunk,
+                <float*>x_f.data, <float*>y_f.data, <float*>out_f.data)
+        return out
+
     def relu(self, np.ndarray X, inplace=False):
         cdef np.ndarray out = X if inplace else X.copy()
         cdef weight_t* data = <weight_t*>out.data
         cdef size_t size = out.size
-        for i in range(size):
-            if data[i] < 0:
-                data[i] = 0.
+        with nogil:
+            for i in range(size):
+                if data[i] < 0:
+                    data[i] = 0.
         return out
 
     def backprop_relu(self, np.ndarray dY, np.ndarray Y, inplace=False):
@@ -106,11 +154,61 @@ class NumpyOps(Ops):
         cdef size_t size = dX.size
         cdef weight_t* dX_ptr = <weight_t*>dX.data
         cdef const weight_t* Y_ptr = <const weight_t*>Y.data
-        for i in range(size):
-            if Y_ptr[i] <= 0:
-                dX_ptr[i] = 0.
+        with nogil:
+            for i in range(size):
+                if Y_ptr[i] <= 0:
+                    dX_ptr[i] = 0.
+        return dX
+
+    def dropout(self, X, drop, *, inplace=False):
+        if X.dtype != numpy.float32 or not X.flags.c_contiguous or not 0 < drop < 1:
+            return Ops.dropout(self, X, drop, inplace=inplace)
+        # Every value of Y is written, so it doesn't need to be zeroed.
+        Y = X if inplace else numpy.empty(X.shape, dtype="float32")
+        cdef size_t size = X.size
+        # Compare raw 32-bit random integers against a threshold, rather than
+        # drawing float64 uniforms, to avoid large temporaries.
+        rng = get_numpy_rng()
+        if hasattr(rng, "bit_generator"):
+            rand = rng.bit_generator.random_raw((size + 1) // 2).view(numpy.uint32)
+        else:
+            rand = rng.randint(0, 2 ** 32, size=size, dtype=numpy.uint32)
+        mask = numpy.empty(X.shape, dtype=numpy.bool_)
+        cdef uint32_t threshold = <uint32_t>min(drop * 2 ** 32, 2 ** 32 - 1)
+        cdef float scale = 1.0 / (1.0 - drop)
+        cdef const float* X_ptr = <const float*>np.PyArray_DATA(X)
+        cdef float* Y_ptr = <float*>np.PyArray_DATA(Y)
+        cdef const uint32_t* rand_ptr = <const uint32_t*>np.PyArray_DATA(rand)
+        cdef unsigned char* mask_ptr = <unsigned char*>np.PyArray_DATA(mask)
+        with nogil:
+            cpu_dropout(Y_ptr, mask_ptr, X_ptr, rand_ptr, threshold, scale, size)
+        return Y, mask
+
+    def backprop_dropout(self, dY, mask, drop, *, inplace=False):
+        if (
+            dY.dtype != numpy.float32
+            or mask.dtype != numpy.bool_
+            or not dY.flags.c_contiguous
+            or not mask.flags.c_contiguous
+            or not 0 < drop < 1
+        ):
+            return Ops.backprop_dropout(self, dY, mask, drop, inplace=inplace)
+        dX = dY if inplace else numpy.empty(dY.shape, dtype="float32")
+        cdef float scale = 1.0 / (1.0 - drop)
+        cdef size_t size = dY.size
+        cdef const float* dY_ptr = <const float*>np.PyArray_DATA(dY)
+        cdef float* dX_ptr = <float*>np.PyArray_DATA(dX)
+        cdef const unsigned char* mask_ptr = <const unsigned char*>np.PyArray_DATA(mask)
+        with nogil:
+            for i in range(size):
+                dX_ptr[i] = dY_ptr[i] * (scale * mask_ptr[i])
         return dX
 
+    def get_dropout_mask(self, shape, drop):
+        if drop is None or drop <= 0 or drop >= 1:
+            return Ops.get_dropout_mask(self, shape, drop)
+        return self.dropout(numpy.ones(shape, dtype="float32"), drop, inplace=True)[0]
+
     def lstm_forward_training(
         self,
         np.ndarray params,
@@ -132,8 +230,7 @@ class NumpyOps(Ops):
         np.ndarray X,
         np.ndarray size_at_t
     ):
-        Y, _ = lstm_forward_training(params, H0, C0, X, size_at_t)
-        return Y
+        return lstm_forward_inference(params, H0, C0, X, size_at_t)
 
     def backprop_lstm(
             self, np.ndarray dY, np.ndarray lengths, np.ndarray params, fwd_state
@@ -142,46 +239,224 @@ class NumpyOps(Ops):
         return dX, d_params
 
     def maxout(self, const float[:, :, ::1] X):
-        cdef Pool mem = Pool()
         cdef int B = X.shape[0]
         cdef int O = X.shape[1]
         cdef int P = X.shape[2]
+        cdef int n_threads = self.n_threads
 
-        cdef np.ndarray best = numpy.zeros((B, O), dtype='float32', order='C')
-        cdef np.ndarray which = numpy.zeros((B, O), dtype='int32', order='C')
+        cdef np.ndarray best = self.alloc((B, O), dtype='float32')
+        cdef np.ndarray which = self.alloc((B, O), dtype='int32')
         if len(X) > 0:
-            cpu_maxout(<float*>best.data, <int*>which.data,
-                &X[0, 0, 0], B, O, P)
+            with nogil:
+                cpu_maxout(<float*>best.data, <int*>which.data,
+                    &X[0, 0, 0], B, O, P, n_threads)
         return best, which
 
     def backprop_maxout(self, const float[:, ::1] dY, int[:, ::1] which, int P):
         cdef int B = dY.shape[0]
         cdef int O = dY.shape[1]
+        cdef int n_threads = self.n_threads
 
-        cdef np.ndarray dX = numpy.zeros((B, O, P), dtype='float32')
-        cpu_backprop_maxout(<float*>dX.data,
-            &dY[0, 0], &which[0, 0], B, O, P)
+        cdef np.ndarray dX = self.alloc((B, O, P), dtype='float32')
+        with nogil:
+            cpu_backprop_maxout(<float*>dX.data,
+                &dY[0, 0], &which[0, 0], B, O, P, n_threads)
         return dX
 
+    def gelu(self, X, inplace=False):
+        if not _is_contig_floats(X):
+            return Ops.gelu(self, X, inplace=inplace)
+        return _activate_array(X, ACT_GELU, inplace, self.n_threads)
+
+    def backprop_gelu(self, dY, X, inplace=False):
+        if not _is_contig_floats(dY) or not _is_contig_floats(X) \
+                or dY.shape != X.shape:
+            return Ops.backprop_gelu(self, dY, X, inplace=inplace)
+        return _backprop_activate_array(dY, X, X, ACT_GELU, inplace, self.n_threads)
+
+    def gelu_approx(self, X, inplace=False):
+        if not _is_contig_floats(X):
+            return Ops.gelu_approx(self, X, inplace=inplace)
+        return _activate_array(X, ACT_GELU_APPROX, inplace, self.n_threads)
+
+    def backprop_gelu_approx(self, dY, X, inplace=False):
+        if not _is_contig_floats(dY) or not _is_contig_floats(X) \
+                or dY.shape != X.shape:
+            return Ops.backprop_gelu_approx(self, dY, X, inplace=inplace)
+        return _backprop_activate_array(dY, X, X, ACT_GELU_APPROX, inplace,
+            self.n_threads)
+
+    def swish(self, X, inplace=False):
+        if not _is_contig_floats(X):
+            return Ops.swish(self, X, inplace=inplace)
+        return _activate_array(X, ACT_SWISH, inplace, self.n_threads)
+
+    def backprop_swish(self, dY, X, Y, inplace=False):
+        if not _is_contig_floats(dY) or not _is_contig_floats(X) \
+                or not _is_contig_floats(Y) or not dY.shape == X.shape == Y.shape:
+            return Ops.backprop_swish(self, dY, X, Y, inplace=inplace)
+        return _backprop_activate_array(dY, X, Y, ACT_SWISH, inplace, self.n_threads)
+
+    def hard_swish(self, X, inplace=False):
+        if not _is_contig_floats(X):
+            return Ops.hard_swish(self, X, inplace=inplace)
+        return _activate_array(X, ACT_HARD_SWISH, inplace, self.n_threads)
+
+    def backprop_hard_swish(self, dY, X, inplace=False):
+        if not _is_contig_floats(dY) or not _is_contig_floats(X) \
+                or dY.shape != X.shape:
+            return Ops.backprop_hard_swish(self, dY, X, inplace=inplace)
+        return _backprop_activate_array(dY, X, X, ACT_HARD_SWISH, inplace,
+            self.n_threads)
+
+    def hard_swish_mobilenet(self, X, inplace=False):
+        if not _is_contig_floats(X):
+            return Ops.hard_swish_mobilenet(self, X, inplace=inplace)
+        return _activate_array(X, ACT_HARD_SWISH_MOBILENET, inplace, self.n_threads)
+
+    def backprop_hard_swish_mobilenet(self, dY, X, inplace=False):
+        if not _is_contig_floats(dY) or not _is_contig_floats(X) \
+                or dY.shape != X.shape:
+            return Ops.backprop_hard_swish_mobilenet(self, dY, X, inplace=inplace)
+        return _backprop_activate_array(dY, X, X, ACT_HARD_SWISH_MOBILENET,
+            inplace, self.n_threads)
+
+    def erf(self, X):
+        if not _is_contig_floats(X):
+            return Ops.erf(self, X)
+        return _activate_array(X, ACT_ERF, False, self.n_threads)
+
     def mish(self, const float[:, ::1] X, threshold=20.0):
         shape = [X.shape[i] for i in range(X.ndim)]
         cdef np.ndarray Y = self.alloc(tuple(shape), dtype="f")
-        cpu_mish(<float*>Y.data,
-            &X[0, 0], threshold, X.size)
+        cdef float c_threshold = threshold
+        cdef int N = X.size
+        cdef int n_threads = self.n_threads
+        with nogil:
+            cpu_mish(<float*>Y.data, &X[0, 0], c_threshold, N, n_threads)
         return Y
 
     def backprop_mish(self, const float[:, ::1] dY, const float[:, ::1] X,
             threshold=20.0, out=None):
         shape = [X.shape[i] for i in range(X.ndim)]
         cdef np.ndarray dX = self.alloc(tuple(shape), dtype="f")
-        cpu_backprop_mish(<float*>dX.data,
-            &dY[0, 0], &X[0, 0], threshold, X.size)
+        cdef float c_threshold = threshold
+        cdef int N = X.size
+        cdef int n_threads = self.n_threads
+        with nogil:
+            cpu_backprop_mish(<float*>dX.data,
+                &dY[0, 0], &X[0, 0], c_threshold, N, n_threads)
         if out is not None:
             out[:] = dX
             return out
         else:
             return dX
 
+    def layer_norm(self, X, G, b, *, eps=1e-8):
+        if not _is_contig_floats(X, 2) or not _is_contig_floats(G, 1) \
+                or not _is_contig_floats(b, 1) or X.shape[1] == 0:
+            return Ops.layer_norm(self, X, G, b, eps=eps)
+        cdef int B = X.shape[0]
+        cdef int O = X.shape[1]
+        cdef np.ndarray Y = numpy.empty((B, O), dtype="float32")
+        cdef np.ndarray mean = numpy.empty((B,), dtype="float32")
+        cdef np.ndarray rstd = numpy.empty((B,), dtype="float32")
+        cdef const float* X_ptr = <const float*>np.PyArray_DATA(X)
+        cdef const float* G_ptr = <const float*>np.PyArray_DATA(G)
+        cdef const float* b_ptr = <const float*>np.PyArray_DATA(b)
+        cdef float c_eps = eps
+        cdef int n_threads = self.n_threads
+        with nogil:
+            cpu_layer_norm(<float*>Y.data, <float*>mean.data, <float*>rstd.data,
+                X_ptr, G_ptr, b_ptr, c_eps, B, O, n_threads)
+        return Y, mean, rstd
+
+    def backprop_layer_norm(self, dY, X, G, mean, rstd):
+        if not _is_contig_floats(dY, 2) or not _is_contig_floats(X, 2) \
+                or not _is_contig_floats(G, 1) or not _is_contig_floats(mean, 1) \
+                or not _is_contig_floats(rstd, 1):
+            return Ops.backprop_layer_norm(self, dY, X, G, mean, rstd)
+        cdef int B = X.shape[0]
+        cdef int O = X.shape[1]
+        cdef np.ndarray dX = numpy.empty((B, O), dtype="float32")
+        cdef np.ndarray dG = numpy.zeros((O,), dtype="float32")
+        cdef np.ndarray db = numpy.zeros((O,), dtype="float32")
+        cdef const float* dY_ptr = <const float*>np.PyArray_DATA(dY)
+        cdef const float* X_ptr = <const float*>np.PyArray_DATA(X)
+        cdef const float* G_ptr = <const float*>np.PyArray_DATA(G)
+        cdef const float* mean_ptr = <const float*>np.PyArray_DATA(mean)
+        cdef const float* rstd_ptr = <const float*>np.PyArray_DATA(rstd)
+        cdef int n_threads = self.n_threads
+        with nogil:
+            cpu_backprop_layer_norm(<float*>dX.data, <float*>dG.data,
+                <float*>db.data, dY_ptr, X_ptr, G_ptr, mean_ptr, rstd_ptr,
+                B, O, n_threads)
+        return dX, dG, db
+
+    def affine_act(self, X, W, b, act="relu", *, keep_preact=True):
+        if act not in _AFFINE_ACT_CODES or not _is_contig_floats(X, 2) \
+                or not _is_contig_floats(W, 2) or not _is_contig_floats(b, 1) \
+                or b.shape[0] != W.shape[0]:
+            return Ops.affine_act(self, X, W, b, act, keep_preact=keep_preact)
+        cdef np.ndarray Z = self.gemm(X, W, trans2=True)
+        cdef int B = Z.shape[0]
+        cdef int O = Z.shape[1]
+        cdef int code = _AFFINE_ACT_CODES[act]
+        # Write the activations into the gemm output, unless the pre-activation
+        # values are needed for the backward pass.
+        cdef np.ndarray Y = Z
+        if keep_preact and act != "relu":
+            Y = numpy.empty((B, O), dtype="float32")
+        cdef const float* b_ptr = <const float*>np.PyArray_DATA(b)
+        cdef int n_threads = self.n_threads
+        with nogil:
+            cpu_affine_act(<float*>Y.data, <float*>Z.data, b_ptr, code,
+                B, O, n_threads)
+        return Y, Z if Y is not Z else None
+
+    def backprop_affine_act(self, dY, X, W, Y, Y_preact, act="relu"):
+        if act not in _AFFINE_ACT_CODES or not _is_contig_floats(dY, 2) \
+                or not _is_contig_floats(Y, 2) or dY.shape != Y.shape \
+                or (act != "relu" and (not _is_contig_floats(Y_preact, 2)
+                    or Y_preact.shape != Y.shape)):
+            return Ops.backprop_affine_act(self, dY, X, W, Y, Y_preact, act)
+        cdef int B = dY.shape[0]
+        cdef int O = dY.shape[1]
+        cdef int code = _AFFINE_ACT_CODES[act]
+        cdef np.ndarray dY_preact = numpy.empty((B, O), dtype="float32")
+        cdef np.ndarray db = numpy.zeros((O,), dtype="float32")
+        cdef const float* dY_ptr = <const float*>np.PyArray_DATA(dY)
+        cdef const float* Y_ptr = <const float*>np.PyArray_DATA(Y)
+        # Relu's gradient only needs the output.
+        cdef const float* Y_preact_ptr = Y_ptr
+        if act != "relu":
+            Y_preact_ptr = <const float*>np.PyArray_DATA(Y_preact)
+        cdef int n_threads = self.n_threads
+        with nogil:
+            cpu_backprop_affine_act(<float*>dY_preact.data, <float*>db.data,
+                dY_ptr, Y_ptr, Y_preact_ptr, code, B, O, n_threads)
+        dX = self.gemm(dY_preact, W)
+        dW = self.gemm(dY_preact, X, trans1=True)
+        return dX, dW, db
+
+    def affine_maxout(self, X, W, b):
+        if not _is_contig_floats(X, 2) or not _is_contig_floats(W, 3) \
+                or not _is_contig_floats(b, 2) or b.shape != W.shape[:2] \
+                or W.shape[1] == 0:
+            return Ops.affine_maxout(self, X, W, b)
+        cdef int O = W.shape[0]
+        cdef int P = W.shape[1]
+        cdef np.ndarray Z = self.gemm(X, W.reshape((O * P, W.shape[2])), trans2=True)
+        cdef int B = Z.shape[0]
+        cdef np.ndarray best = numpy.empty((B, O), dtype="float32")
+        cdef np.ndarray which = numpy.empty((B, O), dtype="int32")
+        cdef const float* b_ptr = <const float*>np.PyArray_DATA(b)
+        cdef int n_threads = self.n_threads
+        with nogil:
+            cpu_affine_maxout(<float*>best.data, <int*>which.data,
+                <const float*>Z.data, b_ptr, B, O, P, n_threads)
+        return best, which
+
     def seq2col(self, const float[:, ::1] seq, int nW, *, const int[::1] lengths=None):
         """Given an (M, N) sequence of vectors, return an (M, N*(nW*2+1))
         sequence. The new sequence is constructed by concatenating nW preceding
@@ -195,9 +470,15 @@ class NumpyOps(Ops):
         cdef int nL = lengths.shape[0]
 
         cdef np.ndarray cols = self.alloc((B, (2*nW + 1) * I), dtype="float32")
+        cdef int n_threads = self.n_threads
 
+        # The scratch memory is allocated here, so that a failed allocation
+        # raises a MemoryError instead of crashing the parallel loop.
+        cdef np.ndarray bounds = numpy.empty((2, B), dtype="int32")
         if seq.size != 0 and lengths.size != 0:
-            seq2col(<float*>cols.data, &seq[0,0], &lengths[0], nW, B, I, nL)
+            with nogil:
+                seq2col(<float*>cols.data, &seq[0,0], &lengths[0], nW, B, I,
+                    nL, n_threads, <int*>bounds.data)
 
         return cols
 
@@ -210,8 +491,12 @@ class NumpyOps(Ops):
         cdef int nL = lengths.shape[0]
 
         cdef np.ndarray dX = self.alloc((B, I), dtype='float32')
+        cdef int n_threads = self.n_threads
+        cdef np.ndarray bounds = numpy.empty((2, B), dtype="int32")
         if dY.size != 0 and lengths.size != 0:
-            backprop_seq2col(<float*>dX.data, &dY[0,0], &lengths[0], B, I, nW, nL)
+            with nogil:
+                backprop_seq2col(<float*>dX.data, &dY[0,0], &lengths[0], B, I,
+                    nW, nL, n_threads, <int*>bounds.data)
         return dX
 
     @cython.boundscheck(False)
@@ -222,8 +507,10 @@ class NumpyOps(Ops):
         cdef np.ndarray[uint32_t, ndim=2] keys = self.alloc((ids.shape[0], 4), dtype='uint32')
         cdef int i
         cdef uint32_t* dest = <uint32_t*>keys.data
-        for i in range(len(ids)):
-            MurmurHash3_x86_128_uint64(ids[i], seed, &dest[i*4])
+        cdef int n = ids.shape[0]
+        with nogil:
+            for i in range(n):
+                MurmurHash3_x86_128_uint64(ids[i], seed, &dest[i*4])
         return keys
 
     def reduce_mean(self, const float[:, ::1] X, int[::1] lengths):
@@ -231,28 +518,34 @@ class NumpyOps(Ops):
         cdef int O = X.shape[1]
         cdef int T = X.shape[0]
 
-        cdef Pool mem = Pool()
         assert B != 0
         assert O != 0
-        means = <float*>mem.alloc(B * O, sizeof(float))
+        cdef np.ndarray means = self.alloc((B, O), dtype='float32')
 
-        cpu_reduce_mean(means,
-            &X[0, 0], &lengths[0], B, T, O)
-        return cpu_floats_ptr2array(means, (B, O))
+        cdef int n_threads = self.n_threads
+        cdef np.ndarray offsets = numpy.empty((B,), dtype="int32")
+        with nogil:
+            cpu_reduce_mean(<float*>means.data,
+                &X[0, 0], &lengths[0], B, T, O, n_threads,
+                <int*>offsets.data)
+        return means
 
     def reduce_sum(self, const float[:, ::1] X, int[::1] lengths):
         cdef int B = lengths.shape[0]
         cdef int O = X.shape[1]
         cdef int T = X.shape[0]
 
-        cdef Pool mem = Pool()
         assert B != 0
         assert O != 0
-        sums = <float*>mem.alloc(B * O, sizeof(float))
+        cdef np.ndarray sums = self.alloc((B, O), dtype='float32')
 
-        cpu_reduce_sum(sums,
-            &X[0, 0], &lengths[0], B, T, O)
-        return cpu_floats_ptr2array(sums, (B, O))
+        cdef int n_threads = self.n_threads
+        cdef np.ndarray offsets = numpy.empty((B,), dtype="int32")
+        with nogil:
+            cpu_reduce_sum(<float*>sums.data,
+                &X[0, 0], &lengths[0], B, T, O, n_threads,
+                <int*>offsets.data)
+        return sums
 
     def backprop_reduce_mean(self, const float[:, ::1] d_means, int[::1] lengths):
         cdef int B = lengths.shape[0]
@@ -260,15 +553,18 @@ class NumpyOps(Ops):
         cdef int T = 0
         for length in lengths[:B]:
             T += length
-        cdef Pool mem = Pool()
         assert T != 0
         assert O != 0
-        dX = <float*>mem.alloc(T * O, sizeof(float))
+        cdef np.ndarray dX = self.alloc((T, O), dtype='float32')
 
-        cpu_backprop_reduce_mean(dX,
-            &d_means[0,0], &lengths[0], B, T, O)
+        cdef int n_threads = self.n_threads
+        cdef np.ndarray offsets = numpy.empty((B,), dtype="int32")
+        with nogil:
+            cpu_backprop_reduce_mean(<float*>dX.data,
+                &d_means[0,0], &lengths[0], B, T, O, n_threads,
+                <int*>offsets.data)
 
-        return cpu_floats_ptr2array(dX, (T, O))
+        return dX
 
     def backprop_reduce_sum(self, const float[:, ::1] d_sums, int[::1] lengths):
         cdef int B = lengths.shape[0]
@@ -276,32 +572,36 @@ class NumpyOps(Ops):
         cdef int T = 0
         for length in lengths[:B]:
             T += length
-        cdef Pool mem = Pool()
         assert T != 0
         assert O != 0
-        dX = <float*>mem.alloc(T * O, sizeof(float))
-
-        cpu_backprop_reduce_sum(dX,
-            &d_sums[0,0], &lengths[0], B, T, O)
-        return cpu_floats_ptr2array(dX, (T, O))
+        cdef np.ndarray dX = self.alloc((T, O), dtype='float32')
+
+        cdef int n_threads = self.n_threads
+        cdef np.ndarray offsets = numpy.empty((B,), dtype="int32")
+        with nogil:
+            cpu_backprop_reduce_sum(<float*>dX.data,
+                &d_sums[0,0], &lengths[0], B, T, O, n_threads,
+                <int*>offsets.data)
+        return dX
 
     def reduce_max(self, const float[:, ::1] X, const int[::1] lengths):
         cdef int B = lengths.shape[0]
         cdef int O = X.shape[1]
         cdef int T = X.shape[0]
 
-        cdef Pool mem = Pool()
         assert B != 0
         assert O != 0
-        maxes = <float*>mem.alloc(B * O, sizeof(float))
-        which = <int*>mem.alloc(B * O, sizeof(int))
+        cdef np.ndarray maxes = self.alloc((B, O), dtype='float32')
+        cdef np.ndarray which = self.alloc((B, O), dtype='int32')
 
-        cpu_reduce_max(maxes, which,
-            &X[0, 0], &lengths[0], B, T, O)
+        cdef int n_threads = self.n_threads
+        cdef np.ndarray offsets = numpy.empty((B,), dtype="int32")
+        with nogil:
+            cpu_reduce_max(<float*>maxes.data, <int*>which.data,
+                &X[0, 0], &lengths[0], B, T, O, n_threads,
+                <int*>offsets.data)
 
-        cdef np.ndarray py_best = cpu_floats_ptr2array(maxes, (B, O))
-        cdef np.ndarray py_which = cpu_ints_ptr2array(which, (B, O))
-        return py_best, py_which
+        return maxes, which
 
     def backprop_reduce_max(self, const float[:, ::1] d_maxes,
             const int[:, ::1] which, const int[::1] lengths):
@@ -310,15 +610,18 @@ class NumpyOps(Ops):
         cdef int T = 0
         for length in lengths[:B]:
             T += length
-        cdef Pool mem = Pool()
         assert T != 0
         assert O != 0
-        dX = <float*>mem.alloc(T * O, sizeof(float))
+        cdef np.ndarray dX = self.alloc((T, O), dtype='float32')
 
-        cpu_backprop_reduce_max(dX,
-            &d_maxes[0,0], &which[0, 0], &lengths[0], B, T, O)
+        cdef int n_threads = self.n_threads
+        cdef np.ndarray offsets = numpy.empty((B,), dtype="int32")
+        with nogil:
+            cpu_backprop_reduce_max(<float*>dX.data,
+                &d_maxes[0,0], &which[0, 0], &lengths[0], B, T, O, n_threads,
+                <int*>offsets.data)
 
-        return cpu_floats_ptr2array(dX, (T, O))
+        return dX
 
     def scatter_add(self, np.ndarray table, np.ndarray indices, np.ndarray values):
         if table.dtype == 'float32' \
@@ -350,6 +653,48 @@ class NumpyOps(Ops):
         memset(<float*>gradient.data, 0, gradient.size * sizeof(float))
         return weights, gradient, mom1, mom2
 
+    def multi_adam(self, weights, gradients, mom1, mom2, averages,
+            float beta1, float beta2, float eps, float learn_rate, *,
+            float L2=0.0, float weight_decay=0.0, float grad_clip=0.0,
+            float average_decay=0.0, bint use_mom2=True):
+        cdef int n = len(weights)
+        cdef int n_threads = self.n_threads
+        # The pointers are kept in numpy arrays, so that a failed allocation
+        # raises a MemoryError.
+        cdef np.ndarray ptrs_array = numpy.zeros((n * 5,), dtype=numpy.uintp)
+        cdef np.ndarray sizes_array = numpy.zeros((n,), dtype="int32")
+        cdef float** ptrs = <float**>ptrs_array.data
+        cdef int* sizes = <int*>sizes_array.data
+        cdef int t, k
+        cdef bint supported = True
+        cdef np.ndarray arr
+        for t in range(n):
+            sizes[t] = weights[t].size
+            for k, arrays in enumerate((weights, gradients, mom1, mom2, averages)):
+                if arrays is None:
+                    continue
+                obj = arrays[t]
+                if obj.size != sizes[t]:
+                    raise ValueError("Mismatched sizes in multi_adam")
+                if not _is_contig_float32(obj):
+                    supported = False
+                    break
+                arr = obj
+                ptrs[k * n + t] = <float*>arr.data
+            if not supported:
+                break
+        if not supported:
+            return super().multi_adam(weights, gradients, mom1, mom2, averages,
+                beta1, beta2, eps, learn_rate, L2=L2, weight_decay=weight_decay,
+                grad_clip=grad_clip, average_decay=average_decay,
+                use_mom2=use_mom2)
+        # The averages pointers are left NULL if there are no averages.
+        for t in prange(n, nogil=True, num_threads=n_threads, schedule="dynamic"):
+            cpu_adam_update(ptrs[t], ptrs[n + t], ptrs[2 * n + t],
+                ptrs[3 * n + t], ptrs[4 * n + t], sizes[t], beta1, beta2, eps,
+                learn_rate, L2, weight_decay, grad_clip, average_decay,
+                use_mom2)
+
     def ngrams(self, int n, const uint64_t[::1] keys):
         if n < 1:
             return self.alloc((0,), dtype="uint64")
@@ -373,6 +718,37 @@ class NumpyOps(Ops):
         return out_
 
 
+def _is_contig_floats(arr, ndim=None):
+    return (
+        isinstance(arr, numpy.ndarray)
+        and arr.dtype == numpy.float32
+        and (ndim is None or arr.ndim == ndim)
+        and arr.flags.c_contiguous
+    )
+
+
+def _is_int8_2d(arr):
+    return isinstance(arr, numpy.ndarray) and arr.dtype == numpy.int8 and arr.ndim == 2
+
+
+def _activate_array(np.ndarray X, int act, bint inplace, int n_threads):
+    cdef np.ndarray Y = X if inplace else numpy.empty_like(X)
+    cdef int N = X.size
+    with nogil:
+        cpu_activate(<float*>Y.data, <const float*>X.data, act, N, n_threads)
+    return Y
+
+
+def _backprop_activate_array(np.ndarray dY, np.ndarray X, np.ndarray Y, int act,
+        bint inplace, int n_threads):
+    cdef np.ndarray dX = dY if inplace else numpy.empty_like(dY)
+    cdef int N = dY.size
+    with nogil:
+        cpu_backprop_activate(<float*>dX.data, <const float*>dY.data,
+            <const float*>X.data, <const float*>Y.data, act, N, n_threads)
+    return dX
+
+
 def check_seq2col_lengths(ops, lengths, B):
     if lengths is None:
         lengths = ops.asarray1i([B])
@@ -383,7 +759,8 @@ def check_seq2col_lengths(ops, lengths, B):
     return lengths
 
 
-cdef void seq2col(float* output, const float* X, const int* L, int nW, int B, int I, int nL) nogil:
+cdef void seq2col(float* output, const float* X, const int* L, int nW, int B, int I, int nL,
+        int n_threads, int* bounds) nogil:
     '''
     Let's say nW is 1 (it usually is). Then we want to take:
 
@@ -420,36 +797,32 @@ cdef void seq2col(float* output, const float* X, const int* L, int nW, int B, in
     of X.
     '''
 
-    nF = nW * 2 + 1
-
-    seq_start = 0
-    for i in range(nL):
-        # Calculate the bounds of the next sequence.
-        seq_end = seq_start + L[i]
-
-        # Four-argument range loop only works with constant step.
-        for j in range(seq_start, seq_end):
-            # Find the unconstrained window around b, which
-            # may be out of the sequence bounds.
-            window_start = j - nW
-            window_end = j + nW + 1
+    cdef int nF = nW * 2 + 1
+    cdef int j, window_start, window_end, x_start, x_end
+    # Find the bounds of the sequence each row belongs to, so that the rows
+    # can be processed independently. The bounds array holds 2 * B ints.
+    cdef int* seq_starts = bounds
+    cdef int* seq_ends = bounds + B
+    _fill_seq_bounds(seq_starts, seq_ends, L, nL)
 
-            # Find the sequence-constrained window around b.
-            x_start = max(seq_start, window_start)
-            x_end = min(seq_end, window_end)
-            n_elems = x_end - x_start
+    for j in prange(B, num_threads=n_threads, schedule="static"):
+        # Find the unconstrained window around b, which
+        # may be out of the sequence bounds.
+        window_start = j - nW
+        window_end = j + nW + 1
 
-            out_offset = x_start - window_start
+        # Find the sequence-constrained window around b.
+        x_start = max(seq_starts[j], window_start)
+        x_end = min(seq_ends[j], window_end)
 
-            memcpy(output + (j * nF * I) + (out_offset * I),
-                   X + (x_start * I),
-                   n_elems * I * sizeof(output[0]))
-
-        seq_start += L[i]
+        memcpy(output + (j * nF * I) + ((x_start - window_start) * I),
+               X + (x_start * I),
+               (x_end - x_start) * I * sizeof(output[0]))
 
 
 cdef void backprop_seq2col(float* d_seqs,
-        const float* d_cols, const int* L, int B, int I, int nW, int nL) nogil:
+        const float* d_cols, const int* L, int B, int I, int nW, int nL,
+        int n_threads, int* bounds) nogil:
     # Here's what we're doing, if we had 2d indexing.
     #for i in range(B):
     #    d_seq[i] += d_cols[i-2, 4]
@@ -457,51 +830,490 @@ cdef void backprop_seq2col(float* d_seqs,
     #    d_seq[i] += d_cols[i, 2]
     #    d_seq[i] += d_cols[i+1, 1]
     #    d_seq[i] += d_cols[i+2, 0]
+    #
+    # Every output row gathers its own gradients, so that the rows can be
+    # processed in parallel without write conflicts.
+
+    cdef int nF = nW * 2 + 1
+    cdef int i, f, j
+    cdef int* seq_starts = bounds
+    cdef int* seq_ends = bounds + B
+    _fill_seq_bounds(seq_starts, seq_ends, L, nL)
+
+    for i in prange(B, num_threads=n_threads, schedule="static"):
+        for f in range(nF):
+            # Row i is at position f in the window of row j.
+            j = i + nW - f
+            if seq_starts[i] <= j < seq_ends[i]:
+                VecVec.add_i(&d_seqs[i * I],
+                             &d_cols[(j * nF * I) + (f * I)],
+                             1., I)
+
+
+cdef void _fill_seq_bounds(int* seq_starts, int* seq_ends, const int* L, int nL) nogil:
+    cdef int i, j
+    cdef int seq_start = 0
+    for i in range(nL):
+        for j in range(seq_start, seq_start + L[i]):
+            seq_starts[j] = seq_start
+            seq_ends[j] = seq_start + L[i]
+        seq_start += L[i]
 
-    nF = nW * 2 + 1
 
-    seq_start = 0
-    for i in range(nL):
-        # Calculate the bounds of the next sequence.
-        seq_end = seq_start + L[i]
+cdef void _fill_seq_offsets(int* offsets, const int* lengths, int B) nogil:
+    cdef int b
+    cdef int offset = 0
+    for b in range(B):
+        offsets[b] = offset
+        offset += lengths[b]
 
-        for j in range(seq_start, seq_end):
-            # Find the unconstrained window around b, which
-            # may be out of the sequence bounds.
-            window_begin = j - nW
-            window_end = j + nW + 1
 
-            # Find the sequence-constrained window around b.
-            d_seqs_begin = max(seq_start, window_begin)
-            d_seqs_end = min(seq_end, window_end)
-            n_elems = d_seqs_end - d_seqs_begin
+cdef void cpu_dropout(float* Y, unsigned char* mask, const float* X,
+        const uint32_t* rand, uint32_t threshold, float scale, size_t N) nogil:
+    cdef unsigned char keep
+    for i in range(N):
+        # Avoid branching, as the outcome is random.
+        keep = rand[i] >= threshold
+        mask[i] = keep
+        Y[i] = X[i] * (scale * keep)
 
-            # If the left window is cut short, we want to
-            # start by the same amount in the output.
-            out_offset = d_seqs_begin - window_begin
 
-            VecVec.add_i(&d_seqs[d_seqs_begin * I],
-                         &d_cols[(j * nF * I) + (out_offset * I)],
-                         1., n_elems * I)
+cdef void cpu_layer_norm(float* Y__bo, float* mean__b, float* rstd__b,
+        const float* X__bo, const float* G__o, const float* b__o, float eps,
+        int B, int O, int n_threads) nogil:
+    cdef int i
+    for i in prange(B, num_threads=n_threads, schedule="static"):
+        _layer_norm_row(&Y__bo[i*O], &mean__b[i], &rstd__b[i],
+            &X__bo[i*O], G__o, b__o, eps, O)
+
+
+cdef void _layer_norm_row(float* Y, float* mean_out, float* rstd_out,
+        const float* X, const float* G, const float* b, float eps, int O) nogil:
+    # Single pass over the row: sum the values and their squares, shifted by
+    # the first value so that large offsets don't cancel out. Unlike Welford's
+    # update, this needs no division per value.
+    cdef double shift = X[0]
+    cdef double total = 0.
+    cdef double sq_total = 0.
+    cdef double d
+    cdef int j
+    for j in range(O):
+        d = X[j] - shift
+        total += d
+        sq_total += d * d
+    cdef double mean = shift + total / O
+    cdef double m2 = sq_total - total * total / O
+    if m2 < 0.:
+        m2 = 0.
+    cdef float rstd = 1. / sqrt(m2 / O + eps)
+    cdef float mean_f = mean
+    for j in range(O):
+        Y[j] = (X[j] - mean_f) * rstd * G[j] + b[j]
+    mean_out[0] = mean_f
+    rstd_out[0] = rstd
+
+
+cdef void cpu_backprop_layer_norm(float* dX__bo, float* dG__o, float* db__o,
+        const float* dY__bo, const float* X__bo, const float* G__o,
+        const float* mean__b, const float* rstd__b,
+        int B, int O, int n_threads) nogil:
+    cdef int i, j
+    cdef float xhat
+    for i in prange(B, num_threads=n_threads, schedule="static"):
+        _backprop_layer_norm_row(&dX__bo[i*O], &dY__bo[i*O], &X__bo[i*O],
+            G__o, mean__b[i], rstd__b[i], O)
+    # The parameter gradients sum over the rows, so they're computed serially.
+    for i in range(B):
+        for j in range(O):
+            xhat = (X__bo[i*O+j] - mean__b[i]) * rstd__b[i]
+            dG__o[j] += dY__bo[i*O+j] * xhat
+            db__o[j] += dY__bo[i*O+j]
+
+
+cdef void _backprop_layer_norm_row(float* dX, const float* dY, const float* X,
+        const float* G, float mean, float rstd, int O) nogil:
+    cdef double sum_dxhat = 0.
+    cdef double sum_dxhat_xhat = 0.
+    cdef float xhat, dxhat
+    cdef int j
+    for j in range(O):
+        xhat = (X[j] - mean) * rstd
+        dxhat = dY[j] * G[j]
+        sum_dxhat += dxhat
+        sum_dxhat_xhat += dxhat * xhat
+    cdef float mean_dxhat = sum_dxhat / O
+    cdef float mean_dxhat_xhat = sum_dxhat_xhat / O
+    for j in range(O):
+        xhat = (X[j] - mean) * rstd
+        dX[j] = (dY[j] * G[j] - mean_dxhat - xhat * mean_dxhat_xhat) * rstd
+
+
+cdef enum:
+    ACT_RELU
+    ACT_GELU
+    ACT_SWISH
+    ACT_HARD_SWISH
+    ACT_HARD_SWISH_MOBILENET
+    ACT_MISH
+    # Not supported by affine_act.
+    ACT_GELU_APPROX
+    ACT_ERF
+
+
+_AFFINE_ACT_CODES = {
+    "relu": ACT_RELU,
+    "gelu": ACT_GELU,
+    "swish": ACT_SWISH,
+    "hard_swish": ACT_HARD_SWISH,
+    "hard_swish_mobilenet": ACT_HARD_SWISH_MOBILENET,
+    "mish": ACT_MISH,
+}
+
+
+cdef union _FloatBits:
+    float f
+    int32_t i
+
+
+# The activations below are written without branches or calls to libm, so
+# that the compiler can vectorize the loops over them. The constants are
+# declared as floats, as Cython makes numeric literals doubles.
+
+# The input range of _exp, in which the result is a normal float. These are
+# globals rather than constants, as GCC otherwise specializes the callers for
+# clamped inputs, and computes denormals in every lane of that path.
+cdef float _EXP_HI = 88.3
+cdef float _EXP_LO = -87.3
+
+
+cdef inline float _exp(float x) nogil:
+    # exp(x) = 2**n * exp(r), with |r| <= ln(2) / 2 and exp(r) approximated
+    # by the polynomial from Cephes' expf.
+    cdef float one = 1.
+    x = x if x < _EXP_HI else _EXP_HI
+    x = x if x > _EXP_LO else _EXP_LO
+    # Round x / ln(2) to the nearest integer, by adding 1.5 * 2**23.
+    cdef float magic = 12582912.
+    cdef _FloatBits t
+    t.f = x * <float>1.44269504088896341 + magic
+    cdef float n = t.f - magic
+    cdef float r = x - n * <float>0.693359375 + n * <float>2.12194440e-4
+    cdef float y = <float>1.9875691500e-4 * r + <float>1.3981999507e-3
+    y = y * r + <float>8.3334519073e-3
+    y = y * r + <float>4.1665795894e-2
+    y = y * r + <float>1.6666665459e-1
+    y = y * r + <float>5.0000001201e-1
+    y = y * r * r + r + one
+    cdef _FloatBits scale
+    scale.i = (t.i - 0x4B400000 + 127) << 23
+    return y * scale.f
+
+
+cdef inline float _sigmoid(float x) nogil:
+    cdef float one = 1.
+    return one / (one + _exp(-x))
 
-        seq_start += L[i]
+
+cdef inline float _erf(float x) nogil:
+    # Abramowitz and Stegun 7.1.26, as in Ops.erf.
+    cdef float zero = 0.
+    cdef float one = 1.
+    cdef float a = x if x >= zero else -x
+    cdef float t = one / (one + <float>0.3275911 * a)
+    cdef float y = <float>1.061405429 * t - <float>1.453152027
+    y = y * t + <float>1.421413741
+    y = y * t - <float>0.284496736
+    y = y * t + <float>0.254829592
+    y = one - y * t * _exp(-a * a)
+    return y if x >= zero else -y
+
+
+cdef inline float _gelu(float x) nogil:
+    cdef float half = 0.5
+    cdef float one = 1.
+    return half * x * (one + _erf(x * <float>0.7071067811865476))
+
+
+cdef inline float _d_gelu(float x) nogil:
+    # The CDF plus x times the PDF of the standard normal distribution.
+    cdef float half = 0.5
+    cdef float one = 1.
+    cdef float pdf = <float>0.3989422804014327 * _exp(-half * x * x)
+    return half * (one + _erf(x * <float>0.7071067811865476)) + x * pdf
+
+
+cdef inline float _gelu_approx(float x) nogil:
+    # 0.5 * (1 + tanh(u)) == sigmoid(2 * u)
+    cdef float u = <float>0.7978845608028654 * (x + <float>0.044715 * x * x * x)
+    return x * _sigmoid(u + u)
+
+
+cdef inline float _d_gelu_approx(float x) nogil:
+    cdef float one = 1.
+    cdef float u = <float>0.7978845608028654 * (x + <float>0.044715 * x * x * x)
+    cdef float du = <float>0.7978845608028654 * (one + <float>0.134145 * x * x)
+    cdef float s = _sigmoid(u + u)
+    return s + (x + x) * s * (one - s) * du
+
+
+cdef inline float _hard_swish(float x) nogil:
+    cdef float zero = 0.
+    cdef float one = 1.
+    cdef float h = <float>0.2 * x + <float>0.5
+    h = h if h > zero else zero
+    h = h if h < one else one
+    return x * h
+
+
+cdef inline float _d_hard_swish(float x) nogil:
+    cdef float zero = 0.
+    cdef float one = 1.
+    cdef float limit = 2.5
+    cdef float d = <float>0.4 * x + <float>0.5
+    d = d if x <= limit else one
+    return d if x >= -limit else zero
+
+
+cdef inline float _hard_swish_mobilenet(float x) nogil:
+    cdef float zero = 0.
+    cdef float three = 3.
+    cdef float six = 6.
+    cdef float h = x + three
+    h = h if h > zero else zero
+    h = h if h < six else six
+    return x * h * <float>(1. / 6.)
+
+
+cdef inline float _d_hard_swish_mobilenet(float x) nogil:
+    cdef float zero = 0.
+    cdef float one = 1.
+    cdef float three = 3.
+    cdef float d = (x + x + three) * <float>(1. / 6.)
+    d = d if x <= three else one
+    return d if x >= -three else zero
+
+
+cdef inline float _mish(float x) nogil:
+    # tanh(softplus(x)) == n / (n + 2), with n = exp(x) * (exp(x) + 2). Above
+    # the threshold of Ops.mish, 20, mish is computed as the identity.
+    cdef float two = 2.
+    cdef float threshold = 20.
+    cdef float e = _exp(x)
+    cdef float n = e * (e + two)
+    return x * n / (n + two) if x < threshold else x
+
+
+cdef inline float _d_mish(float x) nogil:
+    cdef float one = 1.
+    cdef float two = 2.
+    cdef float four = 4.
+    cdef float threshold = 20.
+    cdef float e = _exp(x)
+    cdef float e2 = e * e
+    cdef float omega = four * (x + one) + four * e2 + e2 * e + e * (four * x + <float>6.)
+    cdef float delta = two * e + e2 + two
+    return e * omega / (delta * delta) if x < threshold else one
+
+
+cdef void _activate_chunk(float* Y, const float* X, int act, int N) nogil:
+    # A loop per activation, so that each one can be vectorized.
+    cdef float zero = 0.
+    cdef int i
+    if act == ACT_RELU:
+        for i in range(N):
+            Y[i] = X[i] if X[i] > zero else zero
+    elif act == ACT_GELU:
+        for i in range(N):
+            Y[i] = _gelu(X[i])
+    elif act == ACT_GELU_APPROX:
+        for i in range(N):
+            Y[i] = _gelu_approx(X[i])
+    elif act == ACT_SWISH:
+        for i in range(N):
+            Y[i] = X[i] * _sigmoid(X[i])
+    elif act == ACT_HARD_SWISH:
+        for i in range(N):
+            Y[i] = _hard_swish(X[i])
+    elif act == ACT_HARD_SWISH_MOBILENET:
+        for i in range(N):
+            Y[i] = _hard_swish_mobilenet(X[i])
+    elif act == ACT_MISH:
+        for i in range(N):
+            Y[i] = _mish(X[i])
+    elif act == ACT_ERF:
+        for i in range(N):
+            Y[i] = _erf(X[i])
+
+
+cdef void _backprop_activate_chunk(float* dX, const float* dY, const float* X,
+        const float* Y, int act, int N) nogil:
+    # Relu and swish use the output Y, the others the input X.
+    cdef float zero = 0.
+    cdef float one = 1.
+    cdef int i
+    if act == ACT_RELU:
+        for i in range(N):
+            dX[i] = dY[i] if Y[i] > zero else zero
+    elif act == ACT_GELU:
+        for i in range(N):
+            dX[i] = dY[i] * _d_gelu(X[i])
+    elif act == ACT_GELU_APPROX:
+        for i in range(N):
+            dX[i] = dY[i] * _d_gelu_approx(X[i])
+    elif act == ACT_SWISH:
+        for i in range(N):
+            dX[i] = dY[i] * (Y[i] + _sigmoid(X[i]) * (one - Y[i]))
+    elif act == ACT_HARD_SWISH:
+        for i in range(N):
+            dX[i] = dY[i] * _d_hard_swish(X[i])
+    elif act == ACT_HARD_SWISH_MOBILENET:
+        for i in range(N):
+            dX[i] = dY[i] * _d_hard_swish_mobilenet(X[i])
+    elif act == ACT_MISH:
+        for i in range(N):
+            dX[i] = dY[i] * _d_mish(X[i])
+
+
+cdef enum:
+    # The number of values per task of the elementwise kernels.
+    ACTIVATE_CHUNK = 4096
+
+
+cdef void cpu_activate(float* Y, const float* X, int act, int N,
+        int n_threads) nogil:
+    cdef int n_chunks = (N + ACTIVATE_CHUNK - 1) // ACTIVATE_CHUNK
+    cdef int i, start
+    for i in prange(n_chunks, num_threads=n_threads, schedule="static"):
+        start = i * ACTIVATE_CHUNK
+        _activate_chunk(&Y[start], &X[start], act, min(N - start, ACTIVATE_CHUNK))
+
+
+cdef void cpu_backprop_activate(float* dX, const float* dY, const float* X,
+        const float* Y, int act, int N, int n_threads) nogil:
+    cdef int n_chunks = (N + ACTIVATE_CHUNK - 1) // ACTIVATE_CHUNK
+    cdef int i, start
+    for i in prange(n_chunks, num_threads=n_threads, schedule="static"):
+        start = i * ACTIVATE_CHUNK
+        _backprop_activate_chunk(&dX[start], &dY[start], &X[start], &Y[start],
+            act, min(N - start, ACTIVATE_CHUNK))
+
+
+cdef void cpu_gemm_int8(int32_t* out, const int8_t* x, Py_ssize_t x_rs,
+        Py_ssize_t x_cs, bint trans1, const int8_t* y, Py_ssize_t y_rs,
+        Py_ssize_t y_cs, bint trans2, int M, int N, int K, int chunk,
+        float* x_f, float* y_f, float* out_f) nogil:
+    # Multiply chunks of the int8 arrays with the float32 gemm, which is exact
+    # for up to INT8_GEMM_CHUNK columns, and sum the chunks as int32. The
+    # chunks keep the layout of x and y, so that they're read sequentially.
+    cdef int start, size, i
+    if K == 0:
+        memset(out, 0, M * N * sizeof(int32_t))
+    start = 0
+    while start < K:
+        size = min(chunk, K - start)
+        if trans1:
+            _int8_to_float(x_f, &x[start * x_rs], x_rs, x_cs, size, M)
+        else:
+            _int8_to_float(x_f, &x[start * x_cs], x_rs, x_cs, M, size)
+        if trans2:
+            _int8_to_float(y_f, &y[start * y_cs], y_rs, y_cs, N, size)
+        else:
+            _int8_to_float(y_f, &y[start * y_rs], y_rs, y_cs, size, N)
+        blis.cy.gemm(blis.cy.TRANSPOSE if trans1 else blis.cy.NO_TRANSPOSE,
+            blis.cy.TRANSPOSE if trans2 else blis.cy.NO_TRANSPOSE,
+            M, N, size,
+            1.0,
+            x_f, M if trans1 else size, 1,
+            y_f, size if trans2 else N, 1,
+            0.0,
+            out_f, N, 1)
+        if start == 0:
+            for i in range(M * N):
+                out[i] = <int32_t>out_f[i]
+        else:
+            for i in range(M * N):
+                out[i] += <int32_t>out_f[i]
+        start += chunk
+
+
+cdef void _int8_to_float(float* dest, const int8_t* src, Py_ssize_t rs,
+        Py_ssize_t cs, int n_rows, int n_cols) nogil:
+    cdef int i, j
+    for i in range(n_rows):
+        for j in range(n_cols):
+            dest[i * n_cols + j] = src[i * rs + j * cs]
+
+
+cdef void cpu_affine_act(float* Y__bo, float* Z__bo, const float* b__o, int act,
+        int B, int O, int n_threads) nogil:
+    cdef int i
+    for i in prange(B, num_threads=n_threads, schedule="static"):
+        _affine_act_row(&Y__bo[i*O], &Z__bo[i*O], b__o, act, O)
+
+
+cdef void _affine_act_row(float* Y, float* Z, const float* b, int act,
+        int O) nogil:
+    # Add the bias to a row of the gemm output Z, and apply the activation
+    # while the row is still in cache. If Y and Z are different, Z keeps the
+    # pre-activation values.
+    cdef int j
+    for j in range(O):
+        Z[j] += b[j]
+    _activate_chunk(Y, Z, act, O)
+
+
+cdef void cpu_backprop_affine_act(float* dZ__bo, float* db__o,
+        const float* dY__bo, const float* Y__bo, const float* Z__bo, int act,
+        int B, int O, int n_threads) nogil:
+    cdef int i
+    for i in prange(B, num_threads=n_threads, schedule="static"):
+        _backprop_activate_chunk(&dZ__bo[i*O], &dY__bo[i*O], &Z__bo[i*O],
+            &Y__bo[i*O], act, O)
+    # The bias gradient sums over the rows, so it's computed serially.
+    for i in range(B):
+        VecVec.add_i(db__o, &dZ__bo[i*O], 1., O)
+
+
+cdef void cpu_affine_maxout(float* best__bo, int* which__bo,
+        const float* Z__bop, const float* b__op, int B, int O, int P,
+        int n_threads) nogil:
+    cdef int i
+    for i in prange(B, num_threads=n_threads, schedule="static"):
+        _affine_maxout_row(&best__bo[i*O], &which__bo[i*O], &Z__bop[i*O*P],
+            b__op, O, P)
+
+
+cdef void _affine_maxout_row(float* best, int* which, const float* Z,
+        const float* b, int O, int P) nogil:
+    # Add the bias to the gemm output while looking for the best piece.
+    cdef int o, p, best_p
+    cdef float z, best_z
+    for o in range(O):
+        best_z = Z[o*P] + b[o*P]
+        best_p = 0
+        for p in range(1, P):
+            z = Z[o*P+p] + b[o*P+p]
+            if z > best_z:
+                best_z = z
+                best_p = p
+        best[o] = best_z
+        which[o] = best_p
 
 
 cdef void cpu_maxout(float* best__bo, int* which__bo,
-        const float* cands__bop, int B, int O, int P) nogil:
-    for i in range(B*O):
+        const float* cands__bop, int B, int O, int P, int n_threads) nogil:
+    cdef int i
+    for i in prange(B*O, num_threads=n_threads, schedule="static"):
         which__bo[i] = Vec.arg_max(&cands__bop[i*P], P)
         best__bo[i] = cands__bop[i*P + which__bo[i]]
 
 
 cdef void cpu_backprop_maxout(float* dX__bop,
-        const float* dX__bo, const int* which__bo, int B, int O, int P) nogil:
-    for b in range(B):
-        for o in range(O):
-            dX__bop[which__bo[0]] = dX__bo[0]
-            dX__bop += P
-            dX__bo += 1
-            which__bo += 1
+        const float* dX__bo, const int* which__bo, int B, int O, int P,
+        int n_threads) nogil:
+    cdef int i
+    for i in prange(B*O, num_threads=n_threads, schedule="static"):
+        dX__bop[i*P + which__bo[i]] = dX__bo[i]
 
 
 def cpu_clip_gradient(weight_t[::1] gradient, weight_t threshold):
@@ -586,6 +1398,75 @@ cdef void _adam_momentum(weight_t* gradient, weight_t* mom1, weight_t* mom2,
         idx += step_size
 
 
+cdef void cpu_adam_update(float* W, float* dW, float* M1, float* M2, float* A,
+        int N, float beta1, float beta2, float eps, float learn_rate, float L2,
+        float weight_decay, float grad_clip, float average_decay,
+        bint use_mom2) nogil:
+    # Adam in one pass over the weights, after a first pass for the gradient
+    # norm if the gradient is clipped. A may be NULL, if there are no averages.
+    # Like _adam_momentum, this works blockwise, so that the inner loops are
+    # simple enough to be vectorized.
+    cdef float one_minus_beta1 = 1 - beta1
+    cdef float one_minus_beta2 = 1 - beta2
+    cdef float one_minus_decay = 1 - average_decay
+    cdef float scale = 1.0
+    cdef double norm = 0.0
+    cdef float g
+    cdef float[64] grad
+    cdef float[64] buff
+    cdef int i, j, n
+    if grad_clip > 0:
+        for i in range(N):
+            g = dW[i] + L2 * W[i]
+            norm += g * g
+        norm = sqrt(norm)
+        if norm >= grad_clip:
+            scale = grad_clip / norm
+    cdef float* w
+    cdef float* dw
+    cdef float* m1
+    cdef float* m2
+    cdef float* a
+    for i in range(0, N, 64):
+        n = min(64, N - i)
+        w = &W[i]
+        dw = &dW[i]
+        m1 = &M1[i]
+        m2 = &M2[i]
+        for j in range(n):
+            grad[j] = (dw[j] + L2 * w[j]) * scale
+        memset(dw, 0, n * sizeof(float))
+        for j in range(n):
+            m1[j] = beta1 * m1[j] + one_minus_beta1 * grad[j]
+        for j in range(n):
+            m2[j] = beta2 * m2[j] + one_minus_beta2 * grad[j] * grad[j]
+        if use_mom2:
+            for j in range(n):
+                buff[j] = sqrtf(m2[j])
+            for j in range(n):
+                buff[j] = m1[j] / (buff[j] + eps)
+        else:
+            for j in range(n):
+                buff[j] = m1[j]
+        for j in range(n):
+            w[j] -= learn_rate * buff[j]
+        if weight_decay != 0:
+            for j in range(n):
+                w[j] -= weight_decay * w[j]
+        if A != NULL:
+            a = &A[i]
+            for j in range(n):
+                a[j] -= one_minus_decay * (a[j] - w[j])
+
+
+def _is_contig_float32(arr):
+    return (
+        isinstance(arr, numpy.ndarray)
+        and arr.dtype == numpy.float32
+        and arr.flags["C_CONTIGUOUS"]
+    )
+
+
 @cython.cdivision(True)
 cdef void cpu_update_averages(weight_t* ema,
         const weight_t* weights, int nr_weight, weight_t t, weight_t max_decay) nogil:
@@ -598,9 +1479,11 @@ cdef void cpu_update_averages(weight_t* ema,
         ema[i] -= one_minus_decay * (ema[i] - weights[i])
 
 
-cdef void cpu_mish(weight_t* Y, const weight_t* X, float threshold, int N) nogil:
+cdef void cpu_mish(weight_t* Y, const weight_t* X, float threshold, int N,
+        int n_threads) nogil:
     cdef float one = 1.
-    for i in range(N):
+    cdef int i
+    for i in prange(N, num_threads=n_threads, schedule="static"):
         if X[i] >= threshold:
             Y[i] = X[i]
         else:
@@ -608,10 +1491,12 @@ cdef void cpu_mish(weight_t* Y, const weight_t* X, float threshold, int N) nogil
 
 
 cdef void cpu_backprop_mish(weight_t* dX,
-        const weight_t* dY, const weight_t* X, float threshold, int N) nogil:
+        const weight_t* dY, const weight_t* X, float threshold, int N,
+        int n_threads) nogil:
     cdef float one = 1.
-    cdef float exp_x, exp_2x, exp_3x, omega, delta
-    for i in range(N):
+    cdef float x, exp_x, exp_2x, exp_3x, omega, delta
+    cdef int i
+    for i in prange(N, num_threads=n_threads, schedule="static"):
         x = X[i]
         if x >= threshold:
             dX[i] = dY[i]
@@ -624,134 +1509,118 @@ cdef void cpu_backprop_mish(weight_t* dX,
             dX[i] = dY[i] * ((exp_x * omega) / (delta * delta))
 
 
-cdef cpu_floats_ptr2array(float* ptr, shape):
-    cdef np.ndarray py_out = numpy.zeros(shape, dtype='float32')
-    cdef int N = numpy.prod(shape)
-    memcpy(py_out.data, ptr, N * sizeof(ptr[0]))
-    return py_out
-
-
-cdef cpu_ints_ptr2array(int* ptr, shape):
-    cdef np.ndarray py_out = numpy.zeros(shape, dtype='int32')
-    cdef int N = numpy.prod(shape)
-    memcpy(py_out.data, ptr, N * sizeof(ptr[0]))
-    return py_out
-
-
 cdef void cpu_reduce_mean(float* means__bo,
         const float* X__to, const int* lengths__b,
-        int B, int T, int O) nogil:
+        int B, int T, int O, int n_threads, int* offsets) nogil:
     '''Compute means of a batch of concatenated sequences, using the lengths.'''
-    cdef float scale = 0.
-    for length in lengths__b[:B]:
-        scale = 1. / length
-        for _ in range(length):
-            VecVec.add_i(means__bo,
-                X__to, scale, O)
-            X__to += O
-        means__bo += O
+    cdef int b, t
+    cdef float scale
+    _fill_seq_offsets(offsets, lengths__b, B)
+    for b in prange(B, num_threads=n_threads, schedule="static"):
+        scale = 1. / lengths__b[b]
+        for t in range(offsets[b], offsets[b] + lengths__b[b]):
+            VecVec.add_i(&means__bo[b*O],
+                &X__to[t*O], scale, O)
 
 
 cdef void cpu_backprop_reduce_mean(float* dX__to,
         const float* d_means__bo, const int* lengths__b,
-        int B, int T, int O) nogil:
-    cdef float scale = 0.
-    for length in lengths__b[:B]:
-        scale = 1./ length
-        for _ in range(length):
-            VecVec.add_i(dX__to,
-                d_means__bo, scale, O)
-            dX__to += O
-        d_means__bo += O
+        int B, int T, int O, int n_threads, int* offsets) nogil:
+    cdef int b, t
+    cdef float scale
+    _fill_seq_offsets(offsets, lengths__b, B)
+    for b in prange(B, num_threads=n_threads, schedule="static"):
+        scale = 1. / lengths__b[b]
+        for t in range(offsets[b], offsets[b] + lengths__b[b]):
+            VecVec.add_i(&dX__to[t*O],
+                &d_means__bo[b*O], scale, O)
 
 
 cdef void cpu_reduce_sum(float* sums__bo,
         const float* X__to, const int* lengths__b,
-        int B, int T, int O) nogil:
+        int B, int T, int O, int n_threads, int* offsets) nogil:
     '''Compute sums of a batch of concatenated sequences, using the lengths.'''
-    for length in lengths__b[:B]:
-        for _ in range(length):
-            VecVec.add_i(sums__bo,
-                X__to, 1.0, O)
-            X__to += O
-        sums__bo += O
+    cdef int b, t
+    _fill_seq_offsets(offsets, lengths__b, B)
+    for b in prange(B, num_threads=n_threads, schedule="static"):
+        for t in range(offsets[b], offsets[b] + lengths__b[b]):
+            VecVec.add_i(&sums__bo[b*O],
+                &X__to[t*O], 1.0, O)
 
 
 cdef void cpu_backprop_reduce_sum(float* dX__to,
         const float* d_sums__bo, const int* lengths__b,
-        int B, int T, int O) nogil:
-    for length in lengths__b[:B]:
-        for _ in range(length):
-            VecVec.add_i(dX__to,
-                d_sums__bo, 1.0, O)
-            dX__to += O
-        d_sums__bo += O
+        int B, int T, int O, int n_threads, int* offsets) nogil:
+    cdef int b, t
+    _fill_seq_offsets(offsets, lengths__b, B)
+    for b in prange(B, num_threads=n_threads, schedule="static"):
+        for t in range(offsets[b], offsets[b] + lengths__b[b]):
+            VecVec.add_i(&dX__to[t*O],
+                &d_sums__bo[b*O], 1.0, O)
 
 
 cdef void cpu_reduce_max(float* maxes__bo, int* which__bo,
         const float* X__to, const int* lengths__b,
-        int B, int T, int O) nogil:
+        int B, int T, int O, int n_threads, int* offsets) nogil:
     '''Compute maxes of a batch of concatenated sequences, using the lengths.'''
-    cdef float scale = 0.
-    for length in lengths__b[:B]:
-        memcpy(maxes__bo, X__to, O * sizeof(maxes__bo[0]))
-        memset(which__bo, 0, O * sizeof(which__bo[0]))
-        X__to += O
-        for i in range(1, length):
+    cdef int b, i, j
+    _fill_seq_offsets(offsets, lengths__b, B)
+    for b in prange(B, num_threads=n_threads, schedule="static"):
+        if lengths__b[b] == 0:
+            continue
+        memcpy(&maxes__bo[b*O], &X__to[offsets[b]*O], O * sizeof(maxes__bo[0]))
+        memset(&which__bo[b*O], 0, O * sizeof(which__bo[0]))
+        for i in range(1, lengths__b[b]):
             for j in range(O):
-                if X__to[j] > maxes__bo[j]:
-                    maxes__bo[j] = X__to[j]
-                    which__bo[j] = i
-            X__to += O
-        maxes__bo += O
-        which__bo += O
+                if X__to[(offsets[b]+i)*O + j] > maxes__bo[b*O + j]:
+                    maxes__bo[b*O + j] = X__to[(offsets[b]+i)*O + j]
+                    which__bo[b*O + j] = i
 
 
 cdef void cpu_backprop_reduce_max(float* dX__to,
         const float* d_maxes__bo, const int* which__bo, const int* lengths__b,
-        int B, int T, int O) nogil:
-    cdef int length, i, j
-    for length in lengths__b[:B]:
-        for i in range(length):
+        int B, int T, int O, int n_threads, int* offsets) nogil:
+    cdef int b, i, j
+    _fill_seq_offsets(offsets, lengths__b, B)
+    for b in prange(B, num_threads=n_threads, schedule="static"):
+        for i in range(lengths__b[b]):
             for j in range(O):
-                if which__bo[j] == i:
-                    dX__to[j] += d_maxes__bo[j]
-            dX__to += O
-        d_maxes__bo += O
-        which__bo += O
+                if which__bo[b*O + j] == i:
+                    dX__to[(offsets[b]+i)*O + j] += d_maxes__bo[b*O + j]
 
 
 def lstm_forward_training(
-    np.ndarray params, np.ndarray c_init, np.ndarray h_init,
+    np.ndarray params, np.ndarray h_init, np.ndarray c_init,
     np.ndarray X, np.ndarray lengths
 ):
     xp = numpy
-    depth = c_init.shape[0]
-    dirs = c_init.shape[1]
-    nO = c_init.shape[2]
-    N = X.shape[0]
-    nI = X.shape[1]
-    nT = lengths.shape[0]
+    cdef int depth = c_init.shape[0]
+    cdef int dirs = c_init.shape[1]
+    cdef int nO = c_init.shape[2]
+    cdef int N = X.shape[0]
+    cdef int nI = X.shape[1]
+    cdef int nT = lengths.shape[0]
     cdef int batch_size = lengths[0]
     # Preallocate these so we can pass them through for loop.
-    cdef np.ndarray G = xp.zeros((depth, dirs, X.shape[0], nO * 4), dtype="f")
-    cdef np.ndarray Y = xp.zeros((depth, dirs, X.shape[0], nO), dtype="f")
-    cdef np.ndarray C = xp.zeros((depth, dirs, X.shape[0], nO), dtype="f")
+    cdef np.ndarray G = xp.zeros((depth, dirs, N, nO * 4), dtype="f")
+    cdef np.ndarray Y = xp.zeros((depth, dirs, N, nO), dtype="f")
+    cdef np.ndarray C = xp.zeros((depth, dirs, N, nO), dtype="f")
     cdef np.ndarray Yt2 = numpy.zeros((batch_size, nO), dtype="f")
     cdef np.ndarray Ct2 = numpy.zeros((batch_size, nO), dtype="f")
+    cdef np.ndarray lengths_ = numpy.ascontiguousarray(lengths, dtype="int32")
 
     cdef int params_i = 0
-    cdef int seq_i = 0
     orig_X = X
-    cdef int i
+    cdef np.ndarray Xi = numpy.ascontiguousarray(X, dtype="f")
     cdef np.ndarray Yid
     cdef np.ndarray Cid
     cdef np.ndarray Gid
     cdef np.ndarray Wx
     cdef np.ndarray Wh
     cdef np.ndarray bias
+    cdef int i, d
     for i in range(depth):
-        nI = X.shape[1]
+        nI = Xi.shape[1]
         for d in range(dirs):
             # The inits are shaped (depth, dirs, nO). We add the internal dimension
             # to make them set correctly.
@@ -762,92 +1631,142 @@ def lstm_forward_training(
             Yid = Y[i, d]
             Cid = C[i, d]
             Gid = G[i, d]
-            _lstm_forward_training(
-                d, N, nO, nI, nT, 
-                Gid,
-                <float*>Yid.data,
-                <float*>Cid.data,
-                <float*>X.data,
-                <float*>Wx.data,
-                <float*>Wh.data,
-                bias,
-                <int*>lengths.data,
-                <float*>Yt2.data,
-                <float*>Ct2.data
-            )
+            with nogil:
+                cpu_lstm_forward(d, N, nO, nI, nT,
+                    <float*>Gid.data,
+                    <float*>Yid.data, nO,
+                    <float*>Cid.data,
+                    <const float*>Xi.data,
+                    <const float*>Wx.data,
+                    <const float*>Wh.data,
+                    <const float*>bias.data,
+                    <const int*>lengths_.data,
+                    <float*>Yt2.data,
+                    <float*>Ct2.data
+                )
         H = Y[i].transpose((1, 0, 2)).reshape((N, -1))
-        if dirs == 2:
-            H = xp.ascontiguousarray(H)
-        X = H
-    return H, (Y, G, C, orig_X)
+        Xi = numpy.ascontiguousarray(H)
+    # The initial states are kept so that the backward pass can compute the
+    # gradients of the first step of each sequence.
+    return Xi, (Y, G, C, orig_X, h_init, c_init)
+
 
+def lstm_forward_inference(
+    np.ndarray params, np.ndarray h_init, np.ndarray c_init,
+    np.ndarray X, np.ndarray lengths
+):
+    """Run the LSTM without keeping the per-layer states that the backward
+    pass needs. The gates and cells are computed in buffers that are shared
+    by all layers and directions, and the hidden states are written directly
+    into the output array, so the memory use doesn't grow with the depth.
+    """
+    cdef int depth = c_init.shape[0]
+    cdef int dirs = c_init.shape[1]
+    cdef int nO = c_init.shape[2]
+    cdef int N = X.shape[0]
+    cdef int nI = X.shape[1]
+    cdef int nT = lengths.shape[0]
+    cdef int batch_size = lengths[0]
+    cdef np.ndarray G = numpy.zeros((N, nO * 4), dtype="f")
+    cdef np.ndarray C = numpy.zeros((N, nO), dtype="f")
+    cdef np.ndarray Yt2 = numpy.zeros((batch_size, nO), dtype="f")
+    cdef np.ndarray Ct2 = numpy.zeros((batch_size, nO), dtype="f")
+    cdef np.ndarray lengths_ = numpy.ascontiguousarray(lengths, dtype="int32")
+    # Alternate between two output buffers: layer i reads the output of
+    # layer i-1 and writes into the other one.
+    outputs = [numpy.zeros((N, dirs * nO), dtype="f") for _ in range(min(depth, 2))]
 
-cdef int _lstm_forward_training(
+    cdef int params_i = 0
+    cdef np.ndarray Xi = numpy.ascontiguousarray(X, dtype="f")
+    cdef np.ndarray H
+    cdef np.ndarray Wx
+    cdef np.ndarray Wh
+    cdef np.ndarray bias
+    cdef int i, d
+    for i in range(depth):
+        nI = Xi.shape[1]
+        H = outputs[i % 2]
+        for d in range(dirs):
+            Yt2[:] = h_init[i, d].reshape((1, nO))
+            Ct2[:] = c_init[i, d].reshape((1, nO))
+            layer_params, params_i = _split_weights(params, i, nO, nI, params_i)
+            Wx, Wh, bias = _transpose_weights(layer_params)
+            with nogil:
+                cpu_lstm_forward(d, N, nO, nI, nT,
+                    <float*>G.data,
+                    &(<float*>H.data)[d * nO], dirs * nO,
+                    <float*>C.data,
+                    <const float*>Xi.data,
+                    <const float*>Wx.data,
+                    <const float*>Wh.data,
+                    <const float*>bias.data,
+                    <const int*>lengths_.data,
+                    <float*>Yt2.data,
+                    <float*>Ct2.data
+                )
+        Xi = H
+    return Xi
+
+
+cdef void cpu_lstm_forward(
     int d, int N, int nO, int nI, int nT,
-    np.ndarray G,
-    float* Y,
+    float* G,
+    float* Y, int ldy,
     float* C,
-    float* X,
-    float* Wx,
-    float* Wh,
-    np.ndarray bias,
-    int* lengths,
+    const float* X,
+    const float* Wx,
+    const float* Wh,
+    const float* bias,
+    const int* lengths,
     float* Yt2,
     float* Ct2,
-) except -1:
-    cdef double one = 1.0
+) nogil:
+    """Run one direction of one LSTM layer over a packed batch. The hidden
+    states are written into Y with a row stride of ldy, so that the directions
+    can be interleaved in the output. Yt2 and Ct2 must hold the initial states,
+    and are used as scratch space for the previous step.
+    """
+    cdef int nG = nO * 4
+    cdef int b, t, batch_size
+    cdef int seq_i = 0 if d == 0 else N
+    # Start the gates from the bias, so that the input-to-gates projection of
+    # the whole batch can be accumulated into them with a single gemm.
+    for b in range(N):
+        memcpy(&G[b * nG], bias, nG * sizeof(G[0]))
     blis.cy.gemm(blis.cy.NO_TRANSPOSE, blis.cy.TRANSPOSE,
-        N, nO*4, nI,
-        one,
-        X, nI, 1,
-        Wx, nI, 1,
-        one,
-        <float*>G.data, nO*4, 1
+        N, nG, nI,
+        1.0,
+        <float*>X, nI, 1,
+        <float*>Wx, nI, 1,
+        1.0,
+        G, nG, 1
     )
-    cdef int t, batch_size
-    cdef int seq_i = 0 if d == 0 else N
-    cdef int i, j
-    cdef np.ndarray Gt3_
     for t in range(nT):
         if d == 0:
             batch_size = lengths[t]
         else:
             batch_size = lengths[nT-(t+1)]
             seq_i -= batch_size
-        # Prepare the inputs
-        Yt3 = &Y[seq_i*nO]
-        Ct3 = &C[seq_i*nO]
-        Gt3_ = G[seq_i : seq_i+batch_size]
-        Gt3 = <float*>Gt3_.data
-        # Now do the actual calculation
+        # Gt3 += Yt2 @ Wh.T
         blis.cy.gemm(blis.cy.NO_TRANSPOSE, blis.cy.TRANSPOSE,
-            batch_size, nO*4, nO,
-            one,
+            batch_size, nG, nO,
+            1.0,
             Yt2, nO, 1,
-            Wh, nO, 1,
-            one,
-            Gt3, nO*4, 1
+            <float*>Wh, nO, 1,
+            1.0,
+            &G[seq_i * nG], nG, 1
         )
-        # This is super weird: if we remove this add, it gets slower? I guess
-        # it does cache prefetching or something?
-        # It's annoying though --- it means I can't really refactor further,
-        # because speed goes down if I remove this.
-        Gt3_ += bias
-        #for i in range(batch_size):
-        #    for j in range(nO*4):
-        #        Gt3[i*nO*4+j] += bias[j]
-        cpu_lstm_activate_fwd(Gt3,
-            batch_size, nO)
-        cpu_lstm_gates_fwd(Yt3, Ct3,
-            Gt3, Ct2, batch_size, nO)
-        if d == 0:
-            seq_i += batch_size
+        cpu_lstm_gates_fwd(&Y[seq_i * ldy], ldy, &C[seq_i * nO],
+            &G[seq_i * nG], Ct2, batch_size, nO)
         # We need to keep a full-sized array here, padded with the sequence-start
         # values. This isn't necessary for the l2r part, but for the r2l part
         # it's necessary, as we otherwise would have the previous step smaller
         # than the current.
-        memcpy(Yt2, Yt3, sizeof(Yt3[0]) * batch_size * nO)
-        memcpy(Ct2, Ct3, sizeof(Ct3[0]) * batch_size * nO)
+        for b in range(batch_size):
+            memcpy(&Yt2[b * nO], &Y[(seq_i + b) * ldy], nO * sizeof(Y[0]))
+        memcpy(Ct2, &C[seq_i * nO], batch_size * nO * sizeof(C[0]))
+        if d == 0:
+            seq_i += batch_size
 
 
 def backprop_lstm(np.ndarray dY, np.ndarray lengths, np.ndarray params, fwd_state):
@@ -862,108 +1781,97 @@ def backprop_lstm(np.ndarray dY, np.ndarray lengths, np.ndarray params, fwd_stat
     cdef np.ndarray Wx, Wh, bias
     cdef np.ndarray dWx, dWh, d_bias
     cdef np.ndarray dYid
-    Y, G, C, X = fwd_state
+    cdef np.ndarray hid, cid
+    Y, G, C, X, h_init, c_init = fwd_state
     cdef int depth = C.shape[0]
     cdef int dirs = C.shape[1]
     cdef int N = C.shape[2]
     cdef int nO = C.shape[3]
     cdef int nI = X.shape[1]
-    cdef int batch_size = lengths[0]
     cdef int nT = lengths.shape[0]
+    cdef np.ndarray lengths_ = numpy.ascontiguousarray(lengths, dtype="int32")
+    cdef int batch_size = lengths_.max() if nT else 0
     # We don't need to store all the cells for all the layers.
-    cdef np.ndarray dC = xp.zeros((N, nO), dtype=C.dtype)
-    cdef np.ndarray dG = xp.zeros((N, nO*4), dtype=C.dtype)
-    cdef np.ndarray d_params = xp.zeros((params.shape[0],), dtype=params.dtype)
+    cdef np.ndarray dC = xp.zeros((N, nO), dtype="f")
+    cdef np.ndarray dG = xp.zeros((N, nO*4), dtype="f")
+    # Scratch space for the previous step's states and the cell gradient.
+    cdef np.ndarray Yt2 = xp.zeros((batch_size, nO), dtype="f")
+    cdef np.ndarray Ct2 = xp.zeros((batch_size, nO), dtype="f")
+    cdef np.ndarray dCt2 = xp.zeros((batch_size, nO), dtype="f")
     # Collect the params and slices. It makes it a bit easier to get the indexing
     # right, when we're iterating backwards.
     params_i = 0
     all_layer_params = []
+    all_layer_grads = []
     for i in range(depth):
         all_layer_params.append([])
+        all_layer_grads.append([])
         n_inputs = nI if i == 0 else (nO * dirs)
         for d in range(dirs):
             layer_params, params_i = _split_weights(params, i, nO, n_inputs, params_i)
             layer_params = _transpose_weights(layer_params)
-            all_layer_params[-1].append((layer_params, params_i))
-    params_i = 0
-    all_layer_grads = []
-    for i in range(depth):
-        all_layer_grads.append([])
-        n_inputs = nI if i == 0 else (nO * dirs)
-        for d in range(dirs):
-            layer_grads, params_i = _split_weights(params, i, nO, n_inputs, params_i)
-            layer_grads = _transpose_weights(layer_grads)
-            all_layer_grads[-1].append((layer_grads, params_i))
-    # Similarly, we want to compute the indices first
-    indices = []
-    seq_i = 0
-    for batch_size in lengths:
-        indices.append((seq_i, batch_size))
-        seq_i += batch_size
+            all_layer_params[-1].append(layer_params)
+            all_layer_grads[-1].append(tuple(xp.zeros_like(p) for p in layer_params))
 
     cdef np.ndarray dX
     Xs = [X] + [Y[i].transpose(1, 0, 2).reshape((N, -1)) for i in range(depth-1)]
-    dXs = [xp.zeros((X.shape[0], X.shape[1]), dtype=X.dtype) for X in Xs]
+    Xs = [numpy.ascontiguousarray(X_, dtype="f") for X_ in Xs]
+    dXs = [xp.zeros((X_.shape[0], X_.shape[1]), dtype="f") for X_ in Xs]
     # Okay, now do the actual looping
     for i in reversed(range(depth)):
-        dY = dY.reshape((N, dirs, nO)).transpose((1, 0, 2))
+        # Copy, as the gradient of the hiddens is accumulated into this
+        # array over the timesteps.
+        dY = dY.reshape((N, dirs, nO)).transpose((1, 0, 2)).astype("f", order="C")
         dX = dXs[i]
         X = Xs[i]
-        if dirs >= 2:
-            dY = numpy.ascontiguousarray(dY)
         for d in range(dirs):
-            Wx, Wh, bias = all_layer_params[i][d][0]
-            dWx, dWh, d_bias = all_layer_grads[i][d][0]
+            Wx, Wh, bias = all_layer_params[i][d]
+            dWx, dWh, d_bias = all_layer_grads[i][d]
             assert Wx.shape[1] == dWx.shape[1] == X.shape[1] == dX.shape[1], (Wx.shape[1], dWx.shape[1], X.shape[1], dX.shape[1])
-            dYid = dY[d] 
+            dYid = dY[d]
             dC.fill(0.)
             dG.fill(0.)
             Cid = C[i, d]
             Gid = G[i, d]
             Yid = Y[i, d]
+            hid = numpy.ascontiguousarray(h_init[i, d], dtype="f")
+            cid = numpy.ascontiguousarray(c_init[i, d], dtype="f")
             assert (Cid.shape[0], Cid.shape[1]) == (N, nO)
             assert (Yid.shape[0], Yid.shape[1]) == (N, nO)
             assert (Gid.shape[0], Gid.shape[1]) == (N, nO*4)
             assert (dYid.shape[0], dYid.shape[1]) == (N, nO)
-            assert (dC.shape[0], dC.shape[1]) == (N, nO)
-            assert (dG.shape[0], dG.shape[1]) == (N, nO*4)
-            _lstm_backward_training(d, N, nO, dX.shape[1], nT,
-                <float*>dX.data,
-                <float*>dYid.data,
-                <float*>dC.data,
-                <float*>dG.data,
-                <float*>dWx.data,
-                <float*>dWh.data,
-                <float*>d_bias.data,
-                <float*>Cid.data,
-                <float*>Gid.data, 
-                <float*>Yid.data,
-                <float*>X.data,
-                <float*>Wx.data,
-                <float*>Wh.data,
-                list(indices)
-            )
+            with nogil:
+                cpu_lstm_backward(d, N, nO, dX.shape[1], nT,
+                    <float*>dX.data,
+                    <float*>dYid.data,
+                    <float*>dC.data,
+                    <float*>dG.data,
+                    <float*>dWx.data,
+                    <float*>dWh.data,
+                    <float*>d_bias.data,
+                    <const float*>Cid.data,
+                    <const float*>Gid.data,
+                    <const float*>Yid.data,
+                    <const float*>X.data,
+                    <const float*>Wx.data,
+                    <const float*>Wh.data,
+                    <const int*>lengths_.data,
+                    <const float*>hid.data,
+                    <const float*>cid.data,
+                    <float*>Yt2.data,
+                    <float*>Ct2.data,
+                    <float*>dCt2.data
+                )
         dY = dX
     assert dX.shape[1] == X.shape[1]
     grad_parts = []
     for layer_grads in all_layer_grads:
-        for dir_grads, _ in layer_grads:
+        for dir_grads in layer_grads:
             grad_parts.append(_untranspose_unsplit_weights(dir_grads))
     return dX, numpy.concatenate(grad_parts)
 
 
-def _split_directions(X, dirs):
-    if dirs == 1:
-        return [X]
-    else:
-        X_ = X.reshape((X.shape[0], -1, dirs))
-        Xs = []
-        for d in range(dirs):
-            Xs.append(numpy.ascontiguousarray(X_[:, d]))
-        return Xs
-
-
-cdef int _lstm_backward_training(
+cdef void cpu_lstm_backward(
     int d, int N, int nO, int nI, int nT,
     float* dX,
     float* dY,
@@ -978,79 +1886,97 @@ cdef int _lstm_backward_training(
     const float* X,
     const float* Wx,
     const float* Wh,
-    indices,
-) except -1:
-    cdef int seq_t2
-    cdef int seq_t3
-    cdef double one = 1.0
-    if d == 0:
-        seq_t3, size_t3 = indices[-1]
-        indices = indices[:-1]
-        indices.reverse()
-    else:
-        seq_t3, size_t3 = indices[0]
-        indices = indices[1:]
-    cdef int batch_size
-    for seq_t2, size_t2 in indices:
-        dGt3 = &dG[seq_t3*nO*4]
-        dXt3 = &dX[seq_t3*nI]
-        dYt3 = &dY[seq_t3*nO]
-        dCt3 = &dC[seq_t3*nO]
-        dYt2 = &dY[seq_t2*nO]
-        dCt2 = &dC[seq_t2*nO]
-        Ct3 = &C[seq_t3*nO]
-        Gt3 = &G[seq_t3*nO*4]
-        Ct2 = &C[seq_t2*nO]
-        
-        batch_size = min(size_t2, size_t3)
-        cpu_lstm_gates_bwd(dGt3, dCt2,
-            dYt3, dCt3, Gt3, Ct3, Ct2, batch_size * nO
+    const int* lengths,
+    const float* h_init,
+    const float* c_init,
+    float* Yt2,
+    float* Ct2,
+    float* dCt2,
+) nogil:
+    """Backprop one direction of one LSTM layer. The timesteps are visited in
+    the reverse of the order the forward pass used. dY and dC receive the
+    gradients flowing back into the previous step, so dY is modified.
+    """
+    cdef int nG = nO * 4
+    cdef int step, t, t2, b, seq_t2, size_t2, size_t3, n_prev
+    cdef int seq_t3 = N if d == 0 else 0
+    for step in range(nT):
+        if d == 0:
+            t = nT - (step+1)
+            t2 = t - 1
+        else:
+            t = step
+            t2 = t + 1
+        size_t3 = lengths[t]
+        if d == 0:
+            seq_t3 -= size_t3
+        if 0 <= t2 < nT:
+            size_t2 = lengths[t2]
+            seq_t2 = seq_t3 - size_t2 if d == 0 else seq_t3 + size_t3
+            n_prev = min(size_t2, size_t3)
+        else:
+            seq_t2 = 0
+            n_prev = 0
+        # Gather the states the step started from: the previous step for the
+        # sequences that continue from it, and the initial state otherwise.
+        for b in range(size_t3):
+            if b < n_prev:
+                memcpy(&Yt2[b*nO], &Y[(seq_t2+b)*nO], nO * sizeof(Y[0]))
+                memcpy(&Ct2[b*nO], &C[(seq_t2+b)*nO], nO * sizeof(C[0]))
+            else:
+                memcpy(&Yt2[b*nO], h_init, nO * sizeof(Y[0]))
+                memcpy(&Ct2[b*nO], c_init, nO * sizeof(C[0]))
+        cpu_lstm_gates_bwd(&dG[seq_t3*nG], dCt2,
+            &dY[seq_t3*nO], &dC[seq_t3*nO], &G[seq_t3*nG], &C[seq_t3*nO], Ct2,
+            size_t3 * nO
         )
-        # Backprop hidden-to-hidden w.r.t. hidden.
-        #     dYt2 += dGt3 @ Wh
-        blis.cy.gemm(blis.cy.NO_TRANSPOSE, blis.cy.NO_TRANSPOSE,
-            batch_size, nO, nO*4,
-            one,
-            <float*>dGt3, nO*4, 1,
-            <float*>Wh, nO, 1,
-            one,
-            dYt2, nO, 1
+        # Backprop hidden-to-hidden w.r.t. weights.
+        #     dWh += dGt3.T @ Yt2
+        blis.cy.gemm(blis.cy.TRANSPOSE, blis.cy.NO_TRANSPOSE,
+            nG, nO, size_t3,
+            1.0,
+            &dG[seq_t3*nG], nG, 1,
+            Yt2, nO, 1,
+            1.0,
+            dWh, nO, 1
         )
-        seq_t3 = seq_t2
-        size_t3 = size_t2
+        if n_prev >= 1:
+            # Backprop hidden-to-hidden w.r.t. hidden.
+            #     dYt2 += dGt3 @ Wh
+            blis.cy.gemm(blis.cy.NO_TRANSPOSE, blis.cy.NO_TRANSPOSE,
+                n_prev, nO, nG,
+                1.0,
+                &dG[seq_t3*nG], nG, 1,
+                <float*>Wh, nO, 1,
+                1.0,
+                &dY[seq_t2*nO], nO, 1
+            )
+            memcpy(&dC[seq_t2*nO], dCt2, n_prev * nO * sizeof(dC[0]))
+        if d != 0:
+            seq_t3 += size_t3
 
     # Backprop input-to-hidden w.r.t. weights.
-    #     dWx += dG @ X
+    #     dWx += dG.T @ X
     blis.cy.gemm(blis.cy.TRANSPOSE, blis.cy.NO_TRANSPOSE,
-        nO*4, nI, N,
-        one,
-        <float*>dG, nO*4, 1,
+        nG, nI, N,
+        1.0,
+        dG, nG, 1,
         <float*>X, nI, 1,
-        one,
+        1.0,
         dWx, nI, 1
     )
-    # Backprop hidden-to-hidden w.r.t weights.
-    #     dWh += dG @ Y
-    blis.cy.gemm(blis.cy.TRANSPOSE, blis.cy.NO_TRANSPOSE,
-        nO*4, nO, N,
-        one,
-        <float*>dG, nO*4, 1,
-        <float*>Y, nO, 1,
-        one,
-        dWh, nO, 1
-    )
     # Backprop bias
-    for i in range(N):
-        for j in range(nO*4):
-            d_bias[j] += dG[i*nO*4+j]
+    for b in range(N):
+        VecVec.add_i(d_bias, &dG[b*nG], 1., nG)
 
     # Backprop input-to-hidden w.r.t. input
+    #     dX += dG @ Wx
     blis.cy.gemm(blis.cy.NO_TRANSPOSE, blis.cy.NO_TRANSPOSE,
-        N, nI, nO*4,
-        one,
-        <float*>dG, nO*4, 1,
+        N, nI, nG,
+        1.0,
+        dG, nG, 1,
         <float*>Wx, nI, 1,
-        one,
+        1.0,
         dX, nI, 1
     )
 
@@ -1082,9 +2008,9 @@ def _transpose_weights(params):
     Wh = Wh.transpose((1, 0, 2)).reshape((-1, Wh.shape[-1]))
     bh = bh.reshape((4, -1)).transpose((1, 0)).reshape((-1,))
     ascontig = numpy.ascontiguousarray
-    Wx = ascontig(Wx)
-    Wh = ascontig(Wh)
-    bias = ascontig(bx) + bh
+    Wx = ascontig(Wx, dtype="f")
+    Wh = ascontig(Wh, dtype="f")
+    bias = ascontig(bx + bh, dtype="f")
     return Wx, Wh, bias
 
 
@@ -1111,71 +2037,29 @@ cdef inline float dtanh(float y) nogil:
     return 1-y**2
 
 
-cdef void cpu_lstm_activate_fwd(float* gates, int B, int N) nogil:
-    """Apply sigmoid activation in-place to columns 0, 1, 2 and tanh to column 3.
-    The data is assumed to have the gates in the last dimension.
+cdef void cpu_lstm_gates_fwd(float* hiddens, int ldh, float* cells,
+        float* gates, const float* prevcells, int B, int N) nogil:
+    """Apply the gate activations in-place and compute the new cells and
+    hiddens in the same pass. The gates are assumed to be in the last
+    dimension, i.e. the activations for output i are gates[i*4:i*4+4].
     """
-    # This just does the following, but unrolled slightly to give 
-    # a better chance at simd.
-    #
-    # gates[g+i+0] = sigmoid(gates[g+i+0])
-    # gates[g+i+1] = sigmoid(gates[g+i+1])
-    # gates[g+i+2] = sigmoid(gates[g+i+2])
-    # gates[g+i+3] = tanh(gates[g+i+3])
-    #
-    # I would've hoped the compiler would find this itself? It seems to make
-    # it like, 10% faster. It feels like a dumb thing to do but it's not much
-    # code. The problem with this sort of thing is it needs to be rebenchmarked
-    # later...It's fine to revert this at a later date to the simpler loop.
-    # Shrug. The weird thing is, why should the batch entries be a good loop
-    # stride here? Surely something to do with cache lines would make more sense?
-    cdef int i, b, g
-    g = 0
+    cdef float hf, hi, ho, hc, ct3
+    cdef int b, i, g, c
     for b in range(B):
-        g = b * N * 4
-        end = g + N*4
-        while g < end:
-            gates[g+0] = expf(-gates[g+0])
-            gates[g+1] = expf(-gates[g+1])
-            gates[g+2] = expf(-gates[g+2])
-            g += 4
-        g = b * N * 4
-        while g < end:
-            gates[g+0] += 1
-            gates[g+1] += 1
-            gates[g+2] += 1
-            g += 4
-        g = b * N * 4
-        while g < end:
-            gates[g+0] = 1.0 / gates[g+0]
-            gates[g+1] = 1.0 / gates[g+1]
-            gates[g+2] = 1.0 / gates[g+2]
-            g += 4
-        g = b * N * 4
-        while g < end:
-            gates[g+3] = tanhf(gates[g+3])
-            g += 4
-
- 
-cdef void cpu_lstm_gates_fwd(float* hiddens, float* cells,
-        const float* gates, const float* prevcells, int B, int N) nogil:
-    cdef float hf, hi, ho, hc, ct2, ct3
-    cdef int i, b, g, c, h
-    g = 0
-    c = 0
-    h = 0
-    while g < B*N*4:
-        hf = gates[g+0]
-        hi = gates[g+1]
-        ho = gates[g+2]
-        hc = gates[g+3]
-        ct2 = prevcells[c]
-        ct3 = hf * ct2 + hi * hc
-        hiddens[h] = tanhf(ct3) * ho
-        cells[c] = ct3
-        g += 4
-        c += 1
-        h += 1
+        for i in range(N):
+            c = b * N + i
+            g = c * 4
+            hf = sigmoid(gates[g+0])
+            hi = sigmoid(gates[g+1])
+            ho = sigmoid(gates[g+2])
+            hc = tanhf(gates[g+3])
+            gates[g+0] = hf
+            gates[g+1] = hi
+            gates[g+2] = ho
+            gates[g+3] = hc
+            ct3 = hf * prevcells[c] + hi * hc
+            cells[c] = ct3
+            hiddens[b * ldh + i] = tanhf(ct3) * ho
 
 
 cdef void cpu_lstm_gates_bwd(
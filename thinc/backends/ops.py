@@ -1,16 +1,19 @@
 import math
 
 from typing import Optional, List, Tuple, Sequence, Union, cast, TypeVar
-from typing import Iterator, overload
+from typing import Iterator, Callable, overload
+from queue import Queue, Full
 import numpy
 import itertools
+import threading
 
 from .. import registry
 from ..types import Xp, Shape, DTypes, DTypesInt, DTypesFloat, List2d, ArrayXd
 from ..types import Array3d, Floats1d, Floats2d, Floats3d, Floats4d
 from ..types import FloatsXd, Ints1d, Ints2d, Ints3d, Ints4d, IntsXd, _Floats
 from ..types import DeviceTypes, Generator, Padded, Batchable, SizedGenerator
-from ..util import get_array_module, is_xp_array, to_numpy
+from ..util import get_array_module, is_xp_array, to_numpy, partial
+from ._arena import BufferArena
 
 
 ArrayT = TypeVar("ArrayT", bound=ArrayXd)
@@ -19,11 +22,24 @@ FloatsType = TypeVar("FloatsType", bound=FloatsXd)
 SQRT2PI = math.sqrt(2.0 / math.pi)
 INV_SQRT2 = 1.0 / math.sqrt(2.0)
 INV_SQRT_2PI = 1.0 / math.sqrt(2.0 * math.pi)
+# The activations supported by Ops.affine_act.
+AFFINE_ACTIVATIONS = (
+    "relu",
+    "gelu",
+    "swish",
+    "hard_swish",
+    "hard_swish_mobilenet",
+    "mish",
+)
+# The number of columns for which a float32 sum of int8 products is exact:
+# 1024 * 128 * 128 == 2 ** 24.
+INT8_GEMM_CHUNK = 1024
 
 
 class Ops:
     name: str = "base"
     xp: Xp = numpy
+    arena: Optional[BufferArena] = None
 
     def __init__(
         self, device_type: DeviceTypes = "cpu", device_id: int = -1, **kwargs
@@ -44,6 +60,9 @@ class Ops:
         *,
         shuffle: bool = False,
         buffer: int = 1,
+        lengths: Optional[Sequence[int]] = None,
+        count_padding: bool = False,
+        prefetch: int = 0,
     ) -> SizedGenerator:
         """Iterate slices from a sequence, optionally shuffled. Slices
         may be either views or copies of the underlying data.
@@ -55,15 +74,27 @@ class Ops:
         an index array, shuffling it, and then using it to slice into the
         sequence.
 
+        If the lengths of the items are given, items of similar length are
+        batched together, and the size is the number of tokens per batch
+        instead of the number of items: the sum of the lengths, or with
+        count_padding=True, the length of the longest item times the number
+        of items. An item that exceeds the size on its own gets its own batch.
+        Shuffling then shuffles items of the same length, and the order of
+        the batches.
+
         An internal queue of `buffer` items is accumulated before being each
         output. Buffering is useful for some devices, to allow the
         network to run asynchronously without blocking on every batch.
+
+        If prefetch is above 0, the batches are gathered on a background
+        thread, which stays up to `prefetch` batches ahead of the consumer.
+        This lets the data preparation overlap with the training step.
         """
         if not hasattr(sequence, "__len__"):
             err = f"Can't minibatch data. Expected sequence, got {type(sequence)}"
             raise ValueError(err)
-        sizes = self._get_batch_sizes(
-            len(sequence), itertools.repeat(size) if isinstance(size, int) else size
+        sizes, lengths_ = self._get_batch_plan(
+            len(sequence), size, lengths, count_padding
         )
         indices = numpy.arange(len(sequence))
 
@@ -71,19 +102,20 @@ class Ops:
         # trickery worthwhile: instead of being an actual generator, we
         # return our SizedGenerator object, which provides a __len__.
         def _iter_items():
-            if shuffle:
-                numpy.random.shuffle(indices)
             queue = []
-            i = 0
-            for size in sizes:
-                size = int(size)
-                queue.append(self._get_batch(sequence, indices[i : i + size]))
+            for idx_batch in self._get_batch_indices(
+                indices, sizes, lengths_, shuffle
+            ):
+                queue.append(self._get_batch(sequence, idx_batch))
                 if len(queue) >= buffer:
                     yield from queue
                     queue = []
-                i += size
             yield from queue
 
+        if prefetch > 0:
+            return SizedGenerator(
+                partial(_iter_prefetched, _iter_items, prefetch), len(sizes)
+            )
         return SizedGenerator(_iter_items, len(sizes))
 
     def multibatch(
@@ -93,6 +125,9 @@ class Ops:
         *others: Batchable,
         shuffle: bool = False,
         buffer: int = 1,
+        lengths: Optional[Sequence[int]] = None,
+        count_padding: bool = False,
+        prefetch: int = 0,
     ) -> SizedGenerator:
         """Minibatch one or more sequences of data, and yield
         lists with one batch per sequence. See ops.minibatch.
@@ -104,28 +139,28 @@ class Ops:
             values = ", ".join([f"{type(seq)}" for seq in sequences])
             err = f"Can't multibatch data. Expected sequences, got {values}"
             raise ValueError(err)
-        sizes = self._get_batch_sizes(
-            len(sequence), itertools.repeat(size) if isinstance(size, int) else size
+        sizes, lengths_ = self._get_batch_plan(
+            len(sequence), size, lengths, count_padding
         )
         indices = numpy.arange(len(sequence))
 
         def _iter_items():
-            if shuffle:
-                numpy.random.shuffle(indices)
             queue = []
-            i = 0
-            for size in sizes:
-                size = int(size)
-                idx_batch = indices[i : i + size]
+            for idx_batch in self._get_batch_indices(
+                indices, sizes, lengths_, shuffle
+            ):
                 queue.append([])
                 for sequence in sequences:
                     queue[-1].append(self._get_batch(sequence, idx_batch))
                 if len(queue) >= buffer:
                     yield from queue
                     queue = []
-                i += size
             yield from queue
 
+        if prefetch > 0:
+            return SizedGenerator(
+                partial(_iter_prefetched, _iter_items, prefetch), len(sizes)
+            )
         return SizedGenerator(_iter_items, len(sizes))
 
     def _get_batch(self, sequence, indices):
@@ -141,6 +176,26 @@ class Ops:
             )  # type: ignore
         return subseq
 
+    def _get_batch_plan(
+        self,
+        n_items: int,
+        size: Union[int, Generator],
+        lengths: Optional[Sequence[int]],
+        count_padding: bool,
+    ) -> Tuple[List[int], Optional[numpy.ndarray]]:
+        # Work out the number of items in each batch up front, so that the
+        # SizedGenerator knows its length. With lengths, the batches are cut
+        # from the items sorted by length, which shuffling doesn't change.
+        sizes = itertools.repeat(size) if isinstance(size, int) else size
+        if lengths is None:
+            return self._get_batch_sizes(n_items, sizes), None
+        lengths_ = numpy.asarray(lengths, dtype="int64")
+        if lengths_.shape != (n_items,):
+            err = f"Expected {n_items} lengths, got array of shape {lengths_.shape}"
+            raise ValueError(err)
+        sorted_lengths = numpy.sort(lengths_).tolist()
+        return self._get_bucket_sizes(sorted_lengths, sizes, count_padding), lengths_
+
     def _get_batch_sizes(self, length: int, sizes: Iterator[int]):
         output = []
         i = 0
@@ -149,6 +204,51 @@ class Ops:
             i += output[-1]
         return output
 
+    def _get_bucket_sizes(
+        self, sorted_lengths: List[int], sizes: Iterator[int], count_padding: bool
+    ) -> List[int]:
+        output = []
+        i = 0
+        while i < len(sorted_lengths):
+            budget = int(next(sizes))
+            n_tokens = 0
+            j = i
+            while j < len(sorted_lengths):
+                # The lengths are sorted, so the last item is the longest.
+                if count_padding:
+                    cost = sorted_lengths[j] * (j - i + 1)
+                else:
+                    cost = n_tokens + sorted_lengths[j]
+                if cost > budget and j > i:
+                    break
+                n_tokens += sorted_lengths[j]
+                j += 1
+            output.append(j - i)
+            i = j
+        return output
+
+    def _get_batch_indices(
+        self,
+        indices: numpy.ndarray,
+        sizes: List[int],
+        lengths: Optional[numpy.ndarray],
+        shuffle: bool,
+    ) -> List[numpy.ndarray]:
+        if shuffle:
+            numpy.random.shuffle(indices)
+        if lengths is not None:
+            # A stable sort keeps the shuffled order among items of one length.
+            indices = indices[numpy.argsort(lengths[indices], kind="stable")]
+        batches = []
+        i = 0
+        for size in sizes:
+            size = int(size)
+            batches.append(indices[i : i + size])
+            i += size
+        if shuffle and lengths is not None:
+            numpy.random.shuffle(batches)
+        return batches
+
     def seq2col(
         self, seq: Floats2d, nW: int, *, lengths: Optional[Ints1d] = None
     ) -> Floats2d:
@@ -211,6 +311,36 @@ class Ops:
             self.xp.dot(x, y, out=out)
             return out
 
+    def gemm_int8(
+        self,
+        x: Ints2d,
+        y: Ints2d,
+        out: Optional[Ints2d] = None,
+        trans1: bool = False,
+        trans2: bool = False,
+    ) -> Ints2d:
+        """Multiply two int8 matrices, summing the products as int32, and
+        optionally store the result in the specified output variable.
+
+        The products are computed with the float32 gemm, over chunks of at most
+        1024 columns. A float32 sum of that many int8 products is exact, so the
+        result is the same as with int32 arithmetic.
+        """
+        if trans1:
+            x = x.T
+        if trans2:
+            y = y.T
+        if out is None:
+            out = self.alloc2i(x.shape[0], y.shape[1])
+        else:
+            out.fill(0)
+        for start in range(0, x.shape[1], INT8_GEMM_CHUNK):
+            end = start + INT8_GEMM_CHUNK
+            x_chunk = self.asarray2f(x[:, start:end])
+            y_chunk = self.asarray2f(y[start:end])
+            out += self.gemm(x_chunk, y_chunk).astype("int32")
+        return out
+
     def tile(self, X: Floats2d, reps: int) -> Floats2d:
         return self.xp.tile(X, reps)
 
@@ -222,6 +352,84 @@ class Ops:
         Y += b
         return Y
 
+    def affine_act(
+        self,
+        X: Floats2d,
+        W: Floats2d,
+        b: Floats1d,
+        act: str = "relu",
+        *,
+        keep_preact: bool = True,
+    ) -> Tuple[Floats2d, Optional[Floats2d]]:
+        """Apply a weights layer, a bias and an activation to some inputs, i.e.
+        Y = act(X @ W.T + b). The activation is one of AFFINE_ACTIVATIONS.
+        Returns the output and the pre-activation values, which are needed by
+        backprop_affine_act. They're None if keep_preact is False, or if the
+        activation is relu, whose gradient is computed from the output.
+        """
+        _check_affine_act(act)
+        Y_preact = self.affine(X, W, b)
+        if act == "relu":
+            return self.relu(Y_preact, inplace=True), None
+        elif act == "mish":
+            Y = self.mish(Y_preact)
+        else:
+            Y = getattr(self, act)(Y_preact, inplace=not keep_preact)
+        return Y, Y_preact if keep_preact else None
+
+    def backprop_affine_act(
+        self,
+        dY: Floats2d,
+        X: Floats2d,
+        W: Floats2d,
+        Y: Floats2d,
+        Y_preact: Optional[Floats2d],
+        act: str = "relu",
+    ) -> Tuple[Floats2d, Floats2d, Floats1d]:
+        """Backpropagate through affine_act. Returns the gradients of X, W
+        and b.
+        """
+        _check_affine_act(act)
+        if act == "relu":
+            dY_preact = self.backprop_relu(dY, Y)
+        elif Y_preact is None:
+            raise ValueError(f"The pre-activation values are needed for {act}")
+        elif act == "swish":
+            dY_preact = self.backprop_swish(dY, Y_preact, Y)
+        elif act == "mish":
+            dY_preact = self.backprop_mish(dY, Y_preact)
+        else:
+            dY_preact = getattr(self, "backprop_" + act)(dY, Y_preact)
+        dX = self.gemm(dY_preact, W)
+        dW = self.gemm(dY_preact, X, trans1=True)
+        return dX, dW, dY_preact.sum(axis=0)
+
+    def affine_maxout(
+        self, X: Floats2d, W: Floats3d, b: Floats2d
+    ) -> Tuple[Floats2d, Ints2d]:
+        """Apply a maxout layer to some inputs: the weights of shape
+        (nO, nP, nI) and the bias of shape (nO, nP) produce nP pieces per
+        output, and the largest piece is kept. Returns the output and the
+        index of the piece that was kept, for backprop_affine_maxout.
+        """
+        nO, nP, nI = W.shape
+        Y = self.gemm(X, self.reshape2f(W, nO * nP, nI), trans2=True)
+        Y += self.reshape1f(b, nO * nP)
+        return self.maxout(self.reshape3f(Y, Y.shape[0], nO, nP))
+
+    def backprop_affine_maxout(
+        self, dY: Floats2d, X: Floats2d, W: Floats3d, which: Ints2d
+    ) -> Tuple[Floats2d, Floats3d, Floats2d]:
+        """Backpropagate through affine_maxout. Returns the gradients of X, W
+        and b.
+        """
+        nO, nP, nI = W.shape
+        dZ = self.backprop_maxout(dY, which, nP)
+        dY_preact = self.reshape2f(dZ, dZ.shape[0], nO * nP)
+        dX = self.gemm(dY_preact, self.reshape2f(W, nO * nP, nI))
+        dW = self.reshape3f(self.gemm(dY_preact, X, trans1=True), nO, nP, nI)
+        return dX, dW, dZ.sum(axis=0)
+
     def flatten(
         self,
         X: Sequence[ArrayT],
@@ -380,6 +588,29 @@ class Ops:
         mask = (coinflips >= drop) / (1.0 - drop)
         return cast(FloatsXd, self.asarray(mask, dtype="float32"))
 
+    def dropout(
+        self, X: FloatsT, drop: float, *, inplace: bool = False
+    ) -> Tuple[FloatsT, ArrayXd]:
+        """Apply dropout to X: zero each value with probability `drop`, and
+        scale the others by 1 / (1 - drop). Returns the output and a boolean
+        mask of the values that were kept, for backprop_dropout.
+        """
+        mask = self.xp.random.uniform(0.0, 1.0, X.shape) >= drop
+        Y = X if inplace else X.copy()
+        Y *= mask
+        if drop < 1.0:
+            Y *= 1.0 / (1.0 - drop)
+        return cast(FloatsT, Y), mask
+
+    def backprop_dropout(
+        self, dY: FloatsT, mask: ArrayXd, drop: float, *, inplace: bool = False
+    ) -> FloatsT:
+        dX = dY if inplace else dY.copy()
+        dX *= mask
+        if drop < 1.0:
+            dX *= 1.0 / (1.0 - drop)
+        return cast(FloatsT, dX)
+
     def alloc1f(self, d0: int, *, dtype: Optional[DTypesFloat] = "float32") -> Floats1d:
         return self.alloc((d0,), dtype=dtype)
 
@@ -914,6 +1145,36 @@ class Ops:
         out[indices] = dXsub
         return out
 
+    def layer_norm(
+        self, X: Floats2d, G: Floats1d, b: Floats1d, *, eps: float = 1e-8
+    ) -> Tuple[Floats2d, Floats1d, Floats1d]:
+        """Normalize each row of X to zero mean and unit variance, then scale
+        it by G and shift it by b. The eps is added to the variance. Returns
+        the output, and the mean and inverse standard deviation of each row
+        for backprop_layer_norm.
+        """
+        mean = X.mean(axis=1)
+        rstd = (X.var(axis=1) + eps) ** -0.5
+        Y = (X - mean[:, None]) * rstd[:, None]
+        Y *= G
+        Y += b
+        return cast(Floats2d, Y), cast(Floats1d, mean), cast(Floats1d, rstd)
+
+    def backprop_layer_norm(
+        self, dY: Floats2d, X: Floats2d, G: Floats1d, mean: Floats1d, rstd: Floats1d
+    ) -> Tuple[Floats2d, Floats1d, Floats1d]:
+        """Backpropagate through layer_norm. Returns the gradients of X, G
+        and b.
+        """
+        Xhat = (X - mean[:, None]) * rstd[:, None]
+        db = dY.sum(axis=0)
+        dG = (dY * Xhat).sum(axis=0)
+        dXhat = dY * G
+        dX = dXhat - dXhat.mean(axis=1, keepdims=True)
+        dX -= Xhat * (dXhat * Xhat).mean(axis=1, keepdims=True)
+        dX *= rstd[:, None]
+        return cast(Floats2d, dX), cast(Floats1d, dG), cast(Floats1d, db)
+
     def update_averages(
         self, ema: FloatsT, weights: FloatsT, t: int, max_decay: float = 0.9999
     ) -> None:
@@ -945,6 +1206,49 @@ class Ops:
         weights -= learn_rate * (mom1 / (mod_rate * self.xp.sqrt(mom2) + eps))
         return weights, gradient, mom1, mom2
 
+    def multi_adam(
+        self,
+        weights: Sequence[Floats1d],
+        gradients: Sequence[Floats1d],
+        mom1: Sequence[Floats1d],
+        mom2: Sequence[Floats1d],
+        averages: Optional[Sequence[Floats1d]],
+        beta1: float,
+        beta2: float,
+        eps: float,
+        learn_rate: float,
+        *,
+        L2: float = 0.0,
+        weight_decay: float = 0.0,
+        grad_clip: float = 0.0,
+        average_decay: float = 0.0,
+        use_mom2: bool = True,
+    ) -> None:
+        # Internals for optimizer. Update several parameters in place: add the
+        # L2 penalty to the gradient, clip it, update the moments and weights,
+        # apply weight decay, zero the gradient and update the averages. The
+        # learn rate is assumed to be bias-corrected by the caller. If
+        # use_mom2 is False, the update isn't scaled by the second moment, as
+        # in the first steps of RAdam.
+        for i, (W, dW, m1, m2) in enumerate(zip(weights, gradients, mom1, mom2)):
+            if L2 != 0:
+                dW += L2 * W
+            if grad_clip:
+                dW = self.clip_gradient(dW, grad_clip)
+            m1 *= beta1
+            m1 += (1.0 - beta1) * dW
+            m2 *= beta2
+            m2 += (1.0 - beta2) * (dW * dW)
+            if use_mom2:
+                W -= learn_rate * (m1 / (self.xp.sqrt(m2) + eps))
+            else:
+                W -= learn_rate * m1
+            if weight_decay != 0:
+                W -= weight_decay * W
+            dW.fill(0)
+            if averages is not None:
+                averages[i] -= (1.0 - average_decay) * (averages[i] - W)
+
     def clip_gradient(self, gradient: FloatsT, threshold: float) -> FloatsT:
         # Internals for optimizer
         xp = get_array_module(gradient)
@@ -1093,7 +1397,7 @@ have the initial hiddens and initial cells. So:
 
 
 def lstm_forward_training(
-    params: Floats1d, c_init: Floats3d, h_init: Floats3d, X: Floats2d, lengths: Ints1d
+    params: Floats1d, h_init: Floats3d, c_init: Floats3d, X: Floats2d, lengths: Ints1d
 ) -> Tuple[Floats2d, Tuple]:
     xp = get_array_module(params)
     depth, dirs, nO = c_init.shape
@@ -1352,6 +1656,12 @@ def dtanh(Y: ArrayT) -> ArrayT:
     return 1 - Y ** 2
 
 
+def _check_affine_act(act: str) -> None:
+    if act not in AFFINE_ACTIVATIONS:
+        err = f"Unsupported activation '{act}', expected one of: {AFFINE_ACTIVATIONS}"
+        raise ValueError(err)
+
+
 def gaussian_cdf(ops: Ops, X: FloatsType) -> FloatsType:
     """Gaussian CDF for distribution with mean 0 and stdev 1."""
     return 0.5 * (1.0 + ops.erf(INV_SQRT2 * X))
@@ -1360,3 +1670,46 @@ def gaussian_cdf(ops: Ops, X: FloatsType) -> FloatsType:
 def gaussian_pdf(ops: Ops, X: FloatsType) -> FloatsType:
     """Gaussian PDF for distribution with mean 0 and stdev 1."""
     return INV_SQRT_2PI * ops.xp.exp(-0.5 * X * X)
+
+
+def _iter_prefetched(get_items: Callable[[], Iterator], n: int) -> Iterator:
+    """Iterate over the items from get_items(), which are produced on a worker
+    thread that runs at most n items ahead.
+    """
+    queue: Queue = Queue(maxsize=n)
+    stop = threading.Event()
+    done = object()
+
+    def put(entry) -> bool:
+        # Don't block forever if the consumer stops iterating early.
+        while not stop.is_set():
+            try:
+                queue.put(entry, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def work() -> None:
+        try:
+            for item in get_items():
+                if not put((item, None)):
+                    return
+        except Exception as e:
+            put((done, e))
+        else:
+            put((done, None))
+
+    worker = threading.Thread(target=work, daemon=True)
+    worker.start()
+    try:
+        while True:
+            item, error = queue.get()
+            if error is not None:
+                raise error
+            elif item is done:
+                break
+            yield item
+    finally:
+        stop.set()
+        worker.join()
@@ -0,0 +1,214 @@
+from typing import Any, Dict, Iterator, Optional, Union
+from dataclasses import dataclass, field
+import functools
+import threading
+import time
+import warnings
+
+from wasabi import table
+
+from .ops import Ops
+from ..types import Padded, Ragged
+from ..util import is_cupy_array, is_numpy_array
+from .. import registry
+
+
+# Ops that only allocate, convert or move data around. Their FLOPs are
+# counted as zero; other ops are estimated at one FLOP per output element.
+_DATA_OPS = (
+    "alloc",
+    "asarray",
+    "as_contig",
+    "reshape",
+    "to_numpy",
+    "flatten",
+    "unflatten",
+    "pad",
+    "unpad",
+    "list2padded",
+    "padded2list",
+    "seq2col",
+    "backprop_seq2col",
+    "tile",
+    "insert_into",
+    "minibatch",
+    "multibatch",
+)
+
+
+@dataclass
+class OpStats:
+    """Aggregated measurements for one Ops method. The histogram maps the upper
+    bound of each latency bucket in microseconds, which are powers of two, to
+    the number of calls that fell into it.
+    """
+
+    name: str
+    calls: int = 0
+    total_time: float = 0.0
+    flops: int = 0
+    bytes_moved: int = 0
+    copies: int = 0
+    histogram: Dict[int, int] = field(default_factory=dict)
+
+
+class OpsTrace:
+    """The measurements collected by a TracingOps instance, keyed by method."""
+
+    stats: Dict[str, OpStats]
+
+    def __init__(self):
+        self.stats = {}
+        self._lock = threading.Lock()
+
+    def add(
+        self, name: str, duration: float, flops: int, n_bytes: int, copies: int
+    ) -> None:
+        bucket = 2 ** int(duration * 1e6).bit_length()
+        with self._lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = OpStats(name)
+            stats.calls += 1
+            stats.total_time += duration
+            stats.flops += flops
+            stats.bytes_moved += n_bytes
+            stats.copies += copies
+            stats.histogram[bucket] = stats.histogram.get(bucket, 0) + 1
+
+    def clear(self) -> None:
+        """Remove the collected measurements."""
+        with self._lock:
+            self.stats = {}
+
+    def format_table(self) -> str:
+        """Format the measurements as a table, sorted by total time."""
+        with self._lock:
+            ops = sorted(self.stats.values(), key=lambda s: s.total_time, reverse=True)
+        header = ("Op", "Calls", "Total ms", "Mean us", "MFLOP", "MB moved", "Copies")
+        data = [
+            (
+                s.name,
+                s.calls,
+                f"{s.total_time * 1e3:.2f}",
+                f"{s.total_time * 1e6 / s.calls:.1f}",
+                f"{s.flops / 1e6:.2f}",
+                f"{s.bytes_moved / 2 ** 20:.2f}",
+                s.copies,
+            )
+            for s in ops
+        ]
+        aligns = ("l", "r", "r", "r", "r", "r", "r")
+        return table(data, header=header, aligns=aligns)
+
+
+@registry.ops("TracingOps")
+class TracingOps(Ops):
+    """Wrap another Ops instance and measure each call to its methods: the
+    latency, an estimate of the FLOPs, and the bytes of the arrays passed in
+    and returned. Arrays that are on a different device than the wrapped ops,
+    e.g. numpy arrays passed to CupyOps, are counted as copies, and reported
+    as warnings if warn_on_copy is set. The measurements are available as
+    ops.trace. Only calls made directly on the TracingOps are measured, not
+    the calls the wrapped ops make internally.
+
+    Use it as use_ops("tracing", inner="numpy"). Other keyword arguments are
+    passed to the wrapped ops.
+    """
+
+    name = "tracing"
+
+    def __init__(
+        self,
+        inner: Union[str, Ops] = "cpu",
+        *,
+        warn_on_copy: bool = False,
+        trace: Optional[OpsTrace] = None,
+        **kwargs,
+    ) -> None:
+        from . import get_ops
+
+        self.inner = get_ops(inner, **kwargs) if isinstance(inner, str) else inner
+        self.device_type = self.inner.device_type
+        self.device_id = self.inner.device_id
+        self.xp = self.inner.xp
+        self.warn_on_copy = warn_on_copy
+        self.trace = trace if trace is not None else OpsTrace()
+
+    @property  # type: ignore
+    def arena(self):
+        return self.inner.arena
+
+    def __getattr__(self, name: str) -> Any:
+        # Attributes that are specific to the wrapped ops, e.g. n_threads.
+        if name == "inner":
+            raise AttributeError(name)
+        return getattr(self.inner, name)
+
+    def _call(self, name: str, args: tuple, kwargs: Dict[str, Any]) -> Any:
+        method = getattr(self.inner, name)
+        start = time.perf_counter()
+        result = method(*args, **kwargs)
+        duration = time.perf_counter() - start
+        inputs = list(_iter_arrays(args)) + list(_iter_arrays(kwargs.values()))
+        outputs = list(_iter_arrays([result]))
+        n_bytes = sum(int(arr.nbytes) for arr in inputs + outputs)
+        copies = 0
+        if name != "to_numpy":
+            copies = sum(1 for arr in inputs if self._is_foreign(arr))
+        if copies and self.warn_on_copy:
+            warnings.warn(
+                f"Ops.{name} was called with {copies} array(s) on another "
+                f"device than {self.inner.name} ops, which requires a copy"
+            )
+        flops = _estimate_flops(name, args, kwargs, outputs)
+        self.trace.add(name, duration, flops, n_bytes, copies)
+        return result
+
+    def _is_foreign(self, arr: Any) -> bool:
+        if is_cupy_array(arr):
+            return self.inner.device_type != "gpu"
+        return self.inner.device_type == "gpu" and is_numpy_array(arr)
+
+
+def _make_traced(name: str):
+    @functools.wraps(getattr(Ops, name))
+    def traced(self, *args, **kwargs):
+        return self._call(name, args, kwargs)
+
+    return traced
+
+
+for _name, _value in list(vars(Ops).items()):
+    if not _name.startswith("_") and callable(_value):
+        setattr(TracingOps, _name, _make_traced(_name))
+
+
+def _iter_arrays(objs: Any) -> Iterator[Any]:
+    for obj in objs:
+        if isinstance(obj, (Ragged, Padded)):
+            yield obj.data
+        elif isinstance(obj, (list, tuple)):
+            yield from _iter_arrays(obj)
+        elif hasattr(obj, "nbytes") and hasattr(obj, "shape"):
+            yield obj
+
+
+def _estimate_flops(name: str, args: tuple, kwargs: Dict[str, Any], outputs) -> int:
+    if name in ("gemm", "gemm_int8", "affine") and len(args) >= 2:
+        x = args[0]
+        trans1 = kwargs.get("trans1", args[3] if len(args) >= 4 else False)
+        k = x.shape[0] if name != "affine" and trans1 else x.shape[1]
+        size = int(outputs[0].size) if outputs else 0
+        flops = 2 * size * k
+        return flops + size if name == "affine" else flops
+    elif name in ("affine_act", "affine_maxout") and len(args) >= 2:
+        # A multiply-add per weight and row, plus the bias and activation.
+        n_rows, n_weights = args[0].shape[0], int(args[1].size)
+        return 2 * n_rows * n_weights + n_rows * (n_weights // max(args[0].shape[1], 1))
+    elif name in ("backprop_affine_act", "backprop_affine_maxout") and len(args) >= 3:
+        # The gradients of the input and of the weights are both gemms.
+        return 4 * args[1].shape[0] * int(args[2].size)
+    elif name.startswith(_DATA_OPS):
+        return 0
+    return sum(int(arr.size) for arr in outputs)
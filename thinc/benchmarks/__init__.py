@@ -0,0 +1,155 @@
+"""Benchmarks for the Ops kernels and the common layers. Run them with
+`python -m thinc.benchmarks`, see `python -m thinc.benchmarks --help`.
+"""
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from dataclasses import dataclass
+import gc
+import platform
+import statistics
+import time
+import tracemalloc
+
+from ..about import __version__
+from ..backends import Ops, get_ops
+
+
+@dataclass
+class Benchmark:
+    """A benchmark. The setup function receives the ops and the scale of the
+    inputs, and returns the function to time and the number of items, e.g.
+    rows or tokens, that it processes per call.
+    """
+
+    name: str
+    group: str
+    setup: Callable[[Ops, float], Tuple[Callable[[], Any], int]]
+
+
+BENCHMARKS: Dict[str, Benchmark] = {}
+MIN_MEMORY_CHANGE = 2 ** 16
+
+
+def benchmark(name: str, group: str) -> Callable:
+    """Register a benchmark setup function under the given name."""
+
+    def register(setup: Callable) -> Callable:
+        BENCHMARKS[name] = Benchmark(name, group, setup)
+        return setup
+
+    return register
+
+
+def run_benchmarks(
+    names: Optional[List[str]] = None,
+    *,
+    ops: Optional[Ops] = None,
+    scale: float = 1.0,
+    min_time: float = 0.5,
+    min_calls: int = 5,
+) -> Dict[str, Any]:
+    """Run the benchmarks with the given names, or all of them. Each one is
+    called until it has run for at least min_time seconds and min_calls
+    times. The inputs are sized for realistic workloads, multiplied by the
+    scale. Returns the results with the environment they were measured in,
+    as a JSON-serializable dict.
+    """
+    if ops is None:
+        ops = get_ops("cpu")
+    if names is None:
+        names = list(BENCHMARKS)
+    results = [
+        _run_benchmark(BENCHMARKS[name], ops, scale, min_time, min_calls)
+        for name in names
+    ]
+    return {
+        "thinc_version": __version__,
+        "python_version": platform.python_version(),
+        "platform": platform.platform(),
+        "ops": ops.name,
+        "scale": scale,
+        "results": results,
+    }
+
+
+def compare_results(
+    results: Dict[str, Any], baseline: Dict[str, Any], threshold: float = 0.1
+) -> List[Dict[str, Any]]:
+    """Compare benchmark results against a baseline, and return the
+    regressions: the benchmarks whose throughput dropped, or whose peak
+    memory grew, by more than the threshold.
+    """
+    baseline_by_name = {result["name"]: result for result in baseline["results"]}
+    regressions = []
+    for result in results["results"]:
+        base = baseline_by_name.get(result["name"])
+        if base is None:
+            continue
+        for metric, sign in (("items_per_second", -1), ("peak_memory", 1)):
+            if not base[metric]:
+                continue
+            diff = result[metric] - base[metric]
+            # Ignore memory changes of a few small allocations.
+            if metric == "peak_memory" and abs(diff) < MIN_MEMORY_CHANGE:
+                continue
+            change = diff / base[metric]
+            if change * sign > threshold:
+                regressions.append(
+                    {
+                        "name": result["name"],
+                        "metric": metric,
+                        "baseline": base[metric],
+                        "current": result[metric],
+                        "change": change,
+                    }
+                )
+    return regressions
+
+
+def _run_benchmark(
+    bench: Benchmark, ops: Ops, scale: float, min_time: float, min_calls: int
+) -> Dict[str, Any]:
+    func, n_items = bench.setup(ops, scale)
+    # Warm up caches and lazily allocated buffers.
+    func()
+    times: List[float] = []
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        while len(times) < min_calls or time.perf_counter() - start < min_time:
+            call_start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - call_start)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    # Measure the memory separately, as tracing slows down the calls.
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    elif hasattr(tracemalloc, "reset_peak"):
+        tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    if not tracing:
+        tracemalloc.stop()
+    median = statistics.median(times)
+    return {
+        "name": bench.name,
+        "group": bench.group,
+        "calls": len(times),
+        "items": n_items,
+        "median_time": median,
+        "mean_time": statistics.mean(times),
+        "min_time": min(times),
+        "items_per_second": n_items / median if median else 0.0,
+        "peak_memory": max(peak - before, 0),
+    }
+
+
+# Register the benchmarks.
+from . import suite  # noqa: E402,F401
+
+
+__all__ = ["Benchmark", "BENCHMARKS", "benchmark", "run_benchmarks", "compare_results"]
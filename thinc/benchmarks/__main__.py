@@ -0,0 +1,93 @@
+from typing import List, Optional
+import argparse
+import json
+import sys
+
+from wasabi import msg, table
+
+from ..backends import get_ops
+from . import BENCHMARKS, compare_results, run_benchmarks
+
+
+def main(args: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m thinc.benchmarks",
+        description="Benchmark the Ops kernels and the common layers.",
+    )
+    parser.add_argument(
+        "names", nargs="*", help="Only run benchmarks whose names contain these"
+    )
+    parser.add_argument("--ops", default="cpu", help="The backend to benchmark")
+    parser.add_argument(
+        "--scale", type=float, default=1.0, help="Multiply the input sizes by this"
+    )
+    parser.add_argument(
+        "--min-time", type=float, default=0.5, help="Seconds to run each benchmark"
+    )
+    parser.add_argument(
+        "--min-calls", type=int, default=5, help="Minimum calls per benchmark"
+    )
+    parser.add_argument("--output", help="Save the results as JSON to this path")
+    parser.add_argument("--baseline", help="Compare against results in this path")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Relative change in throughput or memory that counts as a regression",
+    )
+    parser.add_argument("--list", action="store_true", help="List the benchmarks")
+    opts = parser.parse_args(args)
+    names = [
+        name
+        for name in BENCHMARKS
+        if not opts.names or any(pattern in name for pattern in opts.names)
+    ]
+    if opts.list:
+        print("\n".join(names))
+        return 0
+    if not names:
+        msg.fail(f"No benchmarks match: {', '.join(opts.names)}")
+        return 1
+    results = run_benchmarks(
+        names,
+        ops=get_ops(opts.ops),
+        scale=opts.scale,
+        min_time=opts.min_time,
+        min_calls=opts.min_calls,
+    )
+    data = [
+        (
+            result["name"],
+            result["calls"],
+            f"{result['median_time'] * 1000:.3f}",
+            f"{result['items_per_second']:,.0f}",
+            f"{result['peak_memory'] / 2 ** 20:.2f}",
+        )
+        for result in results["results"]
+    ]
+    header = ("Benchmark", "Calls", "Median ms", "Items/s", "Peak MB")
+    print(table(data, header=header, aligns=("l", "r", "r", "r", "r")))
+    if opts.output:
+        with open(opts.output, "w", encoding="utf8") as file_:
+            json.dump(results, file_, indent=2)
+        msg.good(f"Saved results to {opts.output}")
+    if opts.baseline:
+        with open(opts.baseline, encoding="utf8") as file_:
+            baseline = json.load(file_)
+        regressions = compare_results(results, baseline, opts.threshold)
+        if regressions:
+            data = [
+                (r["name"], r["metric"], r["baseline"], r["current"])
+                + (f"{r['change']:+.1%}",)
+                for r in regressions
+            ]
+            header = ("Benchmark", "Metric", "Baseline", "Current", "Change")
+            msg.fail(f"{len(regressions)} regression(s) against {opts.baseline}")
+            print(table(data, header=header))
+            return 1
+        msg.good(f"No regressions against {opts.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,300 @@
+from typing import Any, Callable, Tuple
+import numpy
+
+from ..api import Embed, HashEmbed, LSTM, Maxout, ParametricAttention, SparseLinear
+from ..api import with_padded, quantize_model
+from ..backends import Ops
+from ..model import Model
+from ..types import Ragged
+from . import benchmark
+
+
+# The sizes are typical for NLP models: 4096 tokens per batch, in sequences
+# of 32 tokens, with a width of 256.
+N_TOKENS = 4096
+SEQ_LENGTH = 32
+WIDTH = 256
+N_PIECES = 3
+N_VOCAB = 5000
+
+BenchmarkT = Tuple[Callable[[], Any], int]
+
+
+def _get_sizes(scale: float) -> Tuple[int, int]:
+    n_seqs = max(int(N_TOKENS * scale) // SEQ_LENGTH, 1)
+    return n_seqs * SEQ_LENGTH, n_seqs
+
+
+def _get_floats(ops: Ops, *shape: int) -> Any:
+    rng = numpy.random.RandomState(0)
+    return ops.asarray(rng.uniform(-1, 1, shape).astype("f"))
+
+
+def _get_lengths(ops: Ops, n_seqs: int) -> Any:
+    return ops.asarray1i([SEQ_LENGTH] * n_seqs)
+
+
+def _get_ids(ops: Ops, n: int) -> Any:
+    rng = numpy.random.RandomState(0)
+    return ops.asarray(rng.randint(0, N_VOCAB, size=(n,)), dtype="uint64")
+
+
+def _time_layer(model: Model, X: Any, is_train: bool) -> Callable[[], Any]:
+    if not is_train:
+        return lambda: model.predict(X)
+
+    def update() -> Any:
+        Y, backprop = model(X, is_train=True)
+        return backprop(Y)
+
+    return update
+
+
+@benchmark("ops.gemm", "ops")
+def bench_gemm(ops: Ops, scale: float) -> BenchmarkT:
+    n_tokens, _ = _get_sizes(scale)
+    X = _get_floats(ops, n_tokens, WIDTH)
+    W = _get_floats(ops, WIDTH, WIDTH)
+    return lambda: ops.gemm(X, W, trans2=True), n_tokens
+
+
+@benchmark("ops.gemm_int8", "ops")
+def bench_gemm_int8(ops: Ops, scale: float) -> BenchmarkT:
+    n_tokens, _ = _get_sizes(scale)
+    X = ops.asarray(_get_floats(ops, n_tokens, WIDTH) * 127, dtype="int8")
+    W = ops.asarray(_get_floats(ops, WIDTH, WIDTH) * 127, dtype="int8")
+    return lambda: ops.gemm_int8(X, W, trans2=True), n_tokens
+
+
+@benchmark("ops.seq2col", "ops")
+def bench_seq2col(ops: Ops, scale: float) -> BenchmarkT:
+    n_tokens, n_seqs = _get_sizes(scale)
+    X = _get_floats(ops, n_tokens, WIDTH)
+    lengths = _get_lengths(ops, n_seqs)
+    return lambda: ops.seq2col(X, 1, lengths=lengths), n_tokens
+
+
+@benchmark("ops.backprop_seq2col", "ops")
+def bench_backprop_seq2col(ops: Ops, scale: float) -> BenchmarkT:
+    n_tokens, n_seqs = _get_sizes(scale)
+    dY = _get_floats(ops, n_tokens, WIDTH * 3)
+    lengths = _get_lengths(ops, n_seqs)
+    return lambda: ops.backprop_seq2col(dY, 1, lengths=lengths), n_tokens
+
+
+@benchmark("ops.reduce_sum", "ops")
+def bench_reduce_sum(ops: Ops, scale: float) -> BenchmarkT:
+    n_tokens, n_seqs = _get_sizes(scale)
+    X = _get_floats(ops, n_tokens, WIDTH)
+    lengths = _get_lengths(ops, n_seqs)
+    return lambda: ops.reduce_sum(X, lengths), n_tokens
+
+
+@benchmark("ops.reduce_mean", "ops")
+def bench_reduce_mean(ops: Ops, scale: float) -> BenchmarkT:
+    n_tokens, n_seqs = _get_sizes(scale)
+    X = _get_floats(ops, n_tokens, WIDTH)
+    lengths = _get_lengths(ops, n_seqs)
+    return lambda: ops.reduce_mean(X, lengths), n_tokens
+
+
+@benchmark("ops.reduce_max", "ops")
+def bench_reduce_max(ops: Ops, scale: float) -> BenchmarkT:
+    n_tokens, n_seqs = _get_sizes(scale)
+    X = _get_floats(ops, n_tokens, WIDTH)
+    lengths = _get_lengths(ops, n_seqs)
+    return lambda: ops.reduce_max(X, lengths), n_tokens
+
+
+@benchmark("ops.maxout", "ops")
+def bench_maxout(ops: Ops, scale: float) -> BenchmarkT:
+    n_tokens, _ = _get_sizes(scale)
+    X = _get_floats(ops, n_tokens, WIDTH, N_PIECES)
+    return lambda: ops.maxout(X), n_tokens
+
+
+@benchmark("ops.backprop_maxout", "ops")
+def bench_backprop_maxout(ops: Ops, scale: float) -> BenchmarkT:
+    n_tokens, _ = _get_sizes(scale)
+    _, which = ops.maxout(_get_floats(ops, n_tokens, WIDTH, N_PIECES))
+    dY = _get_floats(ops, n_tokens, WIDTH)
+    return lambda: ops.backprop_maxout(dY, which, N_PIECES), n_tokens
+
+
+@benchmark("ops.hash", "ops")
+def bench_hash(ops: Ops, scale: float) -> BenchmarkT:
+    n_tokens, _ = _get_sizes(scale)
+    ids = _get_ids(ops, n_tokens)
+    return lambda: ops.hash(ids, 0), n_tokens
+
+
+@benchmark("ops.scatter_add", "ops")
+def bench_scatter_add(ops: Ops, scale: float) -> BenchmarkT:
+    n_tokens, _ = _get_sizes(scale)
+    table = ops.alloc2f(N_VOCAB, WIDTH)
+    ids = ops.asarray1i(_get_ids(ops, n_tokens).astype("i"))
+    values = _get_floats(ops, n_tokens, WIDTH)
+    return lambda: ops.scatter_add(table, ids, values), n_tokens
+
+
+@benchmark("ops.adam", "ops")
+def bench_adam(ops: Ops, scale: float) -> BenchmarkT:
+    # One item is one parameter.
+    n_params = max(int(N_VOCAB * WIDTH * scale), 1)
+    weights = _get_floats(ops, n_params)
+    gradient = _get_floats(ops, n_params)
+    mom1 = ops.alloc1f(n_params)
+    mom2 = ops.alloc1f(n_params)
+
+    def adam() -> Any:
+        return ops.adam(weights, gradient, mom1, mom2, 0.9, 0.999, 1e-8, 0.001)
+
+    return adam, n_params
+
+
+@benchmark("ops.lstm_forward_inference", "ops")
+def bench_lstm_forward_inference(ops: Ops, scale: float) -> BenchmarkT:
+    n_tokens, n_seqs = _get_sizes(scale)
+    params, H0, C0, X, size_at_t = _get_lstm_inputs(ops, n_tokens, n_seqs)
+    return lambda: ops.lstm_forward_inference(params, H0, C0, X, size_at_t), n_tokens
+
+
+@benchmark("ops.backprop_lstm", "ops")
+def bench_backprop_lstm(ops: Ops, scale: float) -> BenchmarkT:
+    n_tokens, n_seqs = _get_sizes(scale)
+    params, H0, C0, X, size_at_t = _get_lstm_inputs(ops, n_tokens, n_seqs)
+
+    def lstm() -> Any:
+        Y, fwd_state = ops.lstm_forward_training(params, H0, C0, X, size_at_t)
+        return ops.backprop_lstm(Y, size_at_t, params, fwd_state)
+
+    return lstm, n_tokens
+
+
+def _get_lstm_inputs(ops: Ops, n_tokens: int, n_seqs: int) -> Tuple:
+    n_params = WIDTH * 4 * WIDTH + WIDTH * 4 + WIDTH * 4 * WIDTH + WIDTH * 4
+    params = _get_floats(ops, n_params) * 0.1
+    H0 = ops.alloc3f(1, 1, WIDTH)
+    C0 = ops.alloc3f(1, 1, WIDTH)
+    X = _get_floats(ops, n_tokens, WIDTH)
+    size_at_t = ops.asarray1i([n_seqs] * SEQ_LENGTH)
+    return params, H0, C0, X, size_at_t
+
+
+def _bench_embed(model: Model, ops: Ops, scale: float, is_train: bool) -> BenchmarkT:
+    n_tokens, _ = _get_sizes(scale)
+    model.ops = ops
+    ids = _get_ids(ops, n_tokens)
+    model.initialize(X=ids)
+    return _time_layer(model, ids, is_train), n_tokens
+
+
+@benchmark("layers.Embed.predict", "layers")
+def bench_embed_predict(ops: Ops, scale: float) -> BenchmarkT:
+    return _bench_embed(Embed(WIDTH, N_VOCAB), ops, scale, False)
+
+
+@benchmark("layers.Embed.update", "layers")
+def bench_embed_update(ops: Ops, scale: float) -> BenchmarkT:
+    return _bench_embed(Embed(WIDTH, N_VOCAB), ops, scale, True)
+
+
+@benchmark("layers.HashEmbed.predict", "layers")
+def bench_hash_embed_predict(ops: Ops, scale: float) -> BenchmarkT:
+    return _bench_embed(HashEmbed(WIDTH, N_VOCAB), ops, scale, False)
+
+
+@benchmark("layers.HashEmbed.update", "layers")
+def bench_hash_embed_update(ops: Ops, scale: float) -> BenchmarkT:
+    return _bench_embed(HashEmbed(WIDTH, N_VOCAB), ops, scale, True)
+
+
+def _bench_maxout(ops: Ops, scale: float, is_train: bool) -> BenchmarkT:
+    n_tokens, _ = _get_sizes(scale)
+    model = Maxout(WIDTH, WIDTH, N_PIECES)
+    model.ops = ops
+    X = _get_floats(ops, n_tokens, WIDTH)
+    model.initialize(X=X)
+    return _time_layer(model, X, is_train), n_tokens
+
+
+@benchmark("layers.Maxout.predict", "layers")
+def bench_maxout_predict(ops: Ops, scale: float) -> BenchmarkT:
+    return _bench_maxout(ops, scale, False)
+
+
+@benchmark("layers.Maxout.update", "layers")
+def bench_maxout_update(ops: Ops, scale: float) -> BenchmarkT:
+    return _bench_maxout(ops, scale, True)
+
+
+@benchmark("layers.Maxout.quantized.predict", "layers")
+def bench_maxout_quantized_predict(ops: Ops, scale: float) -> BenchmarkT:
+    n_tokens, _ = _get_sizes(scale)
+    model = Maxout(WIDTH, WIDTH, N_PIECES)
+    model.ops = ops
+    X = _get_floats(ops, n_tokens, WIDTH)
+    model.initialize(X=X)
+    model = quantize_model(model, [X])
+    return _time_layer(model, X, False), n_tokens
+
+
+def _bench_lstm(ops: Ops, scale: float, is_train: bool) -> BenchmarkT:
+    n_tokens, n_seqs = _get_sizes(scale)
+    model = with_padded(LSTM(WIDTH, WIDTH))
+    for node in model.walk():
+        node.ops = ops
+    Xs = [_get_floats(ops, SEQ_LENGTH, WIDTH) for _ in range(n_seqs)]
+    model.initialize(X=Xs)
+    return _time_layer(model, Xs, is_train), n_tokens
+
+
+@benchmark("layers.LSTM.predict", "layers")
+def bench_lstm_predict(ops: Ops, scale: float) -> BenchmarkT:
+    return _bench_lstm(ops, scale, False)
+
+
+@benchmark("layers.LSTM.update", "layers")
+def bench_lstm_update(ops: Ops, scale: float) -> BenchmarkT:
+    return _bench_lstm(ops, scale, True)
+
+
+def _bench_sparse_linear(ops: Ops, scale: float, is_train: bool) -> BenchmarkT:
+    # One item is one document of SEQ_LENGTH features.
+    n_tokens, n_docs = _get_sizes(scale)
+    model = SparseLinear(16)
+    model.ops = ops
+    keys = _get_ids(ops, n_tokens)
+    values = ops.alloc1f(n_tokens) + 1
+    X = (keys, values, _get_lengths(ops, n_docs))
+    model.initialize()
+    return _time_layer(model, X, is_train), n_docs
+
+
+@benchmark("layers.SparseLinear.predict", "layers")
+def bench_sparse_linear_predict(ops: Ops, scale: float) -> BenchmarkT:
+    return _bench_sparse_linear(ops, scale, False)
+
+
+@benchmark("layers.SparseLinear.update", "layers")
+def bench_sparse_linear_update(ops: Ops, scale: float) -> BenchmarkT:
+    return _bench_sparse_linear(ops, scale, True)
+
+
+def _bench_attention(ops: Ops, scale: float, is_train: bool) -> BenchmarkT:
+    n_tokens, n_seqs = _get_sizes(scale)
+    model = ParametricAttention(WIDTH)
+    model.ops = ops
+    X = Ragged(_get_floats(ops, n_tokens, WIDTH), _get_lengths(ops, n_seqs))
+    model.initialize(X=X)
+    return _time_layer(model, X, is_train), n_tokens
+
+
+@benchmark("layers.ParametricAttention.predict", "layers")
+def bench_attention_predict(ops: Ops, scale: float) -> BenchmarkT:
+    return _bench_attention(ops, scale, False)
+
+
+@benchmark("layers.ParametricAttention.update", "layers")
+def bench_attention_update(ops: Ops, scale: float) -> BenchmarkT:
+    return _bench_attention(ops, scale, True)
@@ -1,4 +1,7 @@
-from typing import Callable, cast
+from typing import Callable, List, Optional, Tuple, TypeVar, cast
+from contextvars import ContextVar
+import functools
+import threading
 import numpy
 
 from .backends import Ops
@@ -13,10 +16,57 @@ from .util import partial
 # Initialize via numpy, before copying to ops. This makes it easier to work with
 # the different backends, because the backend won't affect the randomization.
 
+# While Model.initialize(..., shape_only=True) runs a layer's init function,
+# this holds a list that the initializers below append to: instead of drawing
+# random numbers, they return a placeholder that only records the shape, and
+# how to fill in the values later.
+DEFERRED_INITS: ContextVar[
+    Optional[List[Tuple[FloatsXd, Callable[[], FloatsXd]]]]
+] = ContextVar("deferred_inits", default=None)
 
+# The random state used to fill in a deferred parameter in this thread.
+_deferred_random = threading.local()
+
+InitT = TypeVar("InitT", bound=Callable[..., FloatsXd])
+
+
+def deferrable(init: InitT) -> InitT:
+    """Allow an initializer to be deferred by shape-only initialization. The
+    seed for the values is drawn when the initializer is called, so the values
+    don't depend on when, or in which order, the parameters are filled in.
+    """
+
+    @functools.wraps(init)
+    def deferrable_init(ops: Ops, shape: Shape, **kwargs) -> FloatsXd:
+        deferred = DEFERRED_INITS.get()
+        if deferred is None:
+            return init(ops, shape, **kwargs)
+        seed = int(numpy.random.randint(0, 2 ** 31 - 1))
+        placeholder = ops.xp.broadcast_to(ops.xp.zeros((), dtype="float32"), shape)
+        fill = functools.partial(_init_seeded, init, seed, ops, shape, **kwargs)
+        deferred.append((placeholder, fill))
+        return placeholder
+
+    return cast(InitT, deferrable_init)
+
+
+def _init_seeded(init: Callable, seed: int, ops: Ops, shape: Shape, **kwargs):
+    _deferred_random.state = numpy.random.RandomState(seed)
+    try:
+        return init(ops, shape, **kwargs)
+    finally:
+        _deferred_random.state = None
+
+
+def _random():
+    state = getattr(_deferred_random, "state", None)
+    return state if state is not None else numpy.random
+
+
+@deferrable
 def lecun_normal_init(ops: Ops, shape: Shape) -> FloatsXd:
     scale = numpy.sqrt(1.0 / shape[1])
-    return ops.asarray_f(cast(FloatsXd, numpy.random.normal(0, scale, shape)))
+    return ops.asarray_f(cast(FloatsXd, _random().normal(0, scale, shape)))
 
 
 @registry.initializers("lecun_normal_init.v1")
@@ -24,9 +74,10 @@ def configure_lecun_normal_init() -> Callable[[Shape], FloatsXd]:
     return partial(lecun_normal_init)
 
 
+@deferrable
 def he_normal_init(ops: Ops, shape: Shape) -> FloatsXd:
     scale = numpy.sqrt(2.0 / shape[1])
-    return ops.asarray_f(cast(FloatsXd, numpy.random.normal(0, scale, shape)))
+    return ops.asarray_f(cast(FloatsXd, _random().normal(0, scale, shape)))
 
 
 @registry.initializers("he_normal_init.v1")
@@ -34,9 +85,10 @@ def configure_he_normal_init() -> Callable[[Shape], FloatsXd]:
     return partial(he_normal_init)
 
 
+@deferrable
 def glorot_normal_init(ops: Ops, shape: Shape) -> FloatsXd:
     scale = numpy.sqrt(2.0 / (shape[1] + shape[0]))
-    return ops.asarray_f(cast(FloatsXd, numpy.random.normal(0, scale, shape)))
+    return ops.asarray_f(cast(FloatsXd, _random().normal(0, scale, shape)))
 
 
 @registry.initializers("glorot_normal_init.v1")
@@ -44,9 +96,10 @@ def configure_glorot_normal_init() -> Callable[[Shape], FloatsXd]:
     return partial(glorot_normal_init)
 
 
+@deferrable
 def he_uniform_init(ops: Ops, shape: Shape) -> FloatsXd:
     scale = numpy.sqrt(6.0 / shape[1])
-    return ops.asarray_f(cast(FloatsXd, numpy.random.uniform(-scale, scale, shape)))
+    return ops.asarray_f(cast(FloatsXd, _random().uniform(-scale, scale, shape)))
 
 
 @registry.initializers("he_uniform_init.v1")
@@ -54,9 +107,10 @@ def configure_he_uniform_init() -> Callable[[Shape], FloatsXd]:
     return partial(he_uniform_init)
 
 
+@deferrable
 def lecun_uniform_init(ops: Ops, shape: Shape) -> FloatsXd:
     scale = numpy.sqrt(3.0 / shape[1])
-    return ops.asarray_f(cast(FloatsXd, numpy.random.uniform(-scale, scale, shape)))
+    return ops.asarray_f(cast(FloatsXd, _random().uniform(-scale, scale, shape)))
 
 
 @registry.initializers("lecun_uniform_init.v1")
@@ -64,9 +118,10 @@ def configure_lecun_uniform_init() -> Callable[[Shape], FloatsXd]:
     return partial(lecun_uniform_init)
 
 
+@deferrable
 def glorot_uniform_init(ops: Ops, shape: Shape) -> FloatsXd:
     scale = numpy.sqrt(6.0 / (shape[0] + shape[1]))
-    return ops.asarray_f(cast(FloatsXd, numpy.random.uniform(-scale, scale, shape)))
+    return ops.asarray_f(cast(FloatsXd, _random().uniform(-scale, scale, shape)))
 
 
 @registry.initializers("glorot_uniform_init.v1")
@@ -74,6 +129,7 @@ def configure_glorot_uniform_init() -> Callable[[Shape], FloatsXd]:
     return partial(glorot_uniform_init)
 
 
+@deferrable
 def zero_init(ops: Ops, shape: Shape) -> FloatsXd:
     return ops.alloc(shape)
 
@@ -83,10 +139,11 @@ def configure_zero_init() -> Callable[[FloatsXd], FloatsXd]:
     return partial(zero_init)
 
 
+@deferrable
 def uniform_init(
     ops: Ops, shape: Shape, *, lo: float = -0.1, hi: float = 0.1
 ) -> FloatsXd:
-    values = numpy.random.uniform(lo, hi, shape)
+    values = _random().uniform(lo, hi, shape)
     return ops.asarray_f(cast(FloatsXd, values.astype("float32")))
 
 
@@ -97,9 +154,10 @@ def configure_uniform_init(
     return partial(uniform_init, lo=lo, hi=hi)
 
 
+@deferrable
 def normal_init(ops: Ops, shape: Shape, *, mean: float = 0) -> FloatsXd:
     size = int(ops.xp.prod(ops.xp.asarray(shape)))
-    inits = cast(FloatsXd, numpy.random.normal(scale=mean, size=size).astype("float32"))
+    inits = cast(FloatsXd, _random().normal(scale=mean, size=size).astype("float32"))
     inits = ops.reshape_f(inits, shape)
     return ops.asarray_f(inits)
 
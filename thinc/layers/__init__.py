@@ -12,6 +12,7 @@ from .maxout import Maxout
 from .mish import Mish
 from .multisoftmax import MultiSoftmax
 from .parametricattention import ParametricAttention
+from .quantized_linear import QuantizedLinear, quantize_model
 from .pytorchwrapper import PyTorchWrapper, PyTorchWrapper_v2
 from .pytorchwrapper import PyTorchRNNWrapper
 from .relu import Relu
@@ -39,6 +40,7 @@ from .map_list import map_list
 from .noop import noop
 from .residual import residual
 from .uniqued import uniqued
+from .with_cache import with_cache
 from .siamese import siamese
 from .tuplify import tuplify
 
@@ -70,6 +72,7 @@ from .with_ragged import with_ragged
 from .with_reshape import with_reshape
 from .with_getitem import with_getitem
 from .with_debug import with_debug
+from .with_profile import with_profile, profile_model, Profiler
 from .with_nvtx_range import with_nvtx_range
 
 
@@ -86,6 +89,8 @@ __all__ = [
     "Mish",
     "MultiSoftmax",
     "ParametricAttention",
+    "QuantizedLinear",
+    "quantize_model",
     "PyTorchLSTM",
     "PyTorchWrapper",
     "PyTorchWrapper_v2",
@@ -104,6 +109,7 @@ __all__ = [
     "noop",
     "residual",
     "uniqued",
+    "with_cache",
     "siamese",
     "reduce_first",
     "reduce_last",
@@ -126,6 +132,9 @@ __all__ = [
     "with_padded",
     "with_flatten",
     "with_debug",
+    "with_profile",
+    "profile_model",
+    "Profiler",
     "with_nvtx_range",
     "remap_ids",
 ]
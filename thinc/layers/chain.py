@@ -1,4 +1,4 @@
-from typing import Tuple, Callable, Optional, TypeVar, Any, Dict
+from typing import Tuple, Callable, Optional, TypeVar, Any, Dict, cast
 
 from ..model import Model
 from ..config import registry
@@ -41,6 +41,7 @@ def chain(
         init=init,
         dims=dims,
         layers=layers,
+        predict=predict,
     )
     return model
 
@@ -64,6 +65,15 @@ def forward(model: Model[InT, OutT], X: InT, is_train: bool) -> Tuple[OutT, Call
     return Y, backprop
 
 
+def predict(model: Model[InT, OutT], X: InT) -> OutT:
+    """Apply the layers of `model` in sequence without keeping track of the
+    intermediate outputs for backprop.
+    """
+    for layer in model.layers:
+        X = layer.predict(X)
+    return cast(OutT, X)
+
+
 def init(
     model: Model[InT, OutT], X: Optional[InT] = None, Y: Optional[OutT] = None
 ) -> Model[InT, OutT]:
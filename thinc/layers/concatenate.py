@@ -37,6 +37,7 @@ def concatenate(*layers: Model) -> Model[InT, XY_XY_OutT]:
         init=init,
         dims=dims,
         layers=layers,
+        predict=predict,
     )
 
 
@@ -50,6 +51,19 @@ def forward(model: Model[InT, OutT], X: InT, is_train: bool) -> Tuple[OutT, Call
         return _array_forward(model, X, Ys, callbacks, is_train)  # type: ignore
 
 
+def predict(model: Model[InT, OutT], X: InT) -> OutT:
+    Ys = [layer.predict(X) for layer in model.layers]
+    if isinstance(Ys[0], list):
+        lengths = model.ops.asarray1i([len(x) for x in X])
+        Ys = [model.ops.xp.concatenate(Y, axis=0) for Y in Ys]
+        output = model.ops.unflatten(model.ops.xp.hstack(Ys), lengths)
+    elif isinstance(Ys[0], Ragged):
+        output = Ragged(model.ops.xp.hstack([y.data for y in Ys]), Ys[0].lengths)
+    else:
+        output = model.ops.xp.hstack(Ys)
+    return cast(OutT, output)
+
+
 def _array_forward(
     model: Model[InT, Array2d], X, Ys, callbacks, is_train: bool
 ) -> Tuple[Array2d, Callable]:
@@ -42,23 +42,23 @@ def _dropout_array(
     model: Model[ArrayT, ArrayT], X: ArrayT, is_train: bool
 ) -> Tuple[ArrayT, Callable]:
     rate = model.attrs["dropout_rate"]
-    mask = model.ops.get_dropout_mask(X.shape, rate)
+    Y, mask = model.ops.dropout(X, rate)
 
     def backprop(dY: ArrayT) -> ArrayT:
-        return dY * mask
+        return model.ops.backprop_dropout(dY, mask, rate)
 
-    return X * mask, backprop
+    return Y, backprop
 
 
 def _dropout_padded(
     model: Model, Xp: Padded, is_train: bool
 ) -> Tuple[Padded, Callable]:
-    X = Xp.data
-    mask = model.ops.get_dropout_mask(X.shape, model.attrs["dropout_rate"])
-    Y = X * mask
+    rate = model.attrs["dropout_rate"]
+    Y, mask = model.ops.dropout(Xp.data, rate)
 
     def backprop(dYp: Padded) -> Padded:
-        return Padded(dYp.data * mask, dYp.size_at_t, dYp.lengths, dYp.indices)
+        dX = model.ops.backprop_dropout(dYp.data, mask, rate)
+        return Padded(dX, dYp.size_at_t, dYp.lengths, dYp.indices)
 
     return Padded(Y, Xp.size_at_t, Xp.lengths, Xp.indices), backprop
 
@@ -66,25 +66,26 @@ def _dropout_padded(
 def _dropout_ragged(
     model: Model, Xr: Ragged, is_train: bool
 ) -> Tuple[Ragged, Callable]:
-    X = Xr.data
-    lengths = Xr.lengths
-    mask = model.ops.get_dropout_mask(X.shape, model.attrs["dropout_rate"])
-    Y = X * mask
+    rate = model.attrs["dropout_rate"]
+    Y, mask = model.ops.dropout(Xr.data, rate)
 
     def backprop(dYr: Ragged) -> Ragged:
-        return Ragged(dYr.data * mask, dYr.lengths)
+        return Ragged(model.ops.backprop_dropout(dYr.data, mask, rate), dYr.lengths)
 
-    return Ragged(Y, lengths), backprop
+    return Ragged(Y, Xr.lengths), backprop
 
 
 def _dropout_lists(
     model: Model[ArrayT, ArrayT], Xs: List[ArrayT], is_train: bool
 ) -> Tuple[List[ArrayT], Callable]:
     rate = model.attrs["dropout_rate"]
-    masks = [model.ops.get_dropout_mask(X.shape, rate) for X in Xs]
-    Ys = [X * mask for X, mask in zip(Xs, masks)]
+    results = [model.ops.dropout(X, rate) for X in Xs]
+    Ys = [Y for Y, _ in results]
+    masks = [mask for _, mask in results]
 
     def backprop(dYs: List[ArrayT]) -> List[ArrayT]:
-        return [dY * mask for dY, mask in zip(dYs, masks)]
+        return [
+            model.ops.backprop_dropout(dY, mask, rate) for dY, mask in zip(dYs, masks)
+        ]
 
     return Ys, backprop
@@ -4,7 +4,7 @@ from .chain import chain
 from .array_getitem import ints_getitem
 from ..model import Model
 from ..config import registry
-from ..types import Ints1d, Ints2d, Floats1d, Floats2d
+from ..types import RowSparse, Ints1d, Ints2d, Floats1d, Floats2d
 from ..initializers import uniform_init
 from ..util import get_width, partial
 
@@ -20,10 +20,16 @@ def Embed(
     *,
     column: Optional[int] = None,
     initializer: Callable = uniform_init,
-    dropout: Optional[float] = None
+    dropout: Optional[float] = None,
+    sparse_grad: bool = False
 ) -> Model[InT, OutT]:
-    """Map integers to vectors, using a fixed-size lookup table."""
-    attrs: Dict[str, Union[None, int, float]] = {}
+    """Map integers to vectors, using a fixed-size lookup table.
+
+    If sparse_grad is True, the gradient of the table is reported as a
+    RowSparse object that only holds the rows in the batch, so that the
+    optimizer can update just those rows.
+    """
+    attrs: Dict[str, Union[None, int, float]] = {"sparse_grad": sparse_grad}
     if dropout is not None:
         attrs["dropout_rate"] = dropout
     model = Model(  # type: ignore
@@ -61,9 +67,15 @@ def forward(
     def backprop(d_output: OutT) -> Ints1d:
         if drop_mask is not None:
             d_output *= drop_mask
-        d_vectors = model.ops.alloc2f(*vectors.shape)
-        model.ops.scatter_add(d_vectors, ids, d_output)
-        model.inc_grad("E", d_vectors)
+        if model.attrs.get("sparse_grad"):
+            rows = model.ops.asarray_i(ids)
+            # The caller may reuse d_output, so the rows are copied.
+            d_rows = d_output.copy()
+            model.inc_grad("E", RowSparse(rows, d_rows, vectors.shape))
+        else:
+            d_vectors = model.ops.alloc2f(*vectors.shape)
+            model.ops.scatter_add(d_vectors, ids, d_output)
+            model.inc_grad("E", d_vectors)
         dX = model.ops.alloc1i(nN)
         return dX
 
@@ -26,6 +26,7 @@ def HardSwishMobilenet(
         init=partial(init, init_W, init_b),
         dims={"nO": nO, "nI": nI},
         params={"W": None, "b": None},
+        predict=predict,
     )
     if normalize:
         model = chain(model, LayerNorm(nI=nO))
@@ -38,20 +39,26 @@ def forward(model: Model[Floats2d, Floats2d],
             X: Floats2d, is_train: bool) -> Tuple[Floats2d, Callable]:
     W = cast(Floats2d, model.get_param("W"))
     b = cast(Floats1d, model.get_param("b"))
-    Y_preact = model.ops.affine(X, W, b)
-    Y = model.ops.hard_swish_mobilenet(Y_preact)
+    Y, Y_preact = model.ops.affine_act(X, W, b, "hard_swish_mobilenet")
 
     def backprop(dY: Floats2d) -> Floats2d:
-        dY = model.ops.backprop_hard_swish_mobilenet(dY,
-                                                     Y_preact,
-                                                     inplace=False)
-        model.inc_grad("b", dY.sum(axis=0))
-        model.inc_grad("W", model.ops.gemm(dY, X, trans1=True))
-        return model.ops.gemm(dY, W)
+        dX, dW, db = model.ops.backprop_affine_act(
+            dY, X, W, Y, Y_preact, "hard_swish_mobilenet"
+        )
+        model.inc_grad("b", db)
+        model.inc_grad("W", dW)
+        return dX
 
     return Y, backprop
 
 
+def predict(model: Model[Floats2d, Floats2d], X: Floats2d) -> Floats2d:
+    W = cast(Floats2d, model.get_param("W"))
+    b = cast(Floats1d, model.get_param("b"))
+    Y, _ = model.ops.affine_act(X, W, b, "hard_swish_mobilenet", keep_preact=False)
+    return Y
+
+
 def init(
     init_W: Callable,
     init_b: Callable,
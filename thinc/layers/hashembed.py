@@ -4,7 +4,7 @@ from .chain import chain
 from .array_getitem import ints_getitem
 from ..model import Model
 from ..config import registry
-from ..types import Floats1d, Floats2d, Ints2d, Ints1d
+from ..types import RowSparse, Floats1d, Floats2d, Ints2d, Ints1d
 from ..initializers import uniform_init
 from ..util import partial
 
@@ -21,7 +21,8 @@ def HashEmbed(
     seed: Optional[int] = None,
     column: Optional[int] = None,
     initializer: Callable = uniform_init,
-    dropout: Optional[float] = None
+    dropout: Optional[float] = None,
+    sparse_grad: bool = False
 ) -> Model[InT, OutT]:
     """
     An embedding layer that uses the “hashing trick” to map keys to distinct values.
@@ -31,8 +32,16 @@ def HashEmbed(
     it’s unlikely that two different keys will collide on all four “buckets”,
     most distinct keys will receive a distinct vector under this scheme, even
     when the number of vectors in the table is very low.
+
+    If sparse_grad is True, the gradient of the table is reported as a
+    RowSparse object that only holds the rows in the batch, so that the
+    optimizer can update just those rows.
     """
-    attrs: Dict[str, Any] = {"column": column, "seed": seed}
+    attrs: Dict[str, Any] = {
+        "column": column,
+        "seed": seed,
+        "sparse_grad": sparse_grad,
+    }
     if dropout is not None:
         attrs["dropout_rate"] = dropout
     model = Model(  # type: ignore
@@ -79,11 +88,18 @@ def forward(
     def backprop(d_vectors: OutT) -> Ints1d:
         if drop_mask is not None:
             d_vectors *= drop_mask
-        dE = model.ops.alloc2f(*vectors.shape)
-        keysT = model.ops.as_contig(keys.T, dtype="i")
-        for i in range(keysT.shape[0]):
-            model.ops.scatter_add(dE, keysT[i], d_vectors)
-        model.inc_grad("E", dE)
+        if model.attrs.get("sparse_grad"):
+            # Each output row is the sum of the rows of its keys, so every
+            # key receives the gradient of its output row.
+            rows = model.ops.asarray_i(keys.ravel())
+            d_rows = model.ops.xp.repeat(d_vectors, keys.shape[1], axis=0)
+            model.inc_grad("E", RowSparse(rows, d_rows, vectors.shape))
+        else:
+            dE = model.ops.alloc2f(*vectors.shape)
+            keysT = model.ops.as_contig(keys.T, dtype="i")
+            for i in range(keysT.shape[0]):
+                model.ops.scatter_add(dE, keysT[i], d_vectors)
+            model.inc_grad("E", dE)
         dX = model.ops.alloc1i(nN)
         return dX
 
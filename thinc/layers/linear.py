@@ -26,6 +26,7 @@ def Linear(
         init=partial(init, init_W, init_b),
         dims={"nO": nO, "nI": nI},
         params={"W": None, "b": None},
+        predict=predict,
     )
 
 
@@ -43,6 +44,14 @@ def forward(model: Model[InT, OutT], X: InT, is_train: bool) -> Tuple[OutT, Call
     return Y, backprop
 
 
+def predict(model: Model[InT, OutT], X: InT) -> OutT:
+    W = cast(Floats2d, model.get_param("W"))
+    b = cast(Floats1d, model.get_param("b"))
+    Y = model.ops.gemm(X, W, trans2=True)
+    Y += b
+    return Y
+
+
 def init(
     init_W: Callable,
     init_b: Callable,
@@ -31,6 +31,7 @@ def Maxout(
         init=partial(init, init_W, init_b),
         dims={"nO": nO, "nI": nI, "nP": nP},
         params={"W": None, "b": None},
+        predict=predict,
     )
     if normalize:
         model = chain(model, LayerNorm(nI=nO))
@@ -40,29 +41,24 @@ def Maxout(
 
 
 def forward(model: Model[InT, OutT], X: InT, is_train: bool) -> Tuple[OutT, Callable]:
-    nO = model.get_dim("nO")
-    nP = model.get_dim("nP")
-    nI = model.get_dim("nI")
-    b = model.get_param("b")
     W = model.get_param("W")
-    W = model.ops.reshape2f(W, nO * nP, nI)
-    Y = model.ops.gemm(X, W, trans2=True)
-    Y += model.ops.reshape1f(b, nO * nP)
-    Z = model.ops.reshape3f(Y, Y.shape[0], nO, nP)
-    best, which = model.ops.maxout(Z)
+    b = model.get_param("b")
+    best, which = model.ops.affine_maxout(X, W, b)
 
     def backprop(d_best: OutT) -> InT:
-        dZ = model.ops.backprop_maxout(d_best, which, nP)
-        # TODO: Add sum methods for Floats3d
-        model.inc_grad("b", dZ.sum(axis=0))  # type: ignore
-        dY = model.ops.reshape2f(dZ, dZ.shape[0], nO * nP)
-        dW = model.ops.reshape3f(model.ops.gemm(dY, X, trans1=True), nO, nP, nI)
+        dX, dW, db = model.ops.backprop_affine_maxout(d_best, X, W, which)
+        model.inc_grad("b", db)
         model.inc_grad("W", dW)
-        return model.ops.gemm(dY, model.ops.reshape2f(W, nO * nP, nI))
+        return dX
 
     return best, backprop
 
 
+def predict(model: Model[InT, OutT], X: InT) -> OutT:
+    best, _ = model.ops.affine_maxout(X, model.get_param("W"), model.get_param("b"))
+    return best
+
+
 def init(
     init_W: Callable,
     init_b: Callable,
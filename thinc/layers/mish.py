@@ -33,6 +33,7 @@ def Mish(
         init=partial(init, init_W, init_b),
         dims={"nO": nO, "nI": nI},
         params={"W": None, "b": None},
+        predict=predict,
     )
     if normalize:
         model = chain(model, cast(Model[InT, OutT], LayerNorm(nI=nO)))
@@ -44,20 +45,24 @@ def Mish(
 def forward(model: Model[InT, OutT], X: InT, is_train: bool) -> Tuple[OutT, Callable]:
     W = cast(Floats2d, model.get_param("W"))
     b = cast(Floats1d, model.get_param("b"))
-    Y_pre_mish = model.ops.gemm(X, W, trans2=True)
-    Y_pre_mish += b
-    Y = model.ops.mish(Y_pre_mish)
+    Y, Y_preact = model.ops.affine_act(X, W, b, "mish")
 
     def backprop(dY: OutT) -> InT:
-        dY_pre_mish = model.ops.backprop_mish(dY, Y_pre_mish)
-        model.inc_grad("W", model.ops.gemm(dY_pre_mish, X, trans1=True))
-        model.inc_grad("b", dY_pre_mish.sum(axis=0))
-        dX = model.ops.gemm(dY_pre_mish, W)
+        dX, dW, db = model.ops.backprop_affine_act(dY, X, W, Y, Y_preact, "mish")
+        model.inc_grad("W", dW)
+        model.inc_grad("b", db)
         return dX
 
     return Y, backprop
 
 
+def predict(model: Model[InT, OutT], X: InT) -> OutT:
+    W = cast(Floats2d, model.get_param("W"))
+    b = cast(Floats1d, model.get_param("b"))
+    Y, _ = model.ops.affine_act(X, W, b, "mish", keep_preact=False)
+    return Y
+
+
 def init(
     init_W: Callable,
     init_b: Callable,
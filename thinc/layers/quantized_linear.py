@@ -0,0 +1,190 @@
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, TypeVar, cast
+
+from ..model import Model
+from ..config import registry
+from ..types import Floats1d, Floats2d, Ints2d
+from ..util import get_width
+
+
+InT = Floats2d
+OutT = Floats2d
+_ModelT = TypeVar("_ModelT", bound=Model)
+
+# The activations of the layers that quantize_model rewrites, by node name.
+QUANTIZED_LAYERS = {
+    "linear": None,
+    "relu": "relu",
+    "maxout": "maxout",
+    "softmax": "softmax",
+}
+INT8_MAX = 127
+
+
+@registry.layers("QuantizedLinear.v1")
+def QuantizedLinear(
+    nO: Optional[int] = None,
+    nI: Optional[int] = None,
+    nP: int = 1,
+    *,
+    activation: Optional[str] = None,
+) -> Model[InT, OutT]:
+    """An inference-only weights layer with int8 weights, created by
+    quantize_model from a Linear, Relu, Maxout or Softmax layer. The inputs
+    are quantized to int8 with the scale found during calibration, multiplied
+    by the weights with int32 accumulation, and scaled back to floats before
+    the bias and the activation are applied. The activation can be None,
+    "relu", "softmax" or "maxout", which takes the maximum of nP pieces.
+    """
+    if activation not in QUANTIZED_LAYERS.values():
+        raise ValueError(f"Invalid activation for QuantizedLinear: {activation}")
+    return Model(
+        "quantized_linear",
+        forward,
+        init=init,
+        dims={"nO": nO, "nI": nI, "nP": nP},
+        params={"W": None, "W_scale": None, "b": None},
+        attrs={"activation": activation, "X_scale": 1.0},
+        predict=predict,
+    )
+
+
+def forward(model: Model[InT, OutT], X: InT, is_train: bool) -> Tuple[OutT, Callable]:
+    Y = predict(model, X)
+
+    def backprop(dY: OutT) -> InT:
+        raise ValueError("Quantized layers can only be used for inference")
+
+    return Y, backprop
+
+
+def predict(model: Model[InT, OutT], X: InT) -> OutT:
+    ops = model.ops
+    W = cast(Ints2d, model.get_param("W"))
+    W_scale = cast(Floats1d, model.get_param("W_scale"))
+    b = cast(Floats1d, model.get_param("b"))
+    X_scale = model.attrs["X_scale"]
+    Xq = ops.xp.rint(X * (1.0 / X_scale))
+    Xq = ops.xp.clip(Xq, -INT8_MAX, INT8_MAX, out=Xq).astype("int8")
+    Y = ops.gemm_int8(Xq, W, trans2=True).astype("float32")
+    Y *= W_scale * X_scale
+    Y += b
+    activation = model.attrs["activation"]
+    if activation == "relu":
+        Y = ops.relu(Y, inplace=True)
+    elif activation == "softmax":
+        Y = ops.softmax(Y, inplace=True)
+    elif activation == "maxout":
+        nO = model.get_dim("nO")
+        nP = model.get_dim("nP")
+        Y, _ = ops.maxout(ops.reshape3f(Y, Y.shape[0], nO, nP))
+    return Y
+
+
+def init(
+    model: Model[InT, OutT], X: Optional[InT] = None, Y: Optional[OutT] = None
+) -> Model[InT, OutT]:
+    # The weights are set by quantize_model or loaded with from_bytes, so
+    # only the dimensions are inferred here.
+    if X is not None and not model.has_dim("nI"):
+        model.set_dim("nI", get_width(X))
+    if Y is not None and not model.has_dim("nO"):
+        model.set_dim("nO", get_width(Y))
+    return model
+
+
+def quantize_model(model: _ModelT, X: Optional[Iterable[InT]] = None) -> _ModelT:
+    """Rewrite the Linear, Relu, Maxout and Softmax layers of a model to
+    QuantizedLinear layers for inference, with per-row int8 weights. The
+    scales of the layers' inputs are calibrated on the batches X, by running
+    them through the model with predict and taking the maximum absolute value
+    that each layer receives. If X is None, only the model's structure is
+    changed and the params are left unset, e.g. to load a quantized model
+    with from_bytes. The model is modified in-place, unless it's a layer that
+    is rewritten itself: use the returned model.
+    """
+    nodes = [node for node in model.walk() if _can_quantize(node)]
+    X_max = _calibrate(model, nodes, X) if X is not None else {}
+    for node in nodes:
+        quantized = _quantize_layer(node, X_max.get(node.id))
+        if node is model:
+            return cast(_ModelT, quantized)
+        model.replace_node(node, quantized)
+    return model
+
+
+def _can_quantize(node: Model) -> bool:
+    if node.name not in QUANTIZED_LAYERS or node.layers:
+        return False
+    return set(node.param_names) == {"W", "b"}
+
+
+def _calibrate(
+    model: Model, nodes: List[Model], batches: Iterable[InT]
+) -> Dict[int, float]:
+    # Wrap the nodes' callbacks to record their inputs while the batches are
+    # predicted. Combinators may call either of them.
+    X_max: Dict[int, float] = {node.id: 0.0 for node in nodes}
+    callbacks = {node.id: (node._func, node._predict_func, node.init) for node in nodes}
+
+    def record(node: Model, X: InT) -> None:
+        if X.size:
+            X_max[node.id] = max(X_max[node.id], float(node.ops.xp.abs(X).max()))
+
+    for node in nodes:
+        orig_forward, orig_predict, orig_init = callbacks[node.id]
+        node.replace_callbacks(
+            _recording_forward(orig_forward, record),
+            init=orig_init,
+            predict=_recording_predict(orig_predict, record) if orig_predict else None,
+        )
+    try:
+        for X in batches:
+            model.predict(X)
+    finally:
+        for node in nodes:
+            orig_forward, orig_predict, orig_init = callbacks[node.id]
+            node.replace_callbacks(orig_forward, init=orig_init, predict=orig_predict)
+    return X_max
+
+
+def _recording_forward(orig_forward: Callable, record: Callable) -> Callable:
+    def forward(model: Model, X: InT, is_train: bool) -> Tuple[OutT, Callable]:
+        record(model, X)
+        return orig_forward(model, X, is_train)
+
+    return forward
+
+
+def _recording_predict(orig_predict: Callable, record: Callable) -> Callable:
+    def predict(model: Model, X: InT) -> OutT:
+        record(model, X)
+        return orig_predict(model, X)
+
+    return predict
+
+
+def _quantize_layer(node: Model, X_max: Optional[float]) -> Model:
+    activation = QUANTIZED_LAYERS[node.name]
+    nP = node.get_dim("nP") if activation == "maxout" else 1
+    quantized = QuantizedLinear(
+        node.maybe_get_dim("nO"),
+        node.maybe_get_dim("nI"),
+        nP,
+        activation=activation,
+    )
+    quantized.ops = node.ops
+    if X_max is None or not node.has_param("W"):
+        return quantized
+    ops = node.ops
+    W = node.get_param("W")
+    W = ops.reshape2f(W, W.shape[0] * nP, W.shape[-1])
+    # Each row of the weights gets its own scale, so that rows with small
+    # weights keep their precision.
+    W_scale = ops.xp.abs(W).max(axis=1) / INT8_MAX
+    W_scale[W_scale == 0] = 1.0
+    W_q = ops.xp.rint(W / W_scale[:, None]).astype("int8")
+    quantized.set_param("W", W_q)
+    quantized.set_param("W_scale", W_scale.astype("float32"))
+    quantized.set_param("b", ops.asarray1f(node.get_param("b").ravel()))
+    quantized.attrs["X_scale"] = X_max / INT8_MAX if X_max > 0 else 1.0
+    return quantized
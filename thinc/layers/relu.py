@@ -30,6 +30,7 @@ def Relu(
         init=partial(init, init_W, init_b),
         dims={"nO": nO, "nI": nI},
         params={"W": None, "b": None},
+        predict=predict,
     )
     if normalize:
         model = chain(model, LayerNorm(nI=nO))
@@ -41,18 +42,24 @@ def Relu(
 def forward(model: Model[InT, OutT], X: InT, is_train: bool) -> Tuple[OutT, Callable]:
     W = cast(Floats2d, model.get_param("W"))
     b = cast(Floats1d, model.get_param("b"))
-    Y = model.ops.affine(X, W, b)
-    Y = model.ops.relu(Y)
+    Y, Y_preact = model.ops.affine_act(X, W, b, "relu")
 
     def backprop(dY: OutT) -> InT:
-        dY = model.ops.backprop_relu(dY, Y)
-        model.inc_grad("b", dY.sum(axis=0))
-        model.inc_grad("W", model.ops.gemm(dY, X, trans1=True))
-        return model.ops.gemm(dY, W)
+        dX, dW, db = model.ops.backprop_affine_act(dY, X, W, Y, Y_preact, "relu")
+        model.inc_grad("W", dW)
+        model.inc_grad("b", db)
+        return dX
 
     return Y, backprop
 
 
+def predict(model: Model[InT, OutT], X: InT) -> OutT:
+    W = cast(Floats2d, model.get_param("W"))
+    b = cast(Floats1d, model.get_param("b"))
+    Y, _ = model.ops.affine_act(X, W, b, "relu", keep_preact=False)
+    return Y
+
+
 def init(
     init_W: Callable,
     init_b: Callable,
@@ -73,6 +73,7 @@ def resize_linear_weighted(
         attrs=layer.attrs,
         refs={},
         ops=layer.ops,
+        predict=layer._predict_func,
     )
     new_layer.initialize()
     for name in layer.param_names:
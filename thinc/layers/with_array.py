@@ -22,6 +22,7 @@ def with_array(layer: Model[ArrayXd, ArrayXd], pad: int = 0) -> Model[SeqT, SeqT
         layers=[layer],
         attrs={"pad": pad},
         dims={name: layer.maybe_get_dim(name) for name in layer.dim_names},
+        predict=predict,
     )
 
 
@@ -40,6 +41,22 @@ def forward(model: Model[SeqT, SeqT], Xseq: SeqT, is_train: bool):
         return _list_forward(cast(Model[List2d, List2d], model), Xseq, is_train)
 
 
+def predict(model: Model[SeqT, SeqT], Xseq: SeqT) -> SeqT:
+    layer: Model[ArrayXd, ArrayXd] = model.layers[0]
+    if isinstance(Xseq, Ragged):
+        return cast(SeqT, Ragged(layer.predict(Xseq.dataXd), Xseq.lengths))
+    elif isinstance(Xseq, Padded):
+        Y = layer.predict(Xseq.data)
+        return cast(SeqT, Padded(Y, Xseq.size_at_t, Xseq.lengths, Xseq.indices))
+    elif not isinstance(Xseq, (list, tuple)):
+        return cast(SeqT, layer.predict(Xseq))
+    else:
+        pad = model.attrs["pad"]
+        lengths = layer.ops.asarray1i([len(seq) for seq in Xseq])
+        Yf = layer.predict(layer.ops.flatten(Xseq, pad=pad))  # type: ignore
+        return cast(SeqT, layer.ops.unflatten(Yf, lengths, pad=pad))
+
+
 def init(
     model: Model[SeqT, SeqT], X: Optional[SeqT] = None, Y: Optional[SeqT] = None
 ) -> Model[SeqT, SeqT]:
@@ -0,0 +1,232 @@
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple, TypeVar
+from collections import OrderedDict
+import sys
+import threading
+
+from ..model import Model, serialize_attr, deserialize_attr
+from ..config import registry
+
+
+InT = TypeVar("InT")
+OutT = TypeVar("OutT")
+
+
+class LayerCache:
+    """A thread-safe LRU cache of layer outputs, used by with_cache. The
+    key_fn maps an input to its key. Entries are evicted once there are more
+    than max_entries, or once their outputs take up more than max_bytes.
+    """
+
+    key_fn: Callable[[Any], Hashable]
+    max_entries: int
+    max_bytes: Optional[int]
+    n_bytes: int
+    hits: int
+    misses: int
+
+    def __init__(
+        self,
+        key_fn: Callable[[Any], Hashable],
+        max_entries: int,
+        max_bytes: Optional[int] = None,
+    ):
+        if max_entries < 1:
+            raise ValueError(f"Invalid max_entries: {max_entries}")
+        self.key_fn = key_fn
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Hashable, Tuple[Any, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._params_version: Optional[Hashable] = None
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __deepcopy__(self, memo: Dict) -> "LayerCache":
+        # Copies of the model start out with an empty cache.
+        return LayerCache(self.key_fn, self.max_entries, self.max_bytes)
+
+    @property
+    def hit_rate(self) -> float:
+        """The share of lookups that were found in the cache."""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get_many(self, keys: List[Hashable]) -> List[Optional[Any]]:
+        """Look up the outputs for the given keys, with None for the keys that
+        aren't in the cache.
+        """
+        outputs: List[Optional[Any]] = []
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    self.misses += 1
+                    outputs.append(None)
+                else:
+                    self.hits += 1
+                    self._entries.move_to_end(key)
+                    outputs.append(entry[0])
+        return outputs
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """Add an output to the cache, evicting the least recently used
+        entries if the cache is full.
+        """
+        n_bytes = getattr(value, "nbytes", None)
+        if n_bytes is None:
+            n_bytes = sys.getsizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self.n_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, n_bytes)
+            self.n_bytes += n_bytes
+            while len(self._entries) > self.max_entries or (
+                self.max_bytes is not None and self.n_bytes > self.max_bytes
+            ):
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self.n_bytes -= evicted_bytes
+
+    def check_params_version(self, version: Hashable) -> None:
+        """Clear the cache if the version of the params that its outputs were
+        computed with has changed.
+        """
+        with self._lock:
+            if version != self._params_version:
+                self._entries.clear()
+                self.n_bytes = 0
+                self._params_version = version
+
+    def clear(self) -> None:
+        """Remove all entries. The hit and miss counts are kept."""
+        with self._lock:
+            self._entries.clear()
+            self.n_bytes = 0
+
+
+@serialize_attr.register(LayerCache)
+def serialize_cache(
+    _: LayerCache, value: LayerCache, name: str, model: Model
+) -> bytes:
+    # The cached outputs aren't saved with the model.
+    return b""
+
+
+@deserialize_attr.register(LayerCache)
+def deserialize_cache(
+    default: LayerCache, value: bytes, name: str, model: Model
+) -> LayerCache:
+    default.clear()
+    return default
+
+
+@registry.layers("with_cache.v1")
+def with_cache(
+    layer: Model[InT, OutT],
+    key_fn: Optional[Callable[[Any], Hashable]] = None,
+    max_entries: int = 10000,
+    max_bytes: Optional[int] = None,
+) -> Model[InT, OutT]:
+    """Memoize the outputs of a deterministic layer across calls, e.g. for
+    embeddings or feature extractors that see the same inputs over and over.
+    If the input is an array, each row is cached separately; if it's a list,
+    each item is. The key_fn maps a row or item to its cache key, by default
+    the bytes of arrays or the item itself. The least recently used entries
+    are evicted once there are more than max_entries, or once the outputs
+    take up more than max_bytes.
+
+    The cache is only used when predicting. Calls with is_train=True go
+    straight to the layer and clear the cache, as the weights are about to
+    change. The cache is also cleared whenever the layer's params are set or
+    updated, e.g. by Model.use_params or Model.finish_update.
+    """
+    return Model(
+        f"with_cache({layer.name})",
+        forward,
+        init=init,
+        layers=[layer],
+        dims={name: layer.maybe_get_dim(name) for name in layer.dim_names},
+        attrs={
+            "cache": LayerCache(
+                key_fn if key_fn is not None else _get_key, max_entries, max_bytes
+            )
+        },
+        predict=predict,
+    )
+
+
+def forward(model: Model[InT, OutT], X: InT, is_train: bool) -> Tuple[OutT, Callable]:
+    layer = model.layers[0]
+    if is_train:
+        model.attrs["cache"].clear()
+        return layer(X, is_train=True)
+
+    def backprop(dY: OutT) -> InT:
+        raise ValueError("Cannot backprop through with_cache outside of training")
+
+    return predict(model, X), backprop
+
+
+def predict(model: Model[InT, OutT], X: InT) -> OutT:
+    layer = model.layers[0]
+    cache: LayerCache = model.attrs["cache"]
+    cache.check_params_version(_get_params_version(layer))
+    is_list = isinstance(X, list)
+    keys = [cache.key_fn(x) for x in X]  # type: ignore
+    outputs = cache.get_many(keys)
+    # Compute each missing key once, even if it occurs more than once.
+    missing: Dict[Hashable, int] = {}
+    for i, (key, output) in enumerate(zip(keys, outputs)):
+        if output is None and key not in missing:
+            missing[key] = i
+    if missing:
+        indices = list(missing.values())
+        if is_list:
+            X_missing = [X[i] for i in indices]  # type: ignore
+        else:
+            X_missing = X[model.ops.asarray1i(indices)]  # type: ignore
+        Y_missing = layer.predict(X_missing)
+        computed = {}
+        for j, key in enumerate(missing):
+            value = Y_missing[j]  # type: ignore
+            # Copy array rows, so an entry doesn't keep the whole batch alive.
+            if hasattr(value, "copy"):
+                value = value.copy()
+            computed[key] = value
+            cache.put(key, value)
+        outputs = [
+            computed[key] if output is None else output
+            for key, output in zip(keys, outputs)
+        ]
+    if is_list:
+        return outputs  # type: ignore
+    elif not outputs:
+        return layer.predict(X)
+    return model.ops.xp.stack(outputs)
+
+
+def init(
+    model: Model[InT, OutT], X: Optional[InT] = None, Y: Optional[OutT] = None
+) -> Model[InT, OutT]:
+    layer = model.layers[0]
+    layer.initialize(X=X, Y=Y)
+    for dim_name in layer.dim_names:
+        value = layer.maybe_get_dim(dim_name)
+        if value is not None:
+            model.set_dim(dim_name, value)
+    model.attrs["cache"].clear()
+    return model
+
+
+def _get_params_version(layer: Model) -> Hashable:
+    servers = {id(node._params): node._params for node in layer.walk()}
+    return tuple((key, server.version) for key, server in servers.items())
+
+
+def _get_key(x: Any) -> Hashable:
+    if hasattr(x, "tobytes"):
+        return (x.shape, x.tobytes())
+    return x
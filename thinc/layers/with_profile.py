@@ -0,0 +1,272 @@
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, TypeVar, Union
+from dataclasses import dataclass
+from pathlib import Path
+import json
+import os
+import threading
+import time
+
+from wasabi import table
+
+from ..model import Model, wrap_model_recursive
+from ..types import Padded, Ragged
+from ..util import partial
+
+
+InT = TypeVar("InT")
+OutT = TypeVar("OutT")
+
+
+@dataclass
+class LayerProfile:
+    """Aggregated timings for one node of a profiled model. The total times
+    include the time spent in the node's children, the self times don't.
+    Times are in seconds.
+    """
+
+    id: int
+    name: str
+    forward_calls: int = 0
+    backward_calls: int = 0
+    forward_total: float = 0.0
+    forward_self: float = 0.0
+    backward_total: float = 0.0
+    backward_self: float = 0.0
+    output_bytes: int = 0
+    input_shape: Any = None
+    output_shape: Any = None
+
+
+class Profiler:
+    """Collect the forward and backward wall time, the call counts, the input
+    and output shapes and the bytes of the outputs of each node of a model
+    wrapped by with_profile. The timings can be printed as a table, or saved
+    as a trace for chrome://tracing or Perfetto. At most max_events calls are
+    kept for the trace, the aggregated timings are always kept.
+    """
+
+    layers: Dict[int, LayerProfile]
+    events: List[Dict[str, Any]]
+    max_events: int
+
+    def __init__(self, max_events: int = 100000):
+        self.layers = {}
+        self.events = []
+        self.max_events = max_events
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._wrapped: Set[int] = set()
+        self._start = time.perf_counter()
+
+    def clear(self) -> None:
+        """Remove the collected timings and events."""
+        with self._lock:
+            self.layers = {}
+            self.events = []
+            self._start = time.perf_counter()
+
+    def record(
+        self,
+        model: Model,
+        phase: str,
+        func: Callable,
+        *args: Any,
+        returns_callback: bool = False,
+    ) -> Tuple[Any, float]:
+        """Call func(*args) and record its timing as a "forward" or "backward"
+        call of the given node. The first argument is the input. If
+        returns_callback is True, the result is an (output, callback) tuple.
+        Returns the result and the wall time.
+        """
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        # The time spent in nested calls is added to the last item, so it
+        # can be subtracted from the self time.
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            result = func(*args)
+        finally:
+            duration = time.perf_counter() - start
+            child_time = stack.pop()
+            if stack:
+                stack[-1] += duration
+        Y = result[0] if returns_callback else result
+        input_shape = _get_shape(args[0])
+        output_shape = _get_shape(Y)
+        n_bytes = _get_nbytes(Y)
+        with self._lock:
+            stats = self.layers.get(model.id)
+            if stats is None:
+                stats = self.layers[model.id] = LayerProfile(model.id, model.name)
+            if phase == "forward":
+                stats.forward_calls += 1
+                stats.forward_total += duration
+                stats.forward_self += duration - child_time
+                stats.input_shape = input_shape
+                stats.output_shape = output_shape
+            else:
+                stats.backward_calls += 1
+                stats.backward_total += duration
+                stats.backward_self += duration - child_time
+            stats.output_bytes += n_bytes
+            if len(self.events) < self.max_events:
+                self.events.append(
+                    {
+                        "name": model.name,
+                        "cat": phase,
+                        "ph": "X",
+                        "ts": (start - self._start) * 1e6,
+                        "dur": duration * 1e6,
+                        "pid": os.getpid(),
+                        "tid": threading.get_ident(),
+                        "args": {
+                            "id": model.id,
+                            "input_shape": str(input_shape),
+                            "output_shape": str(output_shape),
+                            "output_bytes": n_bytes,
+                        },
+                    }
+                )
+        return result, duration
+
+    def format_table(self, sort_by: str = "self") -> str:
+        """Format the aggregated timings as a table, with times in
+        milliseconds. Rows are sorted by the forward plus backward self time,
+        or by the total time if sort_by is "total".
+        """
+        if sort_by not in ("self", "total"):
+            raise ValueError(f"Invalid sort_by: {sort_by}. Expected 'self' or 'total'")
+        with self._lock:
+            layers = list(self.layers.values())
+        if sort_by == "self":
+            layers.sort(key=lambda s: s.forward_self + s.backward_self, reverse=True)
+        else:
+            layers.sort(key=lambda s: s.forward_total + s.backward_total, reverse=True)
+        header = (
+            "Layer",
+            "Fwd calls",
+            "Fwd self",
+            "Fwd total",
+            "Bwd calls",
+            "Bwd self",
+            "Bwd total",
+            "Output MB",
+            "Input shape",
+            "Output shape",
+        )
+        data = [
+            (
+                f"{s.name} ({s.id})",
+                s.forward_calls,
+                f"{s.forward_self * 1000:.2f}",
+                f"{s.forward_total * 1000:.2f}",
+                s.backward_calls,
+                f"{s.backward_self * 1000:.2f}",
+                f"{s.backward_total * 1000:.2f}",
+                f"{s.output_bytes / 2 ** 20:.2f}",
+                str(s.input_shape),
+                str(s.output_shape),
+            )
+            for s in layers
+        ]
+        aligns = ("l", "r", "r", "r", "r", "r", "r", "r", "l", "l")
+        return table(data, header=header, aligns=aligns)
+
+    def to_chrome_trace(self, path: Optional[Union[str, Path]] = None) -> Dict:
+        """Get the recorded calls in the Chrome trace event format. If a path
+        is given, the trace is also written to it as JSON.
+        """
+        with self._lock:
+            trace = {"traceEvents": list(self.events), "displayTimeUnit": "ms"}
+        if path is not None:
+            with Path(path).open("w", encoding="utf8") as file_:
+                json.dump(trace, file_)
+        return trace
+
+
+def with_profile(layer: Model[InT, OutT], profiler: Profiler) -> Model[InT, OutT]:
+    """Wrap a layer, so that its forward and backward passes are timed by the
+    profiler. The calls are recorded under the wrapped layer's ID and name.
+    Only the layer's own calls are timed: use profile_model to time every
+    node of a model.
+    """
+    if layer.id in profiler._wrapped:
+        return layer
+    model: Model[InT, OutT] = Model(
+        f"with_profile({layer.name})",
+        partial(forward, profiler=profiler),
+        init=init,
+        layers=[layer],
+        dims={name: layer.maybe_get_dim(name) for name in layer.dim_names},
+        predict=partial(predict, profiler=profiler),
+    )
+    profiler._wrapped.add(model.id)
+    return model
+
+
+def profile_model(
+    model: Model[InT, OutT], profiler: Optional[Profiler] = None
+) -> Tuple[Model[InT, OutT], Profiler]:
+    """Wrap every node of a model with with_profile. The nodes are replaced
+    in-place, using wrap_model_recursive. Returns the wrapped model and the
+    profiler that collects their timings.
+    """
+    if profiler is None:
+        profiler = Profiler()
+    model = wrap_model_recursive(model, partial(with_profile, profiler=profiler))
+    return model, profiler
+
+
+def forward(
+    model: Model[InT, OutT], X: InT, is_train: bool, *, profiler: Profiler
+) -> Tuple[OutT, Callable]:
+    layer = model.layers[0]
+    (Y, layer_callback), _ = profiler.record(
+        layer, "forward", layer, X, is_train, returns_callback=True
+    )
+
+    def backprop(dY: OutT) -> InT:
+        return profiler.record(layer, "backward", layer_callback, dY)[0]
+
+    return Y, backprop
+
+
+def predict(model: Model[InT, OutT], X: InT, *, profiler: Profiler) -> OutT:
+    layer = model.layers[0]
+    return profiler.record(layer, "forward", layer.predict, X)[0]
+
+
+def init(
+    model: Model[InT, OutT], X: Optional[InT] = None, Y: Optional[OutT] = None
+) -> Model[InT, OutT]:
+    layer = model.layers[0]
+    layer.initialize(X=X, Y=Y)
+    for dim_name in layer.dim_names:
+        value = layer.maybe_get_dim(dim_name)
+        if value is not None:
+            model.set_dim(dim_name, value)
+    return model
+
+
+def _get_shape(obj: Any) -> Any:
+    if isinstance(obj, (Ragged, Padded)):
+        obj = obj.data
+    if hasattr(obj, "shape"):
+        return tuple(obj.shape)
+    elif isinstance(obj, (list, tuple)):
+        # Only show the first few items of long lists.
+        shapes = [_get_shape(item) for item in obj[:3]]
+        return shapes + ["..."] if len(obj) > 3 else shapes
+    return None
+
+
+def _get_nbytes(obj: Any) -> int:
+    if isinstance(obj, (Ragged, Padded)):
+        obj = obj.data
+    if hasattr(obj, "nbytes"):
+        return int(obj.nbytes)
+    elif isinstance(obj, (list, tuple)):
+        return sum(_get_nbytes(item) for item in obj)
+    return 0
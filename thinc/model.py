@@ -7,13 +7,19 @@ from pathlib import Path
 import copy
 import functools
 import threading
+import numpy
 
 from .backends import ParamServer, Ops, NumpyOps, CupyOps, get_current_ops
 from .optimizers import Optimizer  # noqa: F401
 from .shims import Shim
 from .util import convert_recursive, is_xp_array, DATA_VALIDATION
 from .util import partial, validate_fwd_input_output
-from .types import FloatsXd
+from .initializers import DEFERRED_INITS
+from .types import FloatsXd, RowSparse
+from ._mmap import is_mmap_file, read_mmap
+from ._mmap import unflatten_params, write_mmap, open_replacement
+from ._shared_memory import attach_params, release_params, share_params
+from ._pipe import pipe
 
 
 InT = TypeVar("InT")
@@ -22,7 +28,6 @@ SelfT = TypeVar("SelfT", bound="Model")
 
 context_operators: ContextVar[dict] = ContextVar("context_operators", default={})
 
-
 def empty_init(model: "Model", *args, **kwargs) -> "Model":
     return model
 
@@ -38,6 +43,7 @@ class Model(Generic[InT, OutT]):
     ops: Ops
     id: int
     _func: Callable
+    _predict_func: Optional[Callable]
     init: Callable
     _params: ParamServer
     _dims: Dict[str, Optional[int]]
@@ -53,6 +59,7 @@ class Model(Generic[InT, OutT]):
         "id",
         "ops",
         "_func",
+        "_predict_func",
         "init",
         "_params",
         "_dims",
@@ -76,6 +83,7 @@ class Model(Generic[InT, OutT]):
         attrs: Dict[str, Any] = {},
         refs: Dict[str, Optional["Model"]] = {},
         ops: Optional[Union[NumpyOps, CupyOps]] = None,
+        predict: Optional[Callable] = None,
     ):
         """Initialize a new model."""
         self.name = name
@@ -83,6 +91,7 @@ class Model(Generic[InT, OutT]):
             init = partial(empty_init, self)
         # Assign to callable attrs: https://github.com/python/mypy/issues/2427
         setattr(self, "_func", forward)
+        setattr(self, "_predict_func", predict)
         setattr(self, "init", init)
         self.ops = ops if ops is not None else get_current_ops()
         self._params = ParamServer()
@@ -235,10 +244,12 @@ class Model(Generic[InT, OutT]):
         return self._params.has_grad(self.id, name)
 
     def get_grad(self, name: str) -> FloatsXd:
-        """Get a gradient from the model."""
-        return self._params.get_grad(self.id, name)
+        """Get a gradient from the model. Layers that report row-sparse
+        gradients return a RowSparse object instead of an array.
+        """
+        return cast(FloatsXd, self._params.get_grad(self.id, name))
 
-    def set_grad(self, name: str, value: FloatsXd) -> None:
+    def set_grad(self, name: str, value: Union[FloatsXd, RowSparse]) -> None:
         """Set a gradient value for the model."""
         self._params.set_grad(self.id, name, value)
 
@@ -246,7 +257,7 @@ class Model(Generic[InT, OutT]):
         """Retrieve a gradient by name, or None."""
         return self.get_grad(name) if self.has_grad(name) else None
 
-    def inc_grad(self, name: str, value: FloatsXd) -> None:
+    def inc_grad(self, name: str, value: Union[FloatsXd, RowSparse]) -> None:
         """Increment the gradient of a parameter by a value."""
         self._params.inc_grad(self.id, name, value)
 
@@ -290,15 +301,86 @@ class Model(Generic[InT, OutT]):
         callback to compute the gradients via backpropagation."""
         return self._func(self, X, is_train=is_train)
 
-    def initialize(self, X: Optional[InT] = None, Y: Optional[OutT] = None) -> "Model":
+    def initialize(
+        self,
+        X: Optional[InT] = None,
+        Y: Optional[OutT] = None,
+        *,
+        shape_only: bool = False,
+    ) -> "Model":
         """Finish initialization of the model, optionally providing a batch of
-        example input and output data to perform shape inference."""
+        example input and output data to perform shape inference.
+
+        With shape_only=True, only the shapes of the parameters are recorded:
+        they're allocated and drawn once a parameter is first retrieved.
+        Parameters that are set before then, e.g. by loading the model's
+        weights with from_bytes or from_disk, are never allocated twice or
+        drawn at all. The values are drawn from a seed per parameter, so with
+        fix_random_seed they don't depend on the order they're retrieved in.
+        """
         if DATA_VALIDATION.get():
             validate_fwd_input_output(self.name, self._func, X, Y)
         if self.init is not None:
-            self.init(self, X=X, Y=Y)
+            if shape_only or DEFERRED_INITS.get() is not None:
+                self._init_shape_only(X, Y)
+            else:
+                self.init(self, X=X, Y=Y)
         return self
 
+    def _init_shape_only(self, X: Optional[InT], Y: Optional[OutT]) -> None:
+        # The placeholders are only replaced by deferred params once the
+        # outermost model is initialized, as shape inference may run the
+        # layers that are already initialized.
+        pending = _DEFERRED_PARAMS.get()
+        if pending is None:
+            pending = []
+            token = _DEFERRED_PARAMS.set(pending)
+            try:
+                self._init_shape_only(X, Y)
+            finally:
+                _DEFERRED_PARAMS.reset(token)
+            for node, name, placeholder, init in pending:
+                # Skip params that were set since, e.g. by a parent layer.
+                params = node._params
+                if params.has_param(node.id, name):
+                    if params.get_param(node.id, name) is placeholder:
+                        params.defer_param(node.id, name, init)
+            return
+        deferred: List[Tuple[FloatsXd, Callable[[], FloatsXd]]] = []
+        token = DEFERRED_INITS.set(deferred)
+        try:
+            self.init(self, X=X, Y=Y)
+            placeholders_used = True
+        except ValueError:
+            # The placeholders are read-only, so an init function that
+            # writes to the initial values fails.
+            if not deferred:
+                raise
+            placeholders_used = False
+        finally:
+            DEFERRED_INITS.reset(token)
+        if not deferred:
+            return
+        inits = {id(array): (array, init) for array, init in deferred}
+        claimed = []
+        for name in self.param_names:
+            if self._params.has_param(self.id, name):
+                # Only placeholders that became a parameter as they were can
+                # be filled in later.
+                param = self._params.get_param(self.id, name)
+                if id(param) in inits and inits[id(param)][0] is param:
+                    claimed.append((name, param, inits[id(param)][1]))
+        if placeholders_used and len(claimed) == len(inits):
+            pending.extend((self, *entry) for entry in claimed)
+        else:
+            # The init function transformed the initial values (e.g. LSTM
+            # concatenates them), so run it again with the values drawn.
+            token = DEFERRED_INITS.set(None)
+            try:
+                self.init(self, X=X, Y=Y)
+            finally:
+                DEFERRED_INITS.reset(token)
+
     def begin_update(self, X: InT) -> Tuple[OutT, Callable[[InT], OutT]]:
         """Run the model over a batch of data, returning the output and a
         callback to complete the backward pass. A tuple (Y, finish_update),
@@ -310,9 +392,51 @@ class Model(Generic[InT, OutT]):
 
     def predict(self, X: InT) -> OutT:
         """Call the model's `forward` function with `is_train=False`, and return
-        only the output, instead of the `(output, callback)` tuple.
+        only the output, instead of the `(output, callback)` tuple. If the model
+        was created with a `predict` function, that's called instead, so that
+        no backprop callback or activations for it need to be created.
         """
-        return self._func(self, X, is_train=False)[0]
+        if self._predict_func is not None:
+            Y = self._predict_func(self, X)
+        else:
+            Y = self._func(self, X, is_train=False)[0]
+        if self.ops.arena is not None:
+            self.ops.arena.reset()
+        return Y
+
+    def pipe(
+        self,
+        stream: Iterable[Any],
+        *,
+        batch_size: int = 128,
+        n_process: int = 1,
+        n_threads: int = 1,
+        by_length: bool = False,
+    ) -> Iterator[Any]:
+        """Predict over a stream of items, yielding one output per item in the
+        order of the input. The stream is consumed lazily: items are collected
+        into batches of batch_size items, which are passed to Model.predict,
+        and the output for each item is the corresponding element or row of
+        the batch's output. If the items of a batch are one-dimensional arrays
+        of the same length, e.g. the rows of a Floats2d input, they're stacked
+        into one array. Otherwise, the batch is passed as a list.
+
+        With by_length=True, items are read ahead and sorted by their len(),
+        so that each batch holds items of similar length. With n_process > 1,
+        the batches are predicted by a pool of worker processes. The weights
+        are published once in shared memory, which the workers attach to, so
+        they're not copied per worker (this needs Python 3.8+). With
+        n_threads > 1, the batches are predicted by a pool of threads instead,
+        which share the model.
+        """
+        yield from pipe(
+            self,
+            stream,
+            batch_size=batch_size,
+            n_process=n_process,
+            n_threads=n_threads,
+            by_length=by_length,
+        )
 
     def finish_update(self, optimizer: Optimizer) -> None:
         """Update parameters with current gradients. The optimizer is called
@@ -321,13 +445,70 @@ class Model(Generic[InT, OutT]):
         for node in self.walk():
             for shim in node.shims:
                 shim.finish_update(optimizer)
+        flat_keys = set()
+        server = self._params
+        if server.flat_key is not None and server.flat_key[0] == self.id:
+            # The parameters were flattened by this model, so update them
+            # all with a single call.
+            flat_keys = server.flat_keys
+            averages = getattr(optimizer, "averages", None)
+            has_averages = averages is not None and server.flat_key in averages
+            flat_params, _ = optimizer(
+                server.flat_key, server.flat_params, server.flat_grads
+            )
+            # Like for the other params, the returned weights are used, as
+            # an optimizer may return a new array instead of updating it.
+            if flat_params is not server.flat_params:
+                server.flat_params[...] = flat_params
+            server.version += 1
+            if averages is not None and not has_averages:
+                averages.update(server.get_flat_views(averages[server.flat_key]))
+        arenas = {}
+        nodes = []
+        items = []
         for node in self.walk():
             for name in node.param_names:
+                if (node.id, name) in flat_keys:
+                    continue
+                elif node.has_grad(name):
+                    nodes.append((node, name))
+                    key = (node.id, name)
+                    items.append((key, node.get_param(name), node.get_grad(name)))
+            if node.ops.arena is not None:
+                arenas[id(node.ops.arena)] = node.ops.arena
+        if isinstance(optimizer, Optimizer):
+            results = optimizer.update_many(items)
+        else:
+            results = [optimizer(key, param, grad) for key, param, grad in items]
+        for (node, name), (param, _) in zip(nodes, results):
+            node.set_param(name, param)
+        for arena in arenas.values():
+            arena.reset()
+
+    def flatten_params(self) -> None:
+        """Store the float32 parameters of the model and its sublayers in one
+        contiguous buffer, and their gradients in another, so that operations
+        over all parameters can be done in one go. The parameters are replaced
+        by views of the buffer. Model.finish_update then calls the optimizer
+        once for the whole buffer, so gradient clipping applies to the norm of
+        all gradients together. Call this after the model is initialized.
+        Setting a parameter to an array of a different shape or device undoes
+        the flattening.
+        """
+        server = ParamServer()
+        keys = []
+        for node in self.walk():
+            if node._params.proxy is not None:
+                raise ValueError("Cannot flatten parameters served by a proxy")
+            for name in node.param_names:
+                if node.has_param(name):
+                    server.set_param(node.id, name, node.get_param(name))
+                    keys.append((node.id, name))
                 if node.has_grad(name):
-                    param, grad = optimizer(
-                        (node.id, name), node.get_param(name), node.get_grad(name)
-                    )
-                    node.set_param(name, param)
+                    server.set_grad(node.id, name, node.get_grad(name))
+        for node in self.walk():
+            node._params = server
+        server.flatten(keys, (self.id, "flat_params"))
 
     @contextlib.contextmanager
     def use_params(self, params: Dict[Tuple[int, str], FloatsXd]):
@@ -340,6 +521,10 @@ class Model(Generic[InT, OutT]):
             key = (self.id, name)
             if key in params:
                 backup[name] = self.get_param(name)
+                if key in self._params.flat_keys:
+                    # The params are copied into the flat buffer, so the
+                    # backup can't be a view of it.
+                    backup[name] = backup[name].copy()
                 self.set_param(name, params[key])
 
         with contextlib.ExitStack() as stack:
@@ -418,9 +603,14 @@ class Model(Generic[InT, OutT]):
                     node.set_ref(name, None)
 
     def replace_callbacks(
-        self, forward: Callable, *, init: Optional[Callable] = None
+        self,
+        forward: Callable,
+        *,
+        init: Optional[Callable] = None,
+        predict: Optional[Callable] = None,
     ) -> None:
         setattr(self, "_func", forward)
+        setattr(self, "_predict_func", predict)
         setattr(self, "init", init)
 
     def replace_node(self, old: "Model", new: "Model") -> bool:
@@ -475,6 +665,7 @@ class Model(Generic[InT, OutT]):
             attrs=copy.deepcopy(self._attrs),
             layers=[layer.copy() for layer in self.layers],
             shims=[shim.copy() for shim in self.shims],
+            predict=self._predict_func,
         )
         for name in self.grad_names:
             copied.set_grad(name, self.get_grad(name).copy())
@@ -499,7 +690,10 @@ class Model(Generic[InT, OutT]):
                 if node.has_param(name):
                     node.set_param(name, ops.asarray_f(node.get_param(name)))
                 if node.has_grad(name):
-                    node.set_grad(name, ops.asarray_f(node.get_grad(name)))
+                    grad = node.get_grad(name)
+                    if isinstance(grad, RowSparse):
+                        grad = grad.to_dense()
+                    node.set_grad(name, ops.asarray_f(grad))
             for shim in node.shims:
                 shim.to_device(ops.device_type, ops.device_id)
 
@@ -515,13 +709,21 @@ class Model(Generic[InT, OutT]):
         msg = convert_recursive(is_xp_array, self.ops.to_numpy, msg)
         return srsly.msgpack_dumps(msg)
 
-    def to_disk(self, path: Union[Path, str]) -> None:
+    def to_disk(self, path: Union[Path, str], *, mmap: bool = False) -> None:
         """Serialize the model to disk. Most models will serialize to a single
         file, which should just be the bytes contents of model.to_bytes().
+
+        If mmap is True, the parameters are written as raw, page-aligned arrays
+        after a msgpack header, so that from_disk can memory-map them instead
+        of reading and copying them.
         """
         path = Path(path) if isinstance(path, str) else path
-        with path.open("wb") as file_:
-            file_.write(self.to_bytes())
+        if mmap:
+            write_mmap(self, path)
+            return
+        bytes_data = self.to_bytes()
+        with open_replacement(path) as file_:
+            file_.write(bytes_data)
 
     def to_dict(self) -> Dict:
         """Serialize the model to a dict representation.
@@ -595,12 +797,49 @@ class Model(Generic[InT, OutT]):
     def from_disk(self, path: Union[Path, str]) -> "Model":
         """Deserialize the model from disk. Most models will serialize to a single
         file, which should just be the bytes contents of model.to_bytes().
+
+        Files written with to_disk(path, mmap=True) are memory-mapped. The
+        parameters are then copy-on-write views of the file: they're only read
+        from disk when they're used, processes loading the same file share the
+        memory, and writing to a parameter never changes the file.
         """
         path = Path(path) if isinstance(path, str) else path
+        if is_mmap_file(path):
+            # Setting a param of a flattened model would copy the mapped data.
+            unflatten_params(self)
+            return self.from_dict(read_mmap(path, self.ops))
         with path.open("rb") as file_:
             bytes_data = file_.read()
         return self.from_bytes(bytes_data)
 
+    def to_shared_memory(self, name: Optional[str] = None):
+        """Freeze the model's parameters into a new block of shared memory,
+        and return the multiprocessing.shared_memory.SharedMemory object. The
+        params become read-only views of the block, so processes forked
+        afterwards share them. Other processes can attach a model with the
+        same structure to the block with Model.from_shared_memory. A flat
+        parameter buffer is undone. The block is closed in this process once
+        no model uses it, and removed by release_shared_memory(unlink=True)
+        or the block's unlink() method.
+        """
+        return share_params(self, name)
+
+    def from_shared_memory(self, name: str) -> "Model":
+        """Load the model from a block of shared memory written by
+        Model.to_shared_memory. The params are read-only views of the block,
+        so any number of processes can load the model without copying them.
+        """
+        attach_params(self, name)
+        return self
+
+    def release_shared_memory(self, *, unlink: bool = False) -> None:
+        """Replace the params that are views of shared memory by private
+        copies. A block is closed in this process once no model uses it
+        anymore. If unlink is True, the blocks are also removed, so that no
+        other process can attach to them.
+        """
+        release_params(self, unlink=unlink)
+
     def from_dict(self, msg: Dict) -> "Model":
         if "nodes" not in msg.keys():  # pragma: no cover
             err = "Trying to read a Model that was created with an incompatible version of Thinc"
@@ -624,7 +863,11 @@ class Model(Generic[InT, OutT]):
                 loaded_value = deserialize_attr(default_value, value, attr, node)
                 node.attrs[attr] = loaded_value
             for param_name, value in msg["params"][i].items():
-                if value is not None:
+                if isinstance(value, numpy.memmap):
+                    # Memory-mapped params are copy-on-write, so the file is
+                    # never modified and there's no need to copy them.
+                    value = node.ops.asarray(value)
+                elif value is not None:
                     value = node.ops.asarray(value).copy()
                 node.set_param(param_name, value)
             for i, shim_bytes in enumerate(msg["shims"][i]):
@@ -639,6 +882,8 @@ class Model(Generic[InT, OutT]):
         path = Path(path) if isinstance(path, str) else path
         if path.is_dir() or not path.exists():
             return False
+        if is_mmap_file(path):
+            return self.can_from_dict(read_mmap(path, self.ops), strict=strict)
         with path.open("rb") as file_:
             bytes_data = file_.read()
         return self.can_from_bytes(bytes_data, strict=strict)
@@ -807,6 +1052,12 @@ def deserialize_attr(_: Any, value: Any, name: str, model: Model) -> Any:
 _ModelT = TypeVar("_ModelT", bound=Model)
 
 
+# The params to defer once the outermost model in a shape-only initialization
+# is initialized, see Model._init_shape_only.
+_DEFERRED_PARAMS: ContextVar[
+    Optional[List[Tuple[Model, str, FloatsXd, Callable[[], FloatsXd]]]]
+] = ContextVar("deferred_params", default=None)
+
 def change_attr_values(model: _ModelT, mapping: Dict[str, Dict[str, Any]]) -> _ModelT:
     """Walk over the model's nodes, changing the value of attributes using the
     provided mapping, which maps node names to attr names to attr values.
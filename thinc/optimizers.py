@@ -1,10 +1,11 @@
 import math
 
-from typing import Dict, Optional, Union, Tuple, List, cast
+from typing import Dict, Optional, Union, Tuple, List, Sequence, cast
 from collections import defaultdict
 
 from .backends import get_array_ops
-from .types import Generator, FloatsXd
+from .util import is_cupy_array
+from .types import Generator, FloatsXd, RowSparse
 from .config import registry
 
 
@@ -29,6 +30,11 @@ ADAM_DEFAULTS: Dict[str, Union[float, bool, int]] = {
     "L2_is_weight_decay": True,
 }
 
+MOMENTUM_ERROR = (
+    "Second-order momentum (beta2) requires first-order momentum (beta1): "
+    "set beta1 to a value above 0, or set both to 0 to use vanilla SGD"
+)
+
 
 @registry.optimizers("RAdam.v1")
 def RAdam(
@@ -119,7 +125,7 @@ class Optimizer(object):
     L2: float
     use_radam: bool
     L2_is_weight_decay: bool
-    _radam_buffer: List[List[Optional[FloatsXd]]]
+    _radam_buffer: List[List[Optional[float]]]
 
     # This "locks" the class, so we get an error if you try to assign to
     # an unexpected variable.
@@ -218,28 +224,35 @@ class Optimizer(object):
     ):
         """Call the optimizer with weights and a gradient. The key is the
         identifier for the parameter, usually the node ID and parameter name.
+
+        If the gradient is a RowSparse object, SGD and Adam only update the
+        rows of the weights (and of their momentum and averages) that received
+        a gradient. RAdam has no lazy variant, so the gradient is made dense.
+        With a RowSparse gradient, the averages start from the weights before
+        their first update, so rows that never receive a gradient keep their
+        values.
         """
         if len(gradient) < 1:
             return weights, gradient
         ops = get_array_ops(weights)
+        if isinstance(gradient, RowSparse):
+            if not self.use_radam:
+                return self._lazy_update(ops, key, weights, gradient, lr_scale)
+            sparse_gradient = gradient
+            gradient = sparse_gradient.to_dense()
+            sparse_gradient.clear()
         self.nr_update[key] += 1
         nr_upd = self.nr_update[key]
+        if self._uses_moments:
+            self._fused_update(ops, [(key, weights, gradient)], lr_scale, nr_upd)
+            return weights, gradient
+        elif self.b2 > 0.0:
+            raise ValueError(MOMENTUM_ERROR)
         if self.L2 != 0 and not self.L2_is_weight_decay:
             gradient += self.L2 * weights
         if self.grad_clip:
             gradient = ops.clip_gradient(gradient, self.grad_clip)
-        if self.use_radam:
-            weights, gradient = self._radam(
-                ops, weights, gradient, lr_scale, key, nr_upd
-            )
-        elif self.b1 > 0.0 and self.b2 > 0.0:
-            weights, gradient = self._adam(
-                ops, weights, gradient, lr_scale, key, nr_upd
-            )
-        elif self.b2 > 0.0:  # pragma: no cover
-            raise NotImplementedError  # TODO: error message
-        else:
-            weights -= lr_scale * self.learn_rate * gradient
+        weights -= lr_scale * self.learn_rate * gradient
         gradient *= 0
         if self.L2 != 0 and self.L2_is_weight_decay:
             weights -= lr_scale * self.learn_rate * self.L2 * weights
@@ -249,109 +262,174 @@ class Optimizer(object):
             ops.update_averages(self.averages[key], weights, nr_upd)
         return weights, gradient
 
-    def _radam(self, ops, weights, grad, lr_scale, key, nr_upd):
-        if key not in self.mom1:
-            self.mom1[key] = ops.alloc1f(weights.size)
-        if key not in self.mom2:
-            self.mom2[key] = ops.alloc1f(weights.size)
-
-        weights_1D = ops.reshape1f(weights, weights.size)
-        gradient_1D = ops.reshape1f(grad, grad.size)
-
-        # While we port from the pytorch implementation, keep some of the same
-        # naming
-        state = {
-            "step": self.nr_update[key],
-            "exp_avg": self.mom1[key],
-            "exp_avg_sq": self.mom2[key],
-        }
-        group = {
-            "lr": self.learn_rate,
-            "betas": [self.b1, self.b2],
-            "eps": self.eps,
-            "weight_decay": 0.0,
-            "buffer": self._radam_buffer,
-        }
-        degenerated_to_sgd = True
-
-        exp_avg, exp_avg_sq = state["exp_avg"], state["exp_avg_sq"]
-        beta1, beta2 = group["betas"]
-
-        # exp_avg_sq.mul_(beta2).addcmul_(1 - beta2, grad, grad)
-        exp_avg_sq *= beta2
-        exp_avg_sq += (1 - beta2) * (gradient_1D ** 2)
-        # exp_avg.mul_(beta1).add_(1 - beta1, grad)
-        exp_avg *= beta1
-        exp_avg += (1 - beta1) * gradient_1D
-
-        state["step"] += 1
-        buffered = group["buffer"][int(state["step"] % 10)]
-        if state["step"] == buffered[0]:
-            N_sma, step_size = buffered[1], buffered[2]
+    def _lazy_update(self, ops, key, weights, gradient, lr_scale):
+        self.nr_update[key] += 1
+        nr_upd = self.nr_update[key]
+        # Sum the values for repeated rows, so each row is updated once.
+        indices, inverse = ops.xp.unique(gradient.indices, return_inverse=True)
+        d_rows = ops.alloc2f(indices.shape[0], gradient.values.shape[1])
+        ops.scatter_add(d_rows, ops.asarray_i(inverse.ravel()), gradient.values)
+        rows = weights[indices]
+        if self.L2 != 0 and not self.L2_is_weight_decay:
+            d_rows += self.L2 * rows
+        if self.grad_clip:
+            d_rows = ops.clip_gradient(d_rows, self.grad_clip)
+        if self.b1 > 0.0 and self.b2 > 0.0:
+            if key not in self.mom1:
+                self.mom1[key] = ops.alloc1f(weights.size)
+            if key not in self.mom2:
+                self.mom2[key] = ops.alloc1f(weights.size)
+            mom1 = ops.reshape2f(self.mom1[key], *weights.shape)
+            mom2 = ops.reshape2f(self.mom2[key], *weights.shape)
+            mom1_rows = ops.reshape1f(mom1[indices], rows.size)
+            mom2_rows = ops.reshape1f(mom2[indices], rows.size)
+            fix1 = 1.0 - (self.b1 ** nr_upd)
+            fix2 = 1.0 - (self.b2 ** nr_upd)
+            lr = self.learn_rate * fix2 ** 0.5 / fix1
+            rows_1D, _, mom1_rows, mom2_rows = ops.adam(
+                ops.reshape1f(rows, rows.size),
+                ops.reshape1f(d_rows, d_rows.size),
+                mom1_rows,
+                mom2_rows,
+                self.b1,
+                self.b2,
+                self.eps,
+                lr * lr_scale,
+            )
+            rows = ops.reshape2f(rows_1D, *rows.shape)
+            mom1[indices] = ops.reshape2f(mom1_rows, *rows.shape)
+            mom2[indices] = ops.reshape2f(mom2_rows, *rows.shape)
+        elif self.b2 > 0.0:
+            raise ValueError(MOMENTUM_ERROR)
         else:
-            buffered[0] = state["step"]
-            beta2_t = beta2 ** state["step"]
-            N_sma_max = 2 / (1 - beta2) - 1
-            N_sma = N_sma_max - 2 * state["step"] * beta2_t / (1 - beta2_t)
-            buffered[1] = N_sma
+            rows -= lr_scale * self.learn_rate * d_rows
+        if self.L2 != 0 and self.L2_is_weight_decay:
+            rows -= lr_scale * self.learn_rate * self.L2 * rows
+        if self.averages is not None and key not in self.averages:
+            self.averages[key] = weights.copy()
+        weights[indices] = rows
+        if self.averages is not None:
+            averages = self.averages[key][indices]
+            ops.update_averages(averages, rows, nr_upd)
+            self.averages[key][indices] = averages
+        gradient.clear()
+        return weights, gradient
 
-            # more conservative since it's an approximated value
-            if N_sma >= 5:
-                step_size = math.sqrt(
-                    (1 - beta2_t)
-                    * (N_sma - 4)
-                    / (N_sma_max - 4)
-                    * (N_sma - 2)
-                    / N_sma
-                    * N_sma_max
-                    / (N_sma_max - 2)
-                ) / (1 - beta1 ** state["step"])
-            elif degenerated_to_sgd:
-                step_size = 1.0 / (1 - beta1 ** state["step"])
+    def update_many(
+        self,
+        items: Sequence[Tuple[KeyT, FloatsXd, FloatsXd]],
+        *,
+        lr_scale: float = 1.0,
+    ) -> List[Tuple[FloatsXd, FloatsXd]]:
+        """Call the optimizer with several (key, weights, gradient) triples.
+        This is equivalent to calling the optimizer for each triple in turn,
+        but Adam and RAdam update all dense parameters that are at the same
+        step with a single call to Ops.multi_adam.
+        """
+        results = []
+        groups: Dict[Tuple[int, bool], List[Tuple[KeyT, FloatsXd, FloatsXd]]] = {}
+        for key, weights, gradient in items:
+            results.append((weights, gradient))
+            if (
+                not self._uses_moments
+                or isinstance(gradient, RowSparse)
+                or len(gradient) < 1
+            ):
+                results[-1] = self(key, weights, gradient, lr_scale=lr_scale)
             else:
-                step_size = -1
-            buffered[2] = step_size
+                self.nr_update[key] += 1
+                group_key = (self.nr_update[key], is_cupy_array(weights))
+                groups.setdefault(group_key, []).append((key, weights, gradient))
+        for (nr_upd, _), group in groups.items():
+            ops = get_array_ops(group[0][1])
+            self._fused_update(ops, group, lr_scale, nr_upd)
+        return results
+
+    @property
+    def _uses_moments(self) -> bool:
+        return self.use_radam or (self.b1 > 0.0 and self.b2 > 0.0)
+
+    def _fused_update(self, ops, items, lr_scale, nr_upd):
+        if self.use_radam:
+            N_sma, step_size = self._get_radam_step_size(nr_upd + 1)
+            use_mom2 = N_sma >= 5
+            # The RAdam step size doesn't take the lr_scale into account.
+            learn_rate = step_size * self.learn_rate
+        else:
+            fix1 = 1.0 - (self.b1 ** nr_upd)
+            fix2 = 1.0 - (self.b2 ** nr_upd)
+            use_mom2 = True
+            learn_rate = self.learn_rate * fix2 ** 0.5 / fix1 * lr_scale
+        weights_1D = []
+        gradients_1D = []
+        mom1 = []
+        mom2 = []
+        averages: Optional[List[FloatsXd]] = None
+        if self.averages is not None:
+            averages = []
+        for key, weights, gradient in items:
+            if key not in self.mom1:
+                self.mom1[key] = ops.alloc1f(weights.size)
+            if key not in self.mom2:
+                self.mom2[key] = ops.alloc1f(weights.size)
+            weights_1D.append(ops.reshape1f(weights, weights.size))
+            gradients_1D.append(ops.reshape1f(gradient, gradient.size))
+            mom1.append(self.mom1[key])
+            mom2.append(self.mom2[key])
+            if averages is not None:
+                if key not in self.averages:
+                    self.averages[key] = ops.alloc(weights.shape, dtype="float32")
+                averages.append(ops.reshape1f(self.averages[key], weights.size))
+        L2 = self.L2 if not self.L2_is_weight_decay else 0.0
+        weight_decay = 0.0
+        if self.L2_is_weight_decay:
+            weight_decay = lr_scale * self.learn_rate * self.L2
+        ops.multi_adam(
+            weights_1D,
+            gradients_1D,
+            mom1,
+            mom2,
+            averages,
+            self.b1,
+            self.b2,
+            self.eps,
+            learn_rate,
+            L2=L2,
+            weight_decay=weight_decay,
+            grad_clip=self.grad_clip,
+            average_decay=min((1.0 + nr_upd) / (10.0 + nr_upd), 0.9999),
+            use_mom2=use_mom2,
+        )
 
+    def _get_radam_step_size(self, step: int) -> Tuple[float, float]:
+        # While we port from the pytorch implementation, keep some of the same
+        # naming. The step size only depends on the step, so it's cached.
+        beta1 = self.b1
+        beta2 = self.b2
+        buffered = self._radam_buffer[int(step % 10)]
+        if step == buffered[0]:
+            return cast(float, buffered[1]), cast(float, buffered[2])
+        buffered[0] = step
+        beta2_t = beta2 ** step
+        N_sma_max = 2 / (1 - beta2) - 1
+        N_sma = N_sma_max - 2 * step * beta2_t / (1 - beta2_t)
+        buffered[1] = N_sma
         # more conservative since it's an approximated value
         if N_sma >= 5:
-            if group["weight_decay"] != 0:
-                weights_1D += -group["weight_decay"] * group["lr"] * weights_1D
-            denom = ops.xp.sqrt(exp_avg_sq) + group["eps"]
-            weights_1D += -step_size * group["lr"] * (exp_avg / denom)
-        elif step_size > 0:
-            if group["weight_decay"] != 0:
-                weights_1D += -group["weight_decay"] * group["lr"] * weights_1D
-            weights_1D += -step_size * group["lr"] * exp_avg
-        return (
-            ops.reshape_f(weights_1D, weights.shape),
-            ops.reshape_f(gradient_1D, grad.shape),
-        )
-
-    def _adam(self, ops, weights, gradient, lr_scale, key, nr_upd):
-        weights_1D = ops.reshape1f(weights, weights.size)
-        gradient_1D = ops.reshape1f(gradient, gradient.size)
-        if key not in self.mom1:
-            self.mom1[key] = ops.alloc1f(weights.size)
-        if key not in self.mom2:
-            self.mom2[key] = ops.alloc1f(weights.size)
-        mom1 = self.mom1[key]
-        mom2 = self.mom2[key]
-        b1 = self.b1
-        b2 = self.b2
-        fix1 = 1.0 - (b1 ** nr_upd)
-        fix2 = 1.0 - (b2 ** nr_upd)
-        lr = self.learn_rate * fix2 ** 0.5 / fix1
-        eps = self.eps
-        # needs to be 1D going into the adam function
-        weights_1D, gradient_1D, mom1, mom2 = ops.adam(
-            weights_1D, gradient_1D, mom1, mom2, b1, b2, eps, lr * lr_scale
-        )
-        self.mom1[key] = mom1
-        self.mom2[key] = mom2
-        return (
-            ops.reshape_f(weights_1D, weights.shape),
-            ops.reshape_f(gradient_1D, gradient.shape),
-        )
+            step_size = math.sqrt(
+                (1 - beta2_t)
+                * (N_sma - 4)
+                / (N_sma_max - 4)
+                * (N_sma - 2)
+                / N_sma
+                * N_sma_max
+                / (N_sma_max - 2)
+            ) / (1 - beta1 ** step)
+        else:
+            # degenerated to SGD
+            step_size = 1.0 / (1 - beta1 ** step)
+        buffered[2] = step_size
+        return N_sma, step_size
 
 
 __all__ = ["Adam", "RAdam", "SGD", "Optimizer", "ADAM_DEFAULTS", "SGD_DEFAULTS"]
@@ -0,0 +1,228 @@
+from typing import Any, Deque, Dict, List, Optional
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+import asyncio
+import time
+
+from .model import Model
+from ._pipe import predict_items
+
+
+class _Request:
+    __slots__ = ["item", "key", "future", "start", "deadline"]
+
+    def __init__(self, item: Any, key: int, future: asyncio.Future, latency: float):
+        self.item = item
+        self.key = key
+        self.future = future
+        self.start = time.monotonic()
+        self.deadline = self.start + latency
+
+
+_STOP = object()
+
+# Python 3.6 has no get_running_loop, but in a coroutine, get_event_loop
+# returns the running loop too.
+_get_running_loop = getattr(asyncio, "get_running_loop", asyncio.get_event_loop)
+
+
+class Batcher:
+    """Merge concurrent requests into batches for Model.predict, e.g. to serve
+    a model from an asyncio web server. Each call to `predict` submits one
+    item and returns its output. A batch is predicted as soon as it has
+    max_batch_size items, or when its oldest item has waited max_latency_ms.
+    Like with Model.pipe, items that are rows of an array input are stacked
+    into one array, and other items are passed as a list.
+    With by_length=True, items are grouped by their len(), rounded up to a
+    power of two, so that a batch holds items of similar length.
+
+    The batches are predicted in the given executor, by default a single
+    worker thread, so the event loop isn't blocked. As Model.predict can be
+    called from several threads at once, an executor with more workers lets
+    batches be predicted in parallel.
+    """
+
+    model: Model
+    max_batch_size: int
+    max_latency_ms: float
+    by_length: bool
+    n_requests: int
+    n_batches: int
+    _latencies: Deque[float]
+
+    def __init__(
+        self,
+        model: Model,
+        max_batch_size: int = 32,
+        max_latency_ms: float = 5.0,
+        *,
+        by_length: bool = False,
+        executor: Optional[Executor] = None,
+    ):
+        if max_batch_size < 1:
+            raise ValueError(f"Invalid max_batch_size: {max_batch_size}")
+        if max_latency_ms < 0:
+            raise ValueError(f"Invalid max_latency_ms: {max_latency_ms}")
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_latency_ms = max_latency_ms
+        self.by_length = by_length
+        self._own_executor = executor is None
+        self._executor = executor if executor is not None else ThreadPoolExecutor(1)
+        self._queue: Optional[asyncio.Queue] = None
+        self._runner: Optional[asyncio.Future] = None
+        self._closed = False
+        self._n_pending = 0
+        self.n_requests = 0
+        self.n_batches = 0
+        # The latencies of the most recent requests, in milliseconds.
+        self._latencies = deque(maxlen=1000)
+
+    @property
+    def queue_depth(self) -> int:
+        """The number of requests waiting to be put in a batch."""
+        queued = self._queue.qsize() if self._queue is not None else 0
+        return queued + self._n_pending
+
+    def get_metrics(self) -> Dict[str, float]:
+        """Get the queue depth, the number of requests and batches served so
+        far, the mean batch size, and the mean, median, 95th percentile and
+        maximum latency in milliseconds over the most recent requests.
+        """
+        latencies = sorted(self._latencies)
+        metrics = {
+            "queue_depth": float(self.queue_depth),
+            "n_requests": float(self.n_requests),
+            "n_batches": float(self.n_batches),
+            "mean_batch_size": self.n_requests / max(self.n_batches, 1),
+            "mean_latency_ms": 0.0,
+            "p50_latency_ms": 0.0,
+            "p95_latency_ms": 0.0,
+            "max_latency_ms": 0.0,
+        }
+        if latencies:
+            metrics["mean_latency_ms"] = sum(latencies) / len(latencies)
+            metrics["p50_latency_ms"] = latencies[len(latencies) // 2]
+            metrics["p95_latency_ms"] = latencies[int(len(latencies) * 0.95)]
+            metrics["max_latency_ms"] = latencies[-1]
+        return metrics
+
+    async def predict(self, item: Any) -> Any:
+        """Submit one item, and wait for the model's output for it."""
+        if self._closed:
+            raise ValueError("Cannot predict with a Batcher that was closed")
+        if self._runner is not None and self._runner.done():
+            err = "Cannot predict with a Batcher that stopped after an error"
+            raise ValueError(err) from self._runner.exception()
+        key = len(item).bit_length() if self.by_length else 0
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._runner = asyncio.ensure_future(self._run())
+        future = _get_running_loop().create_future()
+        latency = self.max_latency_ms / 1000
+        self._queue.put_nowait(_Request(item, key, future, latency))
+        return await future
+
+    async def close(self) -> None:
+        """Predict the requests that are still queued, and stop the batcher.
+        The executor is shut down if it was created by the batcher.
+        """
+        self._closed = True
+        if self._queue is not None and self._runner is not None:
+            # If the runner stopped after an error, its requests have already
+            # received the error.
+            if not self._runner.done():
+                self._queue.put_nowait(_STOP)
+                await self._runner
+            elif not self._runner.cancelled():
+                self._runner.exception()
+            self._queue = None
+            self._runner = None
+        if self._own_executor:
+            self._executor.shutdown(wait=True)
+
+    async def _run(self) -> None:
+        assert self._queue is not None
+        buckets: Dict[int, List[_Request]] = {}
+        try:
+            await self._run_buckets(self._queue, buckets)
+        except BaseException as e:
+            # Fail the requests that would otherwise never be answered.
+            requests = [request for bucket in buckets.values() for request in bucket]
+            while not self._queue.empty():
+                requests.append(self._queue.get_nowait())
+            self._n_pending = 0
+            for request in requests:
+                if request is _STOP or request.future.done():
+                    continue
+                elif isinstance(e, asyncio.CancelledError):
+                    request.future.cancel()
+                else:
+                    request.future.set_exception(e)
+            raise
+
+    async def _run_buckets(
+        self, queue: asyncio.Queue, buckets: Dict[int, List[_Request]]
+    ) -> None:
+        in_flight: List[asyncio.Future] = []
+        stopping = False
+        while not stopping:
+            timeout = None
+            if buckets:
+                deadline = min(bucket[0].deadline for bucket in buckets.values())
+                timeout = max(deadline - time.monotonic(), 0.0)
+            try:
+                requests = [await asyncio.wait_for(queue.get(), timeout)]
+            except asyncio.TimeoutError:
+                requests = []
+            # Take whatever else is queued too, so that requests that piled
+            # up while the loop was busy end up in the same batches.
+            while not queue.empty():
+                requests.append(queue.get_nowait())
+            for request in requests:
+                if request is _STOP:
+                    stopping = True
+                    continue
+                buckets.setdefault(request.key, []).append(request)
+                self._n_pending += 1
+            now = time.monotonic()
+            for key, bucket in list(buckets.items()):
+                while len(bucket) >= self.max_batch_size:
+                    batch = bucket[: self.max_batch_size]
+                    in_flight.append(self._start_batch(batch))
+                    del bucket[: self.max_batch_size]
+                if bucket and (stopping or bucket[0].deadline <= now):
+                    in_flight.append(self._start_batch(bucket))
+                    bucket = []
+                if not bucket:
+                    del buckets[key]
+            in_flight = [task for task in in_flight if not task.done()]
+        if in_flight:
+            await asyncio.gather(*in_flight)
+
+    def _start_batch(self, requests: List[_Request]) -> asyncio.Future:
+        self._n_pending -= len(requests)
+        return asyncio.ensure_future(self._run_batch(requests))
+
+    async def _run_batch(self, requests: List[_Request]) -> None:
+        loop = _get_running_loop()
+        items = [request.item for request in requests]
+        try:
+            outputs = await loop.run_in_executor(
+                self._executor, predict_items, self.model, items
+            )
+        except Exception as e:
+            for request in requests:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            return
+        end = time.monotonic()
+        self.n_batches += 1
+        self.n_requests += len(requests)
+        for request, output in zip(requests, outputs):
+            self._latencies.append((end - request.start) * 1000)
+            if not request.future.done():
+                request.future.set_result(output)
+
+
+__all__ = ["Batcher"]
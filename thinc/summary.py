@@ -0,0 +1,209 @@
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+from dataclasses import dataclass
+
+from wasabi import table
+
+from .backends import TracingOps
+from .backends.tracing_ops import _iter_arrays
+from .layers.with_profile import _get_nbytes, _get_shape
+from .model import Model
+
+
+@dataclass
+class NodeSummary:
+    """The estimated costs of one node of a model, for one batch. The FLOPs
+    and bytes only cover the node's own computation, not its children's.
+    """
+
+    name: str
+    depth: int
+    n_params: int = 0
+    param_bytes: int = 0
+    input_shape: Any = None
+    output_shape: Any = None
+    input_bytes: int = 0
+    forward_flops: int = 0
+    backward_flops: int = 0
+    activation_bytes: int = 0
+    gradient_bytes: int = 0
+
+
+class ModelSummary:
+    """The estimated costs of a model for one batch, per node. The nodes are
+    in depth-first order.
+    """
+
+    nodes: List[NodeSummary]
+
+    def __init__(self, nodes: List[NodeSummary]):
+        self.nodes = nodes
+
+    def __str__(self) -> str:
+        return self.format_table()
+
+    @property
+    def n_params(self) -> int:
+        """The number of parameters of the model."""
+        return sum(node.n_params for node in self.nodes)
+
+    @property
+    def forward_flops(self) -> int:
+        """The estimated FLOPs of the forward pass."""
+        return sum(node.forward_flops for node in self.nodes)
+
+    @property
+    def backward_flops(self) -> int:
+        """The estimated FLOPs of the backward pass."""
+        return sum(node.backward_flops for node in self.nodes)
+
+    @property
+    def activation_bytes(self) -> int:
+        """The bytes of the outputs of all nodes. When training, they're all
+        kept until the backward pass, so this is the activation memory.
+        """
+        return sum(node.activation_bytes for node in self.nodes)
+
+    @property
+    def gradient_bytes(self) -> int:
+        """The bytes of the gradients returned by all nodes."""
+        return sum(node.gradient_bytes for node in self.nodes)
+
+    @property
+    def inference_peak_bytes(self) -> int:
+        """The largest input and output size of any node. When predicting,
+        the activations are freed as the batch moves through the model, so
+        this approximates the peak activation memory.
+        """
+        return max((n.input_bytes + n.activation_bytes for n in self.nodes), default=0)
+
+    def format_table(self) -> str:
+        """Format the summary as a table, with a row per node and the totals."""
+        header = (
+            "Layer",
+            "Params",
+            "Input shape",
+            "Output shape",
+            "Fwd MFLOP",
+            "Bwd MFLOP",
+            "Act. MB",
+            "Grad. MB",
+        )
+        data = [
+            (
+                "  " * node.depth + node.name,
+                f"{node.n_params:,}",
+                str(node.input_shape),
+                str(node.output_shape),
+                f"{node.forward_flops / 1e6:.2f}",
+                f"{node.backward_flops / 1e6:.2f}",
+                f"{node.activation_bytes / 2 ** 20:.2f}",
+                f"{node.gradient_bytes / 2 ** 20:.2f}",
+            )
+            for node in self.nodes
+        ]
+        data.append(
+            (
+                "Total",
+                f"{self.n_params:,}",
+                "",
+                "",
+                f"{self.forward_flops / 1e6:.2f}",
+                f"{self.backward_flops / 1e6:.2f}",
+                f"{self.activation_bytes / 2 ** 20:.2f}",
+                f"{self.gradient_bytes / 2 ** 20:.2f}",
+            )
+        )
+        aligns = ("l", "r", "l", "l", "r", "r", "r", "r")
+        return table(data, header=header, aligns=aligns)
+
+
+def model_summary(
+    model: Model, X_sample: Any, *, backward: bool = True
+) -> ModelSummary:
+    """Estimate the parameter count of each node of a model, and the FLOPs and
+    activation memory of its forward and backward pass for the batch X_sample.
+    The FLOPs are counted with TracingOps, so computations that don't go
+    through the model's ops aren't included. The model is copied, so its
+    parameters and gradients are left untouched. If the model isn't
+    initialized, the copy is initialized with X_sample.
+    """
+    orig_nodes = list(model.walk(order="dfs_pre"))
+    model = model.copy()
+    nodes = list(model.walk(order="dfs_pre"))
+    if len(nodes) == len(orig_nodes):
+        for node, orig_node in zip(nodes, orig_nodes):
+            node.ops = orig_node.ops
+    else:
+        # Shared nodes are copied separately, so the nodes don't line up.
+        for node in nodes:
+            node.ops = orig_nodes[0].ops
+    if any(node.has_param(name) is None for node in nodes for name in node.param_names):
+        model.initialize(X=X_sample)
+    depths = dict(_iter_depths(model, 0))
+    # Combinators often return their children's outputs, which are only
+    # counted for the node that created them.
+    seen: Dict[int, Any] = {}
+    summaries: Dict[int, NodeSummary] = {}
+    tracers: Dict[int, TracingOps] = {}
+    for node in nodes:
+        summary = NodeSummary(node.name, depths[node.id])
+        for name in node.param_names:
+            if node.has_param(name):
+                param = node.get_param(name)
+                summary.n_params += int(param.size)
+                summary.param_bytes += int(param.nbytes)
+        summaries[node.id] = summary
+        tracers[node.id] = node.ops = TracingOps(node.ops)
+        node.replace_callbacks(_wrap_forward(node._func, summary, seen), init=node.init)
+    Y, backprop = model(X_sample, is_train=True)
+    for node in nodes:
+        summaries[node.id].forward_flops = _get_flops(tracers[node.id])
+        tracers[node.id].trace.clear()
+    if backward:
+        backprop(Y)
+        for node in nodes:
+            summaries[node.id].backward_flops = _get_flops(tracers[node.id])
+    return ModelSummary([summaries[node.id] for node in nodes])
+
+
+def _wrap_forward(
+    forward: Callable, summary: NodeSummary, seen: Dict[int, Any]
+) -> Callable:
+    def summary_forward(model: Model, X: Any, is_train: bool) -> Tuple[Any, Callable]:
+        Y, backprop = forward(model, X, is_train)
+        summary.input_shape = _get_shape(X)
+        summary.output_shape = _get_shape(Y)
+        summary.input_bytes += _get_nbytes(X)
+        summary.activation_bytes += _get_new_nbytes(Y, seen)
+
+        def summary_backprop(dY: Any) -> Any:
+            dX = backprop(dY)
+            summary.gradient_bytes += _get_new_nbytes(dX, seen)
+            return dX
+
+        return Y, summary_backprop
+
+    return summary_forward
+
+
+def _iter_depths(node: Model, depth: int) -> Iterator[Tuple[int, int]]:
+    yield node.id, depth
+    for layer in node.layers:
+        yield from _iter_depths(layer, depth + 1)
+
+
+def _get_new_nbytes(obj: Any, seen: Dict[int, Any]) -> int:
+    n_bytes = 0
+    for array in _iter_arrays([obj]):
+        if id(array) not in seen:
+            # Keep a reference, so that the id can't be reused.
+            seen[id(array)] = array
+            n_bytes += int(array.nbytes)
+    return n_bytes
+
+
+def _get_flops(ops: TracingOps) -> int:
+    return sum(stats.flops for stats in ops.trace.stats.values())
+
+
+__all__ = ["model_summary", "ModelSummary", "NodeSummary"]
@@ -1,4 +1,7 @@
+from thinc.backends import NumpyOps
+from thinc.backends._arena import BufferArena
 from thinc.backends._param_server import ParamServer
+from thinc.types import RowSparse
 import numpy
 
 
@@ -9,3 +12,83 @@ def test_param_server_init():
     ps = ParamServer(params, grads)
     assert ps.param_keys == (("a", 1), ("b", 2))
     assert ps.grad_keys == (("a", 1),)
+
+
+def test_buffer_arena_reuse():
+    arena = BufferArena()
+    X = arena.alloc((4, 5), dtype="f")
+    assert X.shape == (4, 5)
+    assert X.dtype == numpy.float32
+    X += 1
+    address = X.__array_interface__["data"][0]
+    del X
+    arena.reset()
+    Y = arena.alloc((5, 4), dtype="f")
+    assert Y.__array_interface__["data"][0] == address
+    assert not Y.any()
+    assert arena.n_allocated == 1
+    assert arena.n_reused == 1
+    assert arena.bytes_reused == Y.nbytes
+
+
+def test_buffer_arena_keeps_referenced_buffers():
+    arena = BufferArena()
+    X = arena.alloc((10,), dtype="i")
+    view = X[2:]
+    del X
+    arena.reset()
+    Y = arena.alloc((10,), dtype="i")
+    Y += 1
+    assert not view.any()
+    assert arena.n_allocated == 2
+    del view
+    arena.reset()
+    arena.clear()
+    assert arena.bytes_reserved == arena.min_size
+
+
+def test_buffer_arena_keeps_views_of_views():
+    arena = BufferArena()
+    arrays = [arena.alloc((4, 5), dtype="f") for _ in range(3)]
+    views = [array.T[1:][::2].reshape(2, 4) for array in arrays]
+    del arrays
+    arena.reset()
+    assert arena.bytes_reserved == 3 * arena.min_size
+    new_arrays = [arena.alloc((4, 5), dtype="f") for _ in range(3)]
+    for array in new_arrays:
+        array += 1
+    assert not any(view.any() for view in views)
+    assert arena.n_reused == 0
+    del views
+    arena.reset()
+    arena.alloc((4, 5), dtype="f")
+    assert arena.n_reused == 1
+
+
+def test_numpy_ops_use_arena():
+    ops = NumpyOps(use_arena=True)
+    X = numpy.random.uniform(-1, 1, (6, 3)).astype("f")
+    lengths = numpy.asarray([2, 4], dtype="i")
+    expected = NumpyOps().reduce_max(X, lengths)
+    for _ in range(3):
+        maxes, which = ops.reduce_max(X, lengths)
+        numpy.testing.assert_allclose(maxes, expected[0])
+        numpy.testing.assert_equal(which, expected[1])
+        dX = ops.backprop_reduce_max(maxes, which, lengths)
+        assert dX.shape == X.shape
+        del maxes, which, dX
+        ops.arena.reset()
+    assert ops.arena.n_reused >= 3
+
+
+def test_param_server_inc_row_sparse_grad():
+    values = numpy.ones((2, 3), dtype="f")
+    ps = ParamServer()
+    ps.inc_grad(0, "E", RowSparse(numpy.asarray([0, 2], dtype="i"), values, (4, 3)))
+    ps.inc_grad(0, "E", RowSparse(numpy.asarray([2, 3], dtype="i"), values, (4, 3)))
+    grad = ps.get_grad(0, "E")
+    assert isinstance(grad, RowSparse)
+    assert len(grad) == 4
+    numpy.testing.assert_equal(grad.to_dense().sum(axis=1), [3.0, 0.0, 6.0, 3.0])
+    ps.inc_grad(0, "E", numpy.ones((4, 3), dtype="f"))
+    numpy.testing.assert_equal(ps.get_grad(0, "E").sum(axis=1), [6.0, 3.0, 9.0, 6.0])
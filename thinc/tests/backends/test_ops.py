@@ -3,7 +3,7 @@ import numpy
 from hypothesis import given, settings
 from hypothesis.strategies import composite, integers
 from numpy.testing import assert_allclose
-from thinc.api import NumpyOps, CupyOps, Ops, get_ops
+from thinc.api import NumpyOps, CupyOps, TracingOps, Ops, get_ops
 from thinc.api import get_current_ops, use_ops
 from thinc.util import has_torch
 from thinc.api import fix_random_seed
@@ -82,7 +82,7 @@ else:
     TORCH_FUNCS = []
 
 
-@pytest.mark.parametrize("op", [NumpyOps, CupyOps])
+@pytest.mark.parametrize("op", [NumpyOps, CupyOps, TracingOps])
 def test_ops_consistency(op):
     """Test that specific ops don't define any methods that are not on the
     Ops base class and that all ops methods define the exact same arguments."""
@@ -620,6 +620,27 @@ def test_gemm_out_used(cpu_ops):
     assert numpy.array_equal(c, numpy.zeros((2, 2)))
 
 
+@pytest.mark.parametrize("cpu_ops", [*CPU_OPS, BLIS_OPS])
+@pytest.mark.parametrize("trans1,trans2", [(False, False), (True, False), (False, True)])
+@pytest.mark.parametrize("nI", [0, 5, 2500])
+def test_gemm_int8(cpu_ops, trans1, trans2, nI):
+    # With 2500 columns, the sums are larger than floats represent exactly,
+    # so they have to be computed in chunks.
+    X = numpy.random.randint(-128, 128, size=(6, nI)).astype("int8")
+    W = numpy.random.randint(-128, 128, size=(nI, 4)).astype("int8")
+    X[0] = -128
+    W[:, 0] = -128
+    expected = numpy.dot(X.astype("int64"), W.astype("int64"))
+    x = numpy.ascontiguousarray(X.T) if trans1 else X
+    w = numpy.ascontiguousarray(W.T) if trans2 else W
+    Y = cpu_ops.gemm_int8(x, w, trans1=trans1, trans2=trans2)
+    assert Y.dtype == "int32"
+    numpy.testing.assert_array_equal(Y, expected)
+    out = numpy.ones(Y.shape, dtype="int32")
+    cpu_ops.gemm_int8(x, w, out=out, trans1=trans1, trans2=trans2)
+    numpy.testing.assert_array_equal(out, expected)
+
+
 @pytest.mark.parametrize("cpu_ops", CPU_OPS)
 @settings(max_examples=MAX_EXAMPLES, deadline=None)
 @given(X=strategies.arrays_BI())
@@ -672,6 +693,44 @@ def test_reduce_max(ops):
         start += length
 
 
+def test_numpy_ops_n_threads():
+    with pytest.raises(ValueError):
+        NumpyOps(n_threads=0)
+    ops = NumpyOps(n_threads=4)
+    X = ops.xp.random.uniform(-1, 1, (19, 5)).astype("f")
+    lengths = ops.asarray1i([5, 0, 5, 3, 6])
+    cols = ops.seq2col(X, 2, lengths=lengths)
+    assert_allclose(cols, NUMPY_OPS.seq2col(X, 2, lengths=lengths))
+    assert_allclose(
+        ops.backprop_seq2col(cols, 2, lengths=lengths),
+        NUMPY_OPS.backprop_seq2col(cols, 2, lengths=lengths),
+    )
+    lengths = ops.asarray1i([5, 5, 3, 6])
+    for reduce in ("reduce_sum", "reduce_mean"):
+        Y = getattr(ops, reduce)(X, lengths)
+        assert_allclose(Y, getattr(NUMPY_OPS, reduce)(X, lengths), rtol=1e-5)
+        dX = getattr(ops, f"backprop_{reduce}")(Y, lengths)
+        assert_allclose(dX, getattr(NUMPY_OPS, f"backprop_{reduce}")(Y, lengths))
+    maxes, which = ops.reduce_max(X, lengths)
+    expected_maxes, expected_which = NUMPY_OPS.reduce_max(X, lengths)
+    assert_allclose(maxes, expected_maxes)
+    assert_allclose(which, expected_which)
+    assert_allclose(
+        ops.backprop_reduce_max(maxes, which, lengths),
+        NUMPY_OPS.backprop_reduce_max(maxes, which, lengths),
+    )
+    X3d = ops.xp.ascontiguousarray(ops.reshape3f(X[:18], 6, 5, 3))
+    best, which = ops.maxout(X3d)
+    expected_best, expected_which = NUMPY_OPS.maxout(X3d)
+    assert_allclose(best, expected_best)
+    assert_allclose(which, expected_which)
+    assert_allclose(
+        ops.backprop_maxout(best, which, 3), NUMPY_OPS.backprop_maxout(best, which, 3)
+    )
+    assert_allclose(ops.mish(X), NUMPY_OPS.mish(X))
+    assert_allclose(ops.backprop_mish(X, X), NUMPY_OPS.backprop_mish(X, X))
+
+
 @pytest.mark.parametrize("ops", ALL_OPS)
 @settings(max_examples=MAX_EXAMPLES, deadline=None)
 @given(X=strategies.arrays_BI())
@@ -768,6 +827,33 @@ def test_gelu(ops, X):
     assert not ops.xp.isnan(Y).any()
 
 
+@pytest.mark.parametrize(
+    "name",
+    ["gelu", "gelu_approx", "swish", "hard_swish", "hard_swish_mobilenet", "erf"],
+)
+def test_activation_kernels(name):
+    # The NumpyOps kernels should match the reference implementations, also
+    # for inputs outside the range in which they saturate.
+    X = numpy.linspace(-10.0, 10.0, 501, dtype="f")
+    X = numpy.concatenate([X, [-100.0, -90.0, -30.0, 0.0, 30.0, 90.0, 100.0]])
+    X = numpy.ascontiguousarray(numpy.tile(X.reshape((-1, 1)), (1, 4)))
+    dY = numpy.random.uniform(-1.0, 1.0, X.shape).astype("f")
+    with numpy.errstate(over="ignore"):
+        Y = getattr(VANILLA_OPS, name)(X)
+    assert_allclose(getattr(NUMPY_OPS, name)(X), Y, atol=1e-5)
+    if name == "erf":
+        return
+    Y_inplace = getattr(NUMPY_OPS, name)(X.copy(), inplace=True)
+    assert_allclose(Y_inplace, Y, atol=1e-5)
+    args = (X, Y) if name == "swish" else (X,)
+    backprop = "backprop_" + name
+    with numpy.errstate(over="ignore"):
+        dX = getattr(VANILLA_OPS, backprop)(dY, *args)
+    assert_allclose(getattr(NUMPY_OPS, backprop)(dY, *args), dX, atol=1e-5)
+    dX_inplace = getattr(NUMPY_OPS, backprop)(dY.copy(), *args, inplace=True)
+    assert_allclose(dX_inplace, dX, atol=1e-5)
+
+
 @pytest.mark.parametrize("ops", ALL_OPS)
 @settings(max_examples=MAX_EXAMPLES, deadline=None)
 @given(X=strategies.arrays_BI())
@@ -854,6 +940,76 @@ def test_lstm_forward_training_fuzz(ops, args):
     assert_allclose(Y, reference[0], atol=1e-4, rtol=1e-3)
 
 
+@pytest.mark.parametrize("ops", XP_OPS)
+@pytest.mark.parametrize(
+    "depth,dirs,nO,batch_size,nI",
+    [(1, 1, 2, 3, 2), (2, 1, 3, 4, 2), (1, 2, 4, 3, 3), (3, 2, 4, 2, 5)],
+)
+def test_lstm_forward_inference(ops, depth, dirs, nO, batch_size, nI):
+    params, H0, C0, X, size_at_t = get_lstm_args(depth, dirs, nO, batch_size, nI)
+    params = ops.asarray1f(numpy.random.uniform(-0.5, 0.5, params.shape))
+    X = ops.asarray2f(numpy.random.uniform(-1.0, 1.0, X.shape))
+    Y, _ = ops.lstm_forward_training(params, H0, C0, X, size_at_t)
+    Y_inference = ops.lstm_forward_inference(params, H0, C0, X, size_at_t)
+    assert_allclose(Y_inference, Y, atol=1e-6)
+
+
+@pytest.mark.parametrize(
+    "depth,dirs,nO,nI,lengths",
+    [
+        (1, 1, 3, 2, [2, 2, 1]),
+        (1, 2, 4, 2, [3, 2, 2, 1]),
+        (2, 2, 2, 3, [2, 1, 1]),
+    ],
+)
+def test_backprop_lstm(depth, dirs, nO, nI, lengths):
+    ops = NUMPY_OPS
+    params, H0, C0, _, _ = get_lstm_args(depth, dirs, nO, 1, nI)
+    size_at_t = ops.asarray1i(lengths)
+    params = ops.asarray1f(numpy.random.uniform(-0.5, 0.5, params.shape))
+    H0 = ops.asarray3f(numpy.random.uniform(-0.5, 0.5, H0.shape))
+    C0 = ops.asarray3f(numpy.random.uniform(-0.5, 0.5, C0.shape))
+    X = ops.asarray2f(numpy.random.uniform(-1.0, 1.0, (sum(lengths), nI)))
+    Y, fwd_state = ops.lstm_forward_training(params, H0, C0, X, size_at_t)
+    dY = ops.asarray2f(numpy.random.uniform(-1.0, 1.0, Y.shape))
+    dX, d_params = ops.backprop_lstm(dY.copy(), size_at_t, params, fwd_state)
+
+    def loss(params, X):
+        Y, _ = ops.lstm_forward_training(params, H0, C0, X, size_at_t)
+        return float((Y * dY).sum())
+
+    def numeric_gradient(array, get_loss, eps=1e-2):
+        grad = numpy.zeros(array.shape, dtype="f")
+        for i in numpy.ndindex(array.shape):
+            orig = array[i]
+            array[i] = orig + eps
+            plus = get_loss()
+            array[i] = orig - eps
+            minus = get_loss()
+            array[i] = orig
+            grad[i] = (plus - minus) / (2 * eps)
+        return grad
+
+    assert_allclose(
+        dX, numeric_gradient(X, lambda: loss(params, X)), atol=1e-2, rtol=1e-2
+    )
+    # The gradient of the hidden-to-gates bias is folded into the
+    # input-to-gates bias, and reported as zeros.
+    bh_mask = numpy.ones(params.shape, dtype="bool")
+    params_i = 0
+    for i in range(depth):
+        layer_nI = nI if i == 0 else nO
+        for _ in range(dirs):
+            nH = nO // dirs
+            params_i += 4 * nH * layer_nI + 4 * nH + 4 * nH * nH
+            bh_mask[params_i : params_i + 4 * nH] = False
+            params_i += 4 * nH
+    assert params_i == params.size
+    numeric = numeric_gradient(params, lambda: loss(params, X))
+    assert_allclose(d_params[bh_mask], numeric[bh_mask], atol=1e-2, rtol=1e-2)
+    assert (d_params[~bh_mask] == 0).all()
+
+
 def test_get_ops():
     assert isinstance(get_ops("numpy"), NumpyOps)
     assert isinstance(get_ops("cupy"), CupyOps)
@@ -914,6 +1070,52 @@ def test_minibatch():
         ops.minibatch(10, True)
 
 
+def test_minibatch_lengths():
+    fix_random_seed(0)
+    ops = get_current_ops()
+    lengths = [5, 1, 3, 8, 2, 2, 7, 1]
+    items = list(range(len(lengths)))
+    batches = ops.minibatch(8, items, lengths=lengths)
+    assert len(batches) == 4
+    assert [sorted(batch) for batch in batches] == [[1, 4, 5, 7], [0, 2], [6], [3]]
+    batches = ops.minibatch(8, items, lengths=lengths, count_padding=True)
+    assert [len(batch) for batch in batches] == [4, 1, 1, 1, 1]
+    batches = ops.minibatch(8, items, lengths=lengths, shuffle=True)
+    for _ in range(3):
+        output = list(batches)
+        assert len(output) == len(batches)
+        assert sorted(item for batch in output for item in batch) == items
+        for batch in output:
+            batch_lengths = [lengths[i] for i in batch]
+            assert sum(batch_lengths) <= 8 or len(batch) == 1
+    with pytest.raises(ValueError):
+        ops.minibatch(8, items, lengths=lengths[:-1])
+
+
+def test_minibatch_prefetch():
+    ops = get_current_ops()
+    items = list(range(10))
+    batches = ops.minibatch(3, items, prefetch=2)
+    assert len(batches) == 4
+    assert list(batches) == list(ops.minibatch(3, items))
+    assert list(batches) == [[0, 1, 2], [3, 4, 5], [6, 7, 8], [9]]
+    # Stopping early shuts down the worker.
+    for batch in ops.minibatch(1, items, prefetch=1):
+        break
+    batches = ops.multibatch(4, numpy.arange(10), items, prefetch=1, shuffle=True)
+    output = list(batches)
+    assert len(output) == len(batches)
+    for arr, lst in output:
+        assert arr.tolist() == lst
+
+    class Broken(list):
+        def __getitem__(self, i):
+            raise IndexError("broken")
+
+    with pytest.raises(IndexError, match="broken"):
+        list(ops.minibatch(3, Broken(items), prefetch=2))
+
+
 def test_multibatch():
     fix_random_seed(0)
     ops = get_current_ops()
@@ -1006,3 +1208,191 @@ def test_clipped_linear(ops, x):
         ops.backprop_clipped_linear(1.0, x_thinc, slope=0.2, offset=0.5),
         ops.backprop_hard_sigmoid(1.0, x_thinc),
     )
+
+
+@pytest.mark.parametrize("use_averages", [True, False])
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {},
+        {"L2": 0.1, "grad_clip": 0.5},
+        {"weight_decay": 0.01, "grad_clip": 100.0},
+        {"use_mom2": False},
+    ],
+)
+def test_multi_adam(use_averages, kwargs):
+    shapes = [(7,), (130,), (1,)]
+    results = []
+    for ops in (NUMPY_OPS, VANILLA_OPS, NumpyOps(n_threads=2)):
+        rng = numpy.random.RandomState(0)
+        weights = [rng.uniform(-1, 1, shape).astype("f") for shape in shapes]
+        grads = [rng.uniform(-1, 1, shape).astype("f") for shape in shapes]
+        mom1 = [rng.uniform(-1, 1, shape).astype("f") for shape in shapes]
+        mom2 = [rng.uniform(0, 1, shape).astype("f") for shape in shapes]
+        averages = None
+        if use_averages:
+            averages = [numpy.zeros(shape, dtype="f") for shape in shapes]
+        ops.multi_adam(
+            weights, grads, mom1, mom2, averages, 0.9, 0.999, 1e-8, 0.01, **kwargs
+        )
+        for grad in grads:
+            assert not grad.any()
+        results.append((weights, mom1, mom2, averages))
+    for result in results[1:]:
+        for expected, arrays in zip(results[0], result):
+            if expected is not None:
+                for x, y in zip(expected, arrays):
+                    assert_allclose(x, y, rtol=1e-5, atol=1e-6)
+
+
+def test_tracing_ops():
+    with use_ops("tracing", inner="numpy"):
+        ops = get_current_ops()
+    assert isinstance(ops, TracingOps)
+    assert isinstance(ops.inner, NumpyOps)
+    assert ops.xp is numpy
+    assert ops.n_threads == ops.inner.n_threads
+    X = ops.alloc2f(4, 3) + 1
+    W = ops.alloc2f(2, 3) + 1
+    Y = ops.gemm(X, W, trans2=True)
+    assert_allclose(Y, NUMPY_OPS.gemm(X, W, trans2=True))
+    ops.relu(Y, inplace=True)
+    stats = ops.trace.stats
+    assert stats["alloc2f"].calls == 2
+    assert stats["alloc2f"].flops == 0
+    assert stats["gemm"].calls == 1
+    assert stats["gemm"].flops == 2 * 4 * 2 * 3
+    assert stats["gemm"].bytes_moved == X.nbytes + W.nbytes + Y.nbytes
+    assert sum(stats["gemm"].histogram.values()) == 1
+    assert stats["relu"].flops == Y.size
+    assert "gemm" in ops.trace.format_table()
+    ops.trace.clear()
+    assert not ops.trace.stats
+
+
+@pytest.mark.skipif(CupyOps.xp is None, reason="cupy not installed")
+def test_tracing_ops_copies():  # pragma: no cover
+    ops = TracingOps(inner="cupy", warn_on_copy=True)
+    with pytest.warns(UserWarning):
+        ops.asarray(numpy.zeros((2,), dtype="f"))
+    assert ops.trace.stats["asarray"].copies == 1
+
+
+@pytest.mark.parametrize("ops", ALL_OPS)
+@pytest.mark.parametrize("inplace", [True, False])
+def test_dropout(ops, inplace):
+    X = ops.xp.ones((100, 50), dtype="f")
+    Y, mask = ops.dropout(X, 0.25, inplace=inplace)
+    assert (Y is X) == inplace
+    assert mask.dtype == ops.xp.bool_
+    assert mask.shape == X.shape
+    assert 0.7 < float(mask.mean()) < 0.8
+    assert_allclose(ops.to_numpy(Y), ops.to_numpy(mask / 0.75), rtol=1e-6)
+    dY = ops.xp.ones((100, 50), dtype="f")
+    dX = ops.backprop_dropout(dY, mask, 0.25, inplace=inplace)
+    assert (dX is dY) == inplace
+    assert_allclose(ops.to_numpy(dX), ops.to_numpy(mask / 0.75), rtol=1e-6)
+    Y, mask = ops.dropout(ops.xp.ones((4,), dtype="f"), 1.0)
+    assert not Y.any() and not mask.any()
+    Y, mask = ops.dropout(ops.xp.ones((4,), dtype="f"), 0.0)
+    assert Y.all() and mask.all()
+
+
+def test_dropout_seed():
+    X = numpy.ones((10, 10), dtype="f")
+    fix_random_seed(0)
+    Y1, _ = NUMPY_OPS.dropout(X, 0.5)
+    mask1 = NUMPY_OPS.get_dropout_mask((10,), 0.5)
+    fix_random_seed(0)
+    Y2, _ = NUMPY_OPS.dropout(X, 0.5)
+    mask2 = NUMPY_OPS.get_dropout_mask((10,), 0.5)
+    assert_allclose(Y1, Y2)
+    assert_allclose(mask1, mask2)
+    assert set(mask1.tolist()) <= {0.0, 2.0}
+
+
+@pytest.mark.parametrize("ops", ALL_OPS)
+def test_layer_norm(ops):
+    X = numpy.random.uniform(-1, 1, (20, 30)).astype("f") + 100
+    G = numpy.random.uniform(0.5, 1.5, (30,)).astype("f")
+    b = numpy.random.uniform(-1, 1, (30,)).astype("f")
+    dY = numpy.random.uniform(-1, 1, (20, 30)).astype("f")
+    Y, mean, rstd = ops.layer_norm(ops.asarray(X), ops.asarray(G), ops.asarray(b))
+    mu = X.astype("d").mean(axis=1, keepdims=True)
+    Xhat = (X - mu) / numpy.sqrt(X.astype("d").var(axis=1, keepdims=True) + 1e-8)
+    assert_allclose(ops.to_numpy(mean), mu[:, 0], rtol=1e-6)
+    assert_allclose(ops.to_numpy(Y), Xhat * G + b, atol=1e-3)
+    dX, dG, db = ops.backprop_layer_norm(
+        ops.asarray(dY), ops.asarray(X), ops.asarray(G), mean, rstd
+    )
+    dXhat = dY * G
+    expected_dX = dXhat - dXhat.mean(axis=1, keepdims=True)
+    expected_dX -= Xhat * (dXhat * Xhat).mean(axis=1, keepdims=True)
+    expected_dX *= ops.to_numpy(rstd)[:, None]
+    assert_allclose(ops.to_numpy(dX), expected_dX, atol=1e-3)
+    assert_allclose(ops.to_numpy(dG), (dY * Xhat).sum(axis=0), atol=1e-3)
+    assert_allclose(ops.to_numpy(db), dY.sum(axis=0), atol=1e-4)
+
+
+@pytest.mark.parametrize("ops", ALL_OPS)
+@pytest.mark.parametrize(
+    "act", ["relu", "gelu", "swish", "hard_swish", "hard_swish_mobilenet", "mish"]
+)
+def test_affine_act(ops, act):
+    X = ops.asarray(numpy.random.uniform(-2, 2, (8, 5)).astype("f"))
+    W = ops.asarray(numpy.random.uniform(-1, 1, (6, 5)).astype("f"))
+    b = ops.asarray(numpy.random.uniform(-1, 1, (6,)).astype("f"))
+    dY = ops.asarray(numpy.random.uniform(-1, 1, (8, 6)).astype("f"))
+    Y_preact = ops.affine(X, W, b)
+    Y, kept = ops.affine_act(X, W, b, act)
+    if act == "mish":
+        expected_Y = ops.mish(Y_preact)
+        expected_dY = NUMPY_OPS.backprop_mish(
+            ops.to_numpy(dY), ops.to_numpy(Y_preact)
+        )
+    elif act == "relu":
+        assert kept is None
+        expected_Y = ops.relu(Y_preact)
+        expected_dY = ops.backprop_relu(dY, expected_Y)
+    else:
+        expected_Y = getattr(ops, act)(Y_preact)
+        if act == "swish":
+            expected_dY = ops.backprop_swish(dY, Y_preact, expected_Y)
+        else:
+            expected_dY = getattr(ops, "backprop_" + act)(dY, Y_preact)
+        assert_allclose(ops.to_numpy(kept), ops.to_numpy(Y_preact), atol=1e-6)
+    assert_allclose(ops.to_numpy(Y), ops.to_numpy(expected_Y), atol=1e-5)
+    Y_predict, kept = ops.affine_act(X, W, b, act, keep_preact=False)
+    assert kept is None
+    assert_allclose(ops.to_numpy(Y_predict), ops.to_numpy(Y))
+    # Ops.backprop_mish doesn't match the gradient computed by NumpyOps for
+    # positive inputs.
+    if act != "mish" or isinstance(ops, NumpyOps):
+        dX, dW, db = ops.backprop_affine_act(dY, X, W, Y, Y_preact, act)
+        dY_preact = ops.asarray(expected_dY)
+        assert_allclose(
+            ops.to_numpy(db), ops.to_numpy(dY_preact.sum(axis=0)), atol=1e-5
+        )
+        assert_allclose(ops.to_numpy(dW), ops.to_numpy(dY_preact.T @ X), atol=1e-5)
+        assert_allclose(ops.to_numpy(dX), ops.to_numpy(dY_preact @ W), atol=1e-5)
+    with pytest.raises(ValueError):
+        ops.affine_act(X, W, b, "tanh")
+
+
+@pytest.mark.parametrize("ops", ALL_OPS)
+def test_affine_maxout(ops):
+    X = ops.asarray(numpy.random.uniform(-2, 2, (8, 5)).astype("f"))
+    W = ops.asarray(numpy.random.uniform(-1, 1, (6, 3, 5)).astype("f"))
+    b = ops.asarray(numpy.random.uniform(-1, 1, (6, 3)).astype("f"))
+    dY = ops.asarray(numpy.random.uniform(-1, 1, (8, 6)).astype("f"))
+    Z = ops.reshape3f(ops.affine(X, ops.reshape2f(W, 18, 5), b.ravel()), 8, 6, 3)
+    best, which = ops.affine_maxout(X, W, b)
+    assert_allclose(ops.to_numpy(best), ops.to_numpy(Z.max(axis=-1)), atol=1e-6)
+    assert_allclose(ops.to_numpy(which), ops.to_numpy(Z.argmax(axis=-1)))
+    dX, dW, db = ops.backprop_affine_maxout(dY, X, W, which)
+    dZ = ops.reshape2f(ops.backprop_maxout(dY, which, 3), 8, 18)
+    assert_allclose(ops.to_numpy(db), ops.to_numpy(dZ.sum(axis=0)).reshape((6, 3)))
+    expected_dW = ops.to_numpy(dZ.T @ X).reshape((6, 3, 5))
+    assert_allclose(ops.to_numpy(dW), expected_dW, atol=1e-5)
+    expected_dX = ops.to_numpy(dZ @ ops.reshape2f(W, 18, 5))
+    assert_allclose(ops.to_numpy(dX), expected_dX, atol=1e-5)
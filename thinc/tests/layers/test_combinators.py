@@ -2,7 +2,7 @@ import pytest
 import numpy
 from numpy.testing import assert_allclose
 from thinc.api import clone, concatenate, noop, add, map_list
-from thinc.api import Linear, Dropout, Model, NumpyOps
+from thinc.api import Linear, Dropout, Model, NumpyOps, Maxout, Relu, with_array
 from thinc.layers import chain, tuplify
 
 
@@ -289,3 +289,32 @@ def test_map_list():
     assert len(dXs) == len(Xs)
     assert dXs[0].shape == Xs[0].shape
     assert dXs[1].shape == Xs[1].shape
+
+
+def test_predict_does_not_call_forward():
+    def forward(model, X, is_train):
+        raise AssertionError("forward called")
+
+    def predict(model, X):
+        return X * 2
+
+    layer = Model("double", forward, predict=predict)
+    model = chain(Linear(2, 2), concatenate(layer, with_array(layer)))
+    model.initialize()
+    X = numpy.ones((3, 2), dtype="f")
+    assert model.predict(X).shape == (3, 4)
+    with pytest.raises(AssertionError):
+        model(X, is_train=False)
+    assert model.copy().predict(X).shape == (3, 4)
+
+
+def test_predict_matches_forward():
+    X = numpy.random.uniform(-1, 1, (5, 4)).astype("f")
+    model = chain(
+        Relu(3), concatenate(Maxout(2), Linear(3)), with_array(Linear(2))
+    ).initialize(X=X)
+    assert_allclose(model.predict(X), model(X, is_train=False)[0], rtol=1e-6)
+    seq_model = with_array(concatenate(Relu(3), Linear(2))).initialize(X=[X])
+    Xs = [X, X[:2]]
+    for Y, Yf in zip(seq_model.predict(Xs), seq_model(Xs, is_train=False)[0]):
+        assert_allclose(Y, Yf, rtol=1e-6)
@@ -1,5 +1,6 @@
 import numpy
-from thinc.api import HashEmbed
+import pytest
+from thinc.api import HashEmbed, Embed, RowSparse
 
 
 def test_init():
@@ -16,3 +17,28 @@ def test_seed_changes_bucket():
     vector1 = model1.predict(arr)
     vector2 = model2.predict(arr)
     assert vector1.sum() != vector2.sum()
+
+
+@pytest.mark.parametrize(
+    "make_model",
+    [lambda **kw: HashEmbed(8, 100, seed=1, **kw), lambda **kw: Embed(8, 100, **kw)],
+)
+def test_sparse_grad(make_model):
+    dense = make_model().initialize()
+    sparse = make_model(sparse_grad=True).initialize()
+    sparse.set_param("E", dense.get_param("E").copy())
+    ids = numpy.asarray([1, 5, 1, 7], dtype="uint64")
+    Y, backprop = dense.begin_update(ids)
+    sparse_Y, sparse_backprop = sparse.begin_update(ids)
+    numpy.testing.assert_equal(sparse_Y, Y)
+    for _ in range(2):
+        dY = numpy.random.uniform(-1, 1, Y.shape).astype("f")
+        backprop(dY.copy())
+        sparse_backprop(dY)
+        # The caller may reuse its gradient buffer after the backprop.
+        dY.fill(0)
+    d_rows = sparse.get_grad("E")
+    assert isinstance(d_rows, RowSparse)
+    numpy.testing.assert_allclose(
+        d_rows.to_dense(), dense.get_grad("E"), rtol=1e-5, atol=1e-6
+    )
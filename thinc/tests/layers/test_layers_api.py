@@ -171,6 +171,30 @@ def test_dropout(data):
     assert_data_match(dX, data)
 
 
+@pytest.mark.parametrize(
+    "name",
+    [
+        "Relu.v1",
+        "Gelu.v1",
+        "Swish.v1",
+        "Mish.v1",
+        "HardSwish.v1",
+        "HardSwishMobilenet.v1",
+        "Maxout.v1",
+    ],
+)
+def test_layers_backprop_without_training(name):
+    # The callback of a call with is_train=False can still backprop.
+    model = registry.resolve({"config": {"@layers": name}})["config"]
+    model.initialize(array2d, array2d)
+    Y_train, backprop_train = model(array2d, is_train=True)
+    Y, backprop = model(array2d, is_train=False)
+    assert_almost_equal(Y, Y_train, decimal=5)
+    assert_almost_equal(model.predict(array2d), Y, decimal=5)
+    dY = numpy.ones_like(Y)
+    assert_almost_equal(backprop(dY), backprop_train(dY), decimal=5)
+
+
 @pytest.mark.parametrize("name,kwargs,in_data,out_data", TEST_CASES)
 def test_layers_batching_all(name, kwargs, in_data, out_data):
     cfg = {"@layers": name, **kwargs}
@@ -0,0 +1,78 @@
+import pytest
+import numpy
+from numpy.testing import assert_allclose
+from thinc.api import Linear, Maxout, Relu, Softmax, chain, residual
+from thinc.api import QuantizedLinear, quantize_model
+
+
+def get_model():
+    model = chain(
+        Relu(16, 8),
+        residual(Maxout(16, 16, 3, normalize=True)),
+        Linear(12, 16),
+        Softmax(5, 12),
+    )
+    X = get_data()
+    model.initialize(X=X)
+    # Softmax is initialized with zeros, which would make the test trivial.
+    softmax = model.layers[-1]
+    W = softmax.get_param("W")
+    softmax.set_param("W", numpy.random.uniform(-1, 1, W.shape).astype("f"))
+    return model
+
+
+def get_data(n=64):
+    return numpy.random.uniform(-1, 1, (n, 8)).astype("f")
+
+
+def test_quantize_model():
+    model = get_model()
+    X = get_data()
+    Y = model.predict(X)
+    n_nodes = len(list(model.walk()))
+    model = quantize_model(model, [X[:32], X[32:]])
+    assert len(list(model.walk())) == n_nodes
+    nodes = model.walk(order="dfs_pre")
+    quantized = [node for node in nodes if node.name == "quantized_linear"]
+    assert [node.attrs["activation"] for node in quantized] == [
+        "relu",
+        "maxout",
+        None,
+        "softmax",
+    ]
+    for node in quantized:
+        assert node.get_param("W").dtype == "int8"
+        assert node.attrs["X_scale"] > 0
+    assert_allclose(model.predict(X), Y, atol=0.1)
+    assert (model.predict(X).argmax(axis=1) == Y.argmax(axis=1)).mean() >= 0.9
+
+
+def test_quantize_model_serialize():
+    model = quantize_model(get_model(), [get_data()])
+    X = get_data()
+    Y = model.predict(X)
+    data = model.to_bytes()
+    loaded = quantize_model(get_model())
+    assert not loaded.layers[0].has_param("W")
+    loaded.from_bytes(data)
+    assert loaded.layers[0].get_param("W").dtype == "int8"
+    assert_allclose(loaded.predict(X), Y)
+    assert loaded.to_bytes() == data
+
+
+def test_quantize_model_layer():
+    model = Linear(4, 8)
+    X = get_data()
+    model.initialize(X=X)
+    quantized = quantize_model(model, [X])
+    assert quantized is not model
+    assert quantized.name == "quantized_linear"
+    assert_allclose(quantized.predict(X), model.predict(X), atol=0.1)
+    Y, backprop = quantized(X, is_train=True)
+    with pytest.raises(ValueError):
+        backprop(Y)
+
+
+def test_quantized_linear_invalid_activation():
+    with pytest.raises(ValueError):
+        QuantizedLinear(4, 8, activation="gelu")
@@ -0,0 +1,109 @@
+import pytest
+import numpy
+from numpy.testing import assert_allclose
+from thinc.api import Adam, Linear, Model, chain, with_cache
+
+
+@pytest.fixture
+def X():
+    return numpy.arange(12, dtype="f").reshape((4, 3))
+
+
+def test_with_cache_predict(X):
+    model = with_cache(Linear(2, 3)).initialize(X=X)
+    expected = model.layers[0].predict(X)
+    assert_allclose(model.predict(X), expected)
+    cache = model.attrs["cache"]
+    assert len(cache) == 4
+    assert cache.hits == 0 and cache.misses == 4
+    assert_allclose(model.predict(X[::-1]), expected[::-1])
+    assert cache.hits == 4 and cache.misses == 4
+    assert cache.hit_rate == 0.5
+    Y, backprop = model(X, is_train=False)
+    assert_allclose(Y, expected)
+    with pytest.raises(ValueError):
+        backprop(Y)
+
+
+def test_with_cache_duplicates(X):
+    calls = []
+
+    def forward(model, X, is_train):
+        calls.append(X.shape[0])
+        return X * 2, lambda dY: dY * 2
+
+    model = with_cache(Model("double", forward))
+    Y = model.predict(numpy.vstack([X[:1], X[:1], X[1:2]]))
+    assert calls == [2]
+    assert_allclose(Y, numpy.vstack([X[:1], X[:1], X[1:2]]) * 2)
+
+
+def test_with_cache_eviction(X):
+    model = with_cache(Linear(2, 3), max_entries=2).initialize(X=X)
+    model.predict(X)
+    cache = model.attrs["cache"]
+    assert len(cache) == 2
+    model.predict(X[2:])
+    assert cache.hits == 2
+    row_bytes = 2 * 4
+    model = with_cache(Linear(2, 3), max_bytes=3 * row_bytes).initialize(X=X)
+    model.predict(X)
+    cache = model.attrs["cache"]
+    assert len(cache) == 3
+    assert cache.n_bytes == 3 * row_bytes
+
+
+def test_with_cache_list():
+    def forward(model, X, is_train):
+        return [len(x) for x in X], lambda dY: dY
+
+    model = with_cache(Model("len", forward), key_fn=tuple)
+    assert model.predict([[1, 2], [3], [1, 2]]) == [2, 1, 2]
+    assert model.attrs["cache"].hits == 0
+    assert len(model.attrs["cache"]) == 2
+    assert model.predict([[3]]) == [1]
+    assert model.attrs["cache"].hits == 1
+
+
+def test_with_cache_train_bypass(X):
+    model = with_cache(Linear(2, 3)).initialize(X=X)
+    model.predict(X)
+    Y, backprop = model.begin_update(X)
+    assert len(model.attrs["cache"]) == 0
+    assert backprop(Y).shape == X.shape
+
+
+def test_with_cache_copy_and_serialize(X):
+    model = with_cache(Linear(2, 3)).initialize(X=X)
+    Y = model.predict(X)
+    assert len(model.copy().attrs["cache"]) == 0
+    model2 = with_cache(Linear(2, 3)).initialize(X=X)
+    model2.predict(X)
+    model2.from_bytes(model.to_bytes())
+    assert len(model2.attrs["cache"]) == 0
+    assert_allclose(model2.predict(X), Y)
+
+
+@pytest.mark.parametrize("flatten", [False, True])
+def test_with_cache_params_change(X, flatten):
+    model = with_cache(chain(Linear(4, 3), Linear(2, 4))).initialize(X=X)
+    if flatten:
+        model.layers[0].flatten_params()
+    linear = model.layers[0].layers[1]
+    Y = model.predict(X)
+    optimizer = Adam(0.1)
+    for _ in range(3):
+        Yh, backprop = model.layers[0].begin_update(X)
+        backprop(Yh)
+        model.layers[0].finish_update(optimizer)
+    # Training the wrapped layer directly doesn't clear the cache, the
+    # update does.
+    Y_trained = model.layers[0].predict(X)
+    assert not numpy.allclose(Y_trained, Y)
+    assert_allclose(model.predict(X), Y_trained)
+    with model.use_params(optimizer.averages):
+        Y_averages = model.predict(X)
+        assert_allclose(Y_averages, model.layers[0].predict(X))
+    assert_allclose(model.predict(X), Y_trained)
+    linear.set_param("W", linear.get_param("W") * 2)
+    assert_allclose(model.predict(X), model.layers[0].predict(X))
@@ -0,0 +1,66 @@
+import json
+import numpy
+from thinc.api import Linear, Relu, chain, with_profile, profile_model, Profiler
+
+
+def test_profile_model(tmp_path):
+    model = chain(Relu(4, 3), Linear(2, 4))
+    X = numpy.ones((5, 3), dtype="f")
+    model.initialize(X=X)
+    wrapped, profiler = profile_model(model)
+    assert wrapped is not model
+    assert wrapped.layers == [model]
+    assert all(layer.name.startswith("with_profile") for layer in model.layers)
+    Y, backprop = wrapped(X, is_train=True)
+    backprop(Y)
+    wrapped.predict(X)
+    assert len(profiler.layers) == 3
+    root = profiler.layers[model.id]
+    assert root.forward_calls == 2
+    assert root.backward_calls == 1
+    assert root.input_shape == (5, 3)
+    assert root.output_shape == (5, 2)
+    assert root.forward_self <= root.forward_total
+    for layer in model.layers:
+        stats = profiler.layers[layer.layers[0].id]
+        assert stats.forward_calls == 2
+        assert stats.backward_calls == 1
+        assert stats.forward_total <= root.forward_total
+    relu = profiler.layers[model.layers[0].layers[0].id]
+    assert relu.output_shape == (5, 4)
+    assert relu.output_bytes == 2 * 5 * 4 * 4 + 5 * 3 * 4
+    assert "relu" in profiler.format_table()
+    trace = profiler.to_chrome_trace(tmp_path / "trace.json")
+    assert len(trace["traceEvents"]) == 9
+    with (tmp_path / "trace.json").open() as file_:
+        assert json.load(file_) == trace
+    profiler.clear()
+    assert not profiler.layers
+
+
+def test_with_profile_wraps_once():
+    profiler = Profiler(max_events=1)
+    layer = Linear(2, 3)
+    model = with_profile(layer, profiler)
+    assert model is not layer
+    assert model.layers == [layer]
+    assert with_profile(model, profiler) is model
+    X = numpy.ones((1, 3), dtype="f")
+    model.initialize(X=X)
+    assert model.get_dim("nO") == 2
+    model.predict(X)
+    model.predict(X)
+    assert profiler.layers[layer.id].forward_calls == 2
+    assert len(profiler.events) == 1
+
+
+def test_with_profile_leaves_layer_unchanged():
+    profiler = Profiler()
+    layer = Linear(2, 3)
+    model = with_profile(layer, profiler)
+    X = numpy.ones((1, 3), dtype="f")
+    model.initialize(X=X)
+    layer.predict(X)
+    assert not profiler.layers
+    model.predict(X)
+    assert profiler.layers[layer.id].forward_calls == 1
@@ -1,11 +1,14 @@
 from collections import Counter
 import pytest
+import sys
 import threading
 import time
 from thinc.api import Adam, CupyOps, Dropout, Linear, Model, Relu
 from thinc.api import Shim, Softmax, chain, change_attr_values
 from thinc.api import concatenate, has_cupy, set_dropout_rate
-from thinc.api import use_ops, with_debug, wrap_model_recursive
+from thinc.api import use_ops, with_debug, wrap_model_recursive, LSTM, fix_random_seed
+from thinc.api import list2ragged, reduce_mean, with_array, Maxout
+from thinc._shared_memory import get_shared_block_view
 from thinc.util import gpu_is_available
 import numpy
 
@@ -614,3 +617,253 @@ def test_walk_bfs_post_order_fails():
     relu = Relu(5)
     with pytest.raises(ValueError, match="Invalid order"):
         relu.walk(order="dfs_post_order")
+
+
+def test_flatten_params():
+    X = numpy.random.uniform(-1, 1, (8, 4)).astype("f")
+    Y = numpy.random.uniform(-1, 1, (8, 3)).astype("f")
+    model = chain(Relu(5), Linear(3)).initialize(X=X, Y=Y)
+    flat_model = model.copy()
+    flat_model.flatten_params()
+    server = flat_model.layers[0]._params
+    assert server is flat_model.layers[1]._params
+    assert server.flat_params.size == sum(
+        node.get_param(name).size for node in model.walk() for name in node.param_names
+    )
+    for node, flat_node in zip(model.walk(), flat_model.walk()):
+        for name in node.param_names:
+            numpy.testing.assert_equal(flat_node.get_param(name), node.get_param(name))
+    # With gradient clipping disabled, one update over the flat buffer is the
+    # same as one update per parameter.
+    optimizer = Adam(0.01, grad_clip=0.0)
+    flat_optimizer = Adam(0.01, grad_clip=0.0)
+    for _ in range(3):
+        for m, opt in ((model, optimizer), (flat_model, flat_optimizer)):
+            Yh, backprop = m.begin_update(X)
+            backprop(Yh - Y)
+            m.finish_update(opt)
+    assert not server.flat_grads.any()
+    for node, flat_node in zip(model.walk(), flat_model.walk()):
+        for name in node.param_names:
+            param = node.get_param(name)
+            flat_param = flat_node.get_param(name)
+            numpy.testing.assert_allclose(flat_param, param, rtol=1e-5, atol=1e-6)
+            key = (node.id, name)
+            flat_key = (flat_node.id, name)
+            assert flat_optimizer.averages[flat_key].shape == param.shape
+            numpy.testing.assert_allclose(
+                flat_optimizer.averages[flat_key],
+                optimizer.averages[key],
+                rtol=1e-5,
+                atol=1e-6,
+            )
+
+
+def _sgd_copy(key, weights, gradient):
+    # An optimizer that returns new weights instead of updating them in-place.
+    weights = weights - 0.1 * gradient
+    gradient.fill(0)
+    return weights, gradient
+
+
+def test_flatten_params_optimizer_returns_copies():
+    X = numpy.random.uniform(-1, 1, (8, 4)).astype("f")
+    Y = numpy.random.uniform(-1, 1, (8, 3)).astype("f")
+    model = chain(Relu(5), Linear(3)).initialize(X=X, Y=Y)
+    flat_model = model.copy()
+    flat_model.flatten_params()
+    for _ in range(3):
+        for m in (model, flat_model):
+            Yh, backprop = m.begin_update(X)
+            backprop(Yh - Y)
+            m.finish_update(_sgd_copy)
+    assert not flat_model.layers[0]._params.flat_grads.any()
+    for node, flat_node in zip(model.walk(), flat_model.walk()):
+        for name in node.param_names:
+            numpy.testing.assert_allclose(
+                flat_node.get_param(name), node.get_param(name), rtol=1e-5, atol=1e-6
+            )
+
+
+def test_flatten_params_set_param():
+    model = Linear(3, 2).initialize()
+    model.flatten_params()
+    server = model._params
+    W = numpy.ones((3, 2), dtype="f")
+    model.set_param("W", W)
+    assert server.flat_key is not None
+    numpy.testing.assert_equal(server.flat_params[:6], W.ravel())
+    model.set_param("W", numpy.ones((4, 2), dtype="f"))
+    assert server.flat_key is None
+    assert model.get_param("W").shape == (4, 2)
+
+
+def test_flatten_params_use_params():
+    model = chain(Linear(3, 2), Linear(2, 3)).initialize()
+    model.flatten_params()
+    params = {}
+    expected = {}
+    for node in model.walk():
+        for name in node.param_names:
+            key = (node.id, name)
+            expected[key] = node.get_param(name).copy()
+            params[key] = numpy.zeros_like(expected[key])
+    with model.use_params(params):
+        assert not model.layers[0].get_param("W").any()
+    for node in model.walk():
+        for name in node.param_names:
+            numpy.testing.assert_equal(node.get_param(name), expected[(node.id, name)])
+
+
+def test_initialize_shape_only():
+    X = numpy.zeros((2, 4), dtype="f")
+    model = chain(Relu(5), Linear(3)).initialize(X=X)
+    deferred = chain(Relu(5), Linear(3)).initialize(X=X, shape_only=True)
+    relu = deferred.layers[0]
+    assert relu._params.deferred_keys == ((relu.id, "W"), (relu.id, "b"))
+    assert relu.get_dim("nI") == 4
+    # Only the shape is recorded until the parameter is retrieved.
+    placeholder = relu._params._params[(relu.id, "W")]
+    assert placeholder.shape == (5, 4)
+    assert placeholder.strides == (0, 0)
+    W = relu.get_param("W")
+    assert W.shape == (5, 4) and W.flags.writeable and W.any()
+    assert relu._params.deferred_keys == ((relu.id, "b"),)
+    # Loading the weights means the values never need to be drawn.
+    loaded = chain(Relu(5), Linear(3)).initialize(X=X, shape_only=True)
+    loaded.from_bytes(model.to_bytes())
+    assert all(node._params.deferred_keys == () for node in loaded.walk())
+    X = numpy.random.uniform(-1, 1, (2, 4)).astype("f")
+    numpy.testing.assert_equal(loaded.predict(X), model.predict(X))
+
+
+def test_initialize_shape_only_reproducible():
+    # The values don't depend on the order the params are retrieved in, or on
+    # random numbers drawn in between.
+    X = numpy.zeros((2, 4), dtype="f")
+    fix_random_seed(0)
+    model1 = chain(Relu(5), Linear(3)).initialize(X=X, shape_only=True)
+    fix_random_seed(0)
+    model2 = chain(Relu(5), Linear(3)).initialize(X=X, shape_only=True)
+    W1 = [node.get_param("W") for node in model1.layers]
+    numpy.random.uniform(size=(10,))
+    W2 = [node.get_param("W") for node in reversed(model2.layers)][::-1]
+    for W_a, W_b in zip(W1, W2):
+        numpy.testing.assert_equal(W_a, W_b)
+    assert model1.to_bytes() == model2.to_bytes()
+
+
+def test_initialize_shape_only_fallback():
+    # LSTM concatenates the initial values, so they have to be drawn.
+    model = LSTM(4, 4).initialize(shape_only=True)
+    assert model._params.deferred_keys == ()
+    assert model.get_param("LSTM").any()
+
+
+NEEDS_SHARED_MEMORY = pytest.mark.skipif(
+    sys.version_info < (3, 8), reason="needs shared_memory"
+)
+
+
+@pytest.mark.parametrize(
+    "n_process,n_threads",
+    [(1, 1), pytest.param(2, 1, marks=NEEDS_SHARED_MEMORY), (1, 3)],
+)
+@pytest.mark.parametrize("by_length", [False, True])
+def test_pipe(n_process, n_threads, by_length):
+    model = chain(list2ragged(), reduce_mean(), Relu(4, 3)).initialize()
+    lengths = numpy.random.randint(1, 10, 50)
+    items = [numpy.random.uniform(-1, 1, (n, 3)).astype("f") for n in lengths]
+    outputs = model.pipe(
+        iter(items),
+        batch_size=4,
+        n_process=n_process,
+        n_threads=n_threads,
+        by_length=by_length,
+    )
+    outputs = list(outputs)
+    assert len(outputs) == len(items)
+    numpy.testing.assert_allclose(
+        numpy.stack(outputs), model.predict(items), rtol=1e-5, atol=1e-6
+    )
+    with pytest.raises(ValueError):
+        next(model.pipe(items, batch_size=0))
+    with pytest.raises(ValueError):
+        next(model.pipe(items, n_process=2, n_threads=2))
+
+
+@pytest.mark.parametrize(
+    "n_process,n_threads",
+    [(1, 1), pytest.param(2, 1, marks=NEEDS_SHARED_MEMORY), (1, 3)],
+)
+def test_pipe_array_rows(n_process, n_threads):
+    model = chain(Relu(8, 3), Softmax(3, 8)).initialize()
+    X = numpy.random.uniform(-1, 1, (50, 3)).astype("f")
+    outputs = model.pipe(
+        list(X), batch_size=8, n_process=n_process, n_threads=n_threads
+    )
+    outputs = list(outputs)
+    assert len(outputs) == len(X)
+    assert all(output.shape == (3,) for output in outputs)
+    numpy.testing.assert_allclose(
+        numpy.stack(outputs), model.predict(X), rtol=1e-5, atol=1e-6
+    )
+    # The rows of an array stream are batched the same way.
+    outputs = list(model.pipe(X, batch_size=8, n_threads=n_threads))
+    numpy.testing.assert_allclose(
+        numpy.stack(outputs), model.predict(X), rtol=1e-5, atol=1e-6
+    )
+
+
+def _forward_shared_W(model, X, is_train):
+    # Report whether the weights are a view of shared memory in the worker.
+    W = model.get_param("W")
+    is_shared = get_shared_block_view(W) is not None and not W.flags.writeable
+    Y = numpy.full((len(X), 1), float(is_shared), dtype="f")
+    return Y, lambda dY: dY
+
+
+@NEEDS_SHARED_MEMORY
+def test_pipe_shared_memory():
+    model = Model("shared_W", _forward_shared_W, params={"W": None})
+    model.set_param("W", numpy.ones((64, 64), dtype="f"))
+    # The model itself isn't changed, only the workers use shared memory.
+    assert model.predict([0]).sum() == 0
+    outputs = list(model.pipe(range(20), batch_size=2, n_process=2))
+    assert len(outputs) == 20
+    assert all(output[0] == 1.0 for output in outputs)
+    assert model.get_param("W").flags.writeable
+
+
+def test_concurrent_predict():
+    # Many threads predicting with one model, including the first use of
+    # params whose initialization was deferred, get the same results as
+    # predicting one batch at a time.
+    X = [numpy.zeros((2, 3), dtype="f")]
+    model = chain(
+        with_array(Maxout(6, 3)), list2ragged(), reduce_mean(), Relu(4)
+    ).initialize(X=X, shape_only=True)
+    batches = []
+    for _ in range(40):
+        lengths = numpy.random.randint(1, 20, 8)
+        batches.append(
+            [numpy.random.uniform(-1, 1, (n, 3)).astype("f") for n in lengths]
+        )
+    barrier = threading.Barrier(8)
+    results = {}
+
+    def worker(i):
+        barrier.wait()
+        for j in range(i, len(batches), 8):
+            results[j] = model.predict(batches[j])
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(results) == len(batches)
+    for j, batch in enumerate(batches):
+        numpy.testing.assert_allclose(
+            results[j], model.predict(batch), rtol=1e-5, atol=1e-6
+        )
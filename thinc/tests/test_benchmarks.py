@@ -0,0 +1,53 @@
+import json
+from thinc.benchmarks import BENCHMARKS, run_benchmarks, compare_results
+from thinc.benchmarks.__main__ import main
+
+
+def test_run_benchmarks():
+    results = run_benchmarks(scale=0.01, min_time=0.0, min_calls=1)
+    assert [result["name"] for result in results["results"]] == list(BENCHMARKS)
+    for result in results["results"]:
+        assert result["calls"] >= 1
+        assert result["items_per_second"] > 0
+        assert result["peak_memory"] >= 0
+    assert json.loads(json.dumps(results)) == results
+
+
+def test_compare_results():
+    baseline = {
+        "results": [
+            {"name": "a", "items_per_second": 100.0, "peak_memory": 2 ** 20},
+            {"name": "b", "items_per_second": 100.0, "peak_memory": 2 ** 20},
+            {"name": "c", "items_per_second": 100.0, "peak_memory": 100},
+        ]
+    }
+    results = {
+        "results": [
+            {"name": "a", "items_per_second": 95.0, "peak_memory": 2 ** 20},
+            {"name": "b", "items_per_second": 50.0, "peak_memory": 2 ** 21},
+            {"name": "c", "items_per_second": 100.0, "peak_memory": 200},
+            {"name": "d", "items_per_second": 1.0, "peak_memory": 2 ** 30},
+        ]
+    }
+    regressions = compare_results(results, baseline, threshold=0.1)
+    assert [(r["name"], r["metric"]) for r in regressions] == [
+        ("b", "items_per_second"),
+        ("b", "peak_memory"),
+    ]
+    assert regressions[0]["change"] == -0.5
+
+
+def test_benchmarks_main(tmp_path):
+    output = tmp_path / "results.json"
+    args = ["ops.gemm", "--scale", "0.01", "--min-time", "0", "--min-calls", "1"]
+    assert main(args + ["--output", str(output)]) == 0
+    with output.open() as file_:
+        results = json.load(file_)
+    # The names are matched by substring.
+    names = [result["name"] for result in results["results"]]
+    assert names == ["ops.gemm", "ops.gemm_int8"]
+    results["results"][0]["items_per_second"] *= 1000
+    with output.open("w") as file_:
+        json.dump(results, file_)
+    assert main(args + ["--baseline", str(output)]) == 1
+    assert main(["does-not-exist"]) == 1
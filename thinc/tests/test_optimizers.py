@@ -1,5 +1,5 @@
 import pytest
-from thinc.api import registry, Optimizer
+from thinc.api import registry, Optimizer, RowSparse
 import numpy
 
 
@@ -97,3 +97,159 @@ def test_optimizer_init():
     optimizer((0, "x"), W, dW)
     optimizer = Optimizer(learn_rate=0.123, beta1=0.1, beta2=0.1)
     optimizer((1, "x"), W, dW)
+
+
+@pytest.mark.parametrize("name", ["Adam.v1", "SGD.v1", "RAdam.v1"])
+def test_optimizer_row_sparse(name):
+    dense_opt = registry.resolve({"config": {"@optimizers": name, "learn_rate": 0.1}})
+    sparse_opt = registry.resolve({"config": {"@optimizers": name, "learn_rate": 0.1}})
+    dense_opt, sparse_opt = dense_opt["config"], sparse_opt["config"]
+    W = numpy.random.uniform(-1, 1, (5, 3)).astype("f")
+    dense_W = W.copy()
+    sparse_W = W.copy()
+    # Only the lazy update starts the averages from the weights.
+    dense_opt.averages[(0, "E")] = W.copy()
+    sparse_opt.averages[(0, "E")] = W.copy()
+    for _ in range(3):
+        # Every row is touched (row 1 twice), so lazy and dense updates agree.
+        indices = numpy.asarray([4, 1, 0, 3, 1, 2], dtype="i")
+        values = numpy.random.uniform(-1, 1, (6, 3)).astype("f")
+        grad = RowSparse(indices, values, W.shape)
+        dense_W, _ = dense_opt((0, "E"), dense_W, grad.to_dense())
+        sparse_W, _ = sparse_opt((0, "E"), sparse_W, grad)
+        assert len(grad) == 0
+        numpy.testing.assert_allclose(sparse_W, dense_W, rtol=1e-5, atol=1e-6)
+    numpy.testing.assert_allclose(
+        sparse_opt.averages[(0, "E")],
+        dense_opt.averages[(0, "E")],
+        rtol=1e-5,
+        atol=1e-6,
+    )
+
+
+def test_optimizer_beta2_without_beta1():
+    optimizer = Optimizer(learn_rate=0.1, beta1=0.0, beta2=0.9)
+    W = numpy.zeros((5, 3), dtype="f")
+    grad = RowSparse(numpy.asarray([1], dtype="i"), numpy.ones((1, 3), "f"), W.shape)
+    with pytest.raises(ValueError):
+        optimizer((0, "E"), W, grad.to_dense())
+    with pytest.raises(ValueError):
+        optimizer((0, "E"), W, grad)
+
+
+def test_optimizer_row_sparse_untouched_rows():
+    optimizer = Optimizer(learn_rate=0.1, L2=0.1)
+    W = numpy.random.uniform(-1, 1, (5, 3)).astype("f")
+    orig_W = W.copy()
+    values = numpy.ones((2, 3), dtype="f")
+    grad = RowSparse(numpy.asarray([1, 3], dtype="i"), values, W.shape)
+    W, _ = optimizer((0, "E"), W, grad)
+    for i in (0, 2, 4):
+        numpy.testing.assert_equal(W[i], orig_W[i])
+        numpy.testing.assert_equal(optimizer.mom1[(0, "E")].reshape(W.shape)[i], 0)
+        numpy.testing.assert_equal(optimizer.averages[(0, "E")][i], orig_W[i])
+    assert not numpy.allclose(W[1], orig_W[1])
+    assert not numpy.allclose(W[3], orig_W[3])
+
+
+@pytest.mark.parametrize("name", ["Adam.v1", "SGD.v1", "RAdam.v1"])
+def test_optimizer_update_many(name):
+    config = {"config": {"@optimizers": name, "learn_rate": 0.1, "L2": 0.01}}
+    optimizer = registry.resolve(config)["config"]
+    many_optimizer = registry.resolve(config)["config"]
+    shapes = [(4, 3), (3,), (2, 2, 2)]
+    weights = [numpy.random.uniform(-1, 1, shape).astype("f") for shape in shapes]
+    many_weights = [W.copy() for W in weights]
+    for _ in range(7):
+        grads = [numpy.random.uniform(-1, 1, W.shape).astype("f") for W in weights]
+        for i, (W, dW) in enumerate(zip(weights, grads)):
+            weights[i], _ = optimizer((i, "W"), W, dW.copy())
+        items = [
+            ((i, "W"), W, dW) for i, (W, dW) in enumerate(zip(many_weights, grads))
+        ]
+        results = many_optimizer.update_many(items)
+        many_weights = [W for W, _ in results]
+        for dW in grads:
+            assert not dW.any()
+    for i, (W, many_W) in enumerate(zip(weights, many_weights)):
+        numpy.testing.assert_allclose(many_W, W, rtol=1e-5, atol=1e-6)
+        numpy.testing.assert_allclose(
+            many_optimizer.averages[(i, "W")], optimizer.averages[(i, "W")], rtol=1e-5
+        )
+
+
+def _reference_update(opt, state, W, dW, nr_upd, lr_scale=1.0):
+    # A per-parameter update written out in numpy, as a reference for the
+    # fused kernels.
+    W = W.astype("float64")
+    dW = dW.astype("float64")
+    if "mom1" not in state:
+        state["mom1"] = numpy.zeros_like(W)
+        state["mom2"] = numpy.zeros_like(W)
+        state["avg"] = numpy.zeros_like(W)
+    if opt.L2 != 0 and not opt.L2_is_weight_decay:
+        dW += opt.L2 * W
+    norm = numpy.linalg.norm(dW)
+    if opt.grad_clip and norm >= opt.grad_clip:
+        dW *= opt.grad_clip / norm
+    mom1, mom2 = state["mom1"], state["mom2"]
+    if opt.use_radam or opt.b1 > 0.0:
+        mom1[:] = opt.b1 * mom1 + (1 - opt.b1) * dW
+        mom2[:] = opt.b2 * mom2 + (1 - opt.b2) * dW ** 2
+    if opt.use_radam:
+        step = nr_upd + 1
+        beta2_t = opt.b2 ** step
+        N_sma_max = 2 / (1 - opt.b2) - 1
+        N_sma = N_sma_max - 2 * step * beta2_t / (1 - beta2_t)
+        if N_sma >= 5:
+            rect = (N_sma - 4) / (N_sma_max - 4) * (N_sma - 2) / N_sma
+            rect *= N_sma_max / (N_sma_max - 2)
+            step_size = (((1 - beta2_t) * rect) ** 0.5) / (1 - opt.b1 ** step)
+            W -= step_size * opt.learn_rate * mom1 / (numpy.sqrt(mom2) + opt.eps)
+        else:
+            W -= opt.learn_rate / (1 - opt.b1 ** step) * mom1
+    elif opt.b1 > 0.0:
+        fix1 = 1.0 - opt.b1 ** nr_upd
+        fix2 = 1.0 - opt.b2 ** nr_upd
+        lr = opt.learn_rate * fix2 ** 0.5 / fix1 * lr_scale
+        W -= lr * mom1 / (numpy.sqrt(mom2) + opt.eps)
+    else:
+        W -= lr_scale * opt.learn_rate * dW
+    if opt.L2 != 0 and opt.L2_is_weight_decay:
+        W -= lr_scale * opt.learn_rate * opt.L2 * W
+    decay = min((1.0 + nr_upd) / (10.0 + nr_upd), 0.9999)
+    state["avg"] -= (1 - decay) * (state["avg"] - W)
+    return W
+
+
+@pytest.mark.parametrize(
+    "name,kwargs",
+    [
+        ("Adam.v1", {}),
+        ("Adam.v1", {"L2_is_weight_decay": False}),
+        ("Adam.v1", {"grad_clip": 0.5}),
+        ("RAdam.v1", {}),
+        ("SGD.v1", {}),
+    ],
+)
+def test_optimizer_matches_reference(name, kwargs):
+    config = {"@optimizers": name, "learn_rate": 0.01, "L2": 0.01, **kwargs}
+    optimizer = registry.resolve({"config": config})["config"]
+    shapes = [(4, 3), (3,), (2, 2, 2)]
+    weights = [numpy.random.uniform(-1, 1, shape).astype("f") for shape in shapes]
+    expected = [W.astype("float64") for W in weights]
+    states = [{} for _ in shapes]
+    for nr_upd in range(1, 11):
+        grads = [numpy.random.uniform(-1, 1, W.shape).astype("f") for W in weights]
+        for i, dW in enumerate(grads):
+            expected[i] = _reference_update(
+                optimizer, states[i], expected[i], dW, nr_upd, lr_scale=0.5
+            )
+        items = [((i, "W"), W, dW) for i, (W, dW) in enumerate(zip(weights, grads))]
+        weights = [W for W, _ in optimizer.update_many(items, lr_scale=0.5)]
+        for W, E in zip(weights, expected):
+            numpy.testing.assert_allclose(W, E, rtol=1e-5, atol=1e-6)
+    for i, state in enumerate(states):
+        numpy.testing.assert_allclose(
+            optimizer.averages[(i, "W")], state["avg"], rtol=1e-5, atol=1e-6
+        )
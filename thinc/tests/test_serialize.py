@@ -1,7 +1,13 @@
+import gc
 import pytest
 import srsly
+import sys
+import numpy
 from thinc.api import with_array, Linear, Maxout, chain, Model, Shim
 from thinc.api import serialize_attr, deserialize_attr
+from thinc._mmap import MMAP_MAGIC
+
+from .util import make_tempdir
 
 
 @pytest.fixture
@@ -198,3 +204,120 @@ def test_multi_model_can_from_dict():
     assert chain(Maxout(5, 10, nP=2), Maxout(2, 3)).can_from_dict(model_dict)
     resized = chain(Maxout(5, 10, nP=3), Maxout(2, 3))
     assert not resized.can_from_dict(model_dict)
+
+
+def test_simple_model_roundtrip_disk_mmap():
+    model = chain(Linear(3, 4), Maxout(2, 3)).initialize()
+    model.attrs["some-attr"] = numpy.asarray([1, 2, 3], dtype="i")
+    with make_tempdir() as temp_dir:
+        path = temp_dir / "model"
+        model.to_disk(path, mmap=True)
+        with path.open("rb") as file_:
+            assert file_.read(len(MMAP_MAGIC)) == MMAP_MAGIC
+        new_model = chain(Linear(3, 4), Maxout(2, 3))
+        assert new_model.can_from_disk(path)
+        new_model.from_disk(path)
+        assert new_model.to_bytes() == model.to_bytes()
+        W = new_model.layers[0].get_param("W")
+        assert W.ctypes.data % 64 == 0
+        # Writes to a loaded param stay in memory and don't change the file.
+        W[:] = 0
+        other_model = chain(Linear(3, 4), Maxout(2, 3)).from_disk(path)
+        numpy.testing.assert_equal(
+            other_model.layers[0].get_param("W"), model.layers[0].get_param("W")
+        )
+        # Regular files still load as before.
+        model.to_disk(path)
+        assert new_model.from_disk(path).to_bytes() == model.to_bytes()
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_simple_model_mmap_save_to_same_path(mmap):
+    model = chain(Linear(3, 4), Maxout(2, 3)).initialize()
+    model_bytes = model.to_bytes()
+    with make_tempdir() as temp_dir:
+        path = temp_dir / "model"
+        model.to_disk(path, mmap=True)
+        new_model = chain(Linear(3, 4), Maxout(2, 3)).from_disk(path)
+        # The params are mapped from the file that's being replaced.
+        new_model.to_disk(path, mmap=mmap)
+        assert new_model.to_bytes() == model_bytes
+        other_model = chain(Linear(3, 4), Maxout(2, 3)).from_disk(path)
+        assert other_model.to_bytes() == model_bytes
+        assert [p.name for p in temp_dir.iterdir()] == ["model"]
+
+
+@pytest.mark.skipif(sys.version_info < (3, 8), reason="needs shared_memory")
+def test_simple_model_shared_memory():
+    model = chain(Linear(3, 4), Maxout(2, 3)).initialize()
+    model_bytes = model.to_bytes()
+    block = model.to_shared_memory()
+    try:
+        assert model.to_bytes() == model_bytes
+        W = model.layers[0].get_param("W")
+        assert not W.flags.writeable
+        new_model = chain(Linear(3, 4), Maxout(2, 3)).from_shared_memory(block.name)
+        assert new_model.to_bytes() == model_bytes
+        assert numpy.shares_memory(new_model.layers[0].get_param("W"), W)
+        with pytest.raises(ValueError):
+            Linear(3, 4).from_shared_memory(block.name)
+    finally:
+        block.unlink()
+
+
+@pytest.mark.skipif(sys.version_info < (3, 8), reason="needs shared_memory")
+def test_simple_model_shared_memory_flat_params():
+    model = chain(Linear(3, 4), Maxout(2, 3)).initialize()
+    model.flatten_params()
+    model_bytes = model.to_bytes()
+    block = model.to_shared_memory()
+    try:
+        W = model.layers[0].get_param("W")
+        assert not W.flags.writeable
+        data = numpy.frombuffer(block.buf, dtype="uint8")
+        assert numpy.shares_memory(W, data)
+        del data
+        new_model = chain(Linear(3, 4), Maxout(2, 3)).initialize()
+        new_model.flatten_params()
+        new_model.from_shared_memory(block.name)
+        assert numpy.shares_memory(new_model.layers[0].get_param("W"), W)
+        assert new_model.to_bytes() == model_bytes
+    finally:
+        block.unlink()
+
+
+@pytest.mark.skipif(sys.version_info < (3, 8), reason="needs shared_memory")
+def test_simple_model_shared_memory_release():
+    model = chain(Linear(3, 4), Maxout(2, 3)).initialize()
+    model_bytes = model.to_bytes()
+    block = model.to_shared_memory()
+    other_block = Linear(2, 2).initialize().to_shared_memory()
+    other_block.unlink()
+    # The block is closed once no model uses it.
+    gc.collect()
+    assert other_block.buf is None
+    new_model = chain(Linear(3, 4), Maxout(2, 3)).from_shared_memory(block.name)
+    model.release_shared_memory(unlink=True)
+    assert model.layers[0].get_param("W").flags.writeable
+    assert model.to_bytes() == model_bytes
+    assert block.buf is not None
+    with pytest.raises(FileNotFoundError):
+        Linear(3, 4).from_shared_memory(block.name)
+    del new_model
+    gc.collect()
+    assert block.buf is None
+
+
+def test_simple_model_mmap_flat_params():
+    model = chain(Linear(3, 4), Maxout(2, 3)).initialize()
+    with make_tempdir() as temp_dir:
+        path = temp_dir / "model"
+        model.to_disk(path, mmap=True)
+        new_model = chain(Linear(3, 4), Maxout(2, 3)).initialize()
+        new_model.flatten_params()
+        new_model.from_disk(path)
+        W = new_model.layers[0].get_param("W")
+        data = numpy.memmap(path, dtype="uint8", mode="r")
+        assert not numpy.shares_memory(W, new_model._params.flat_params)
+        assert new_model.to_bytes() == model.to_bytes()
+        del data, W, new_model
@@ -0,0 +1,118 @@
+import pytest
+import asyncio
+import sys
+import numpy
+from thinc.api import Relu, Softmax, chain, list2ragged, reduce_mean
+from thinc.serving import Batcher
+
+
+# The tests use asyncio.run, which was added in Python 3.7.
+pytestmark = pytest.mark.skipif(sys.version_info < (3, 7), reason="needs Python 3.7")
+
+
+@pytest.fixture
+def model():
+    return chain(list2ragged(), reduce_mean(), Relu(4, 3)).initialize()
+
+
+def make_items(n):
+    lengths = numpy.random.randint(1, 20, n)
+    return [numpy.random.uniform(-1, 1, (n, 3)).astype("f") for n in lengths]
+
+
+@pytest.mark.parametrize("by_length", [False, True])
+def test_batcher(model, by_length):
+    items = make_items(100)
+
+    async def run():
+        batcher = Batcher(model, 8, 5.0, by_length=by_length)
+        outputs = await asyncio.gather(*[batcher.predict(item) for item in items])
+        metrics = batcher.get_metrics()
+        await batcher.close()
+        return outputs, metrics
+
+    outputs, metrics = asyncio.run(run())
+    numpy.testing.assert_allclose(
+        numpy.stack(outputs), model.predict(items), rtol=1e-5, atol=1e-6
+    )
+    assert metrics["n_requests"] == 100
+    assert metrics["queue_depth"] == 0
+    assert 100 / 8 <= metrics["n_batches"] < 100
+    assert metrics["mean_batch_size"] <= 8
+    assert 0 < metrics["p50_latency_ms"] <= metrics["max_latency_ms"]
+
+
+def test_batcher_array_rows():
+    model = chain(Relu(8, 3), Softmax(3, 8)).initialize()
+    X = numpy.random.uniform(-1, 1, (50, 3)).astype("f")
+
+    async def run():
+        batcher = Batcher(model, 8, 5.0)
+        outputs = await asyncio.gather(*[batcher.predict(row) for row in X])
+        await batcher.close()
+        return outputs
+
+    outputs = asyncio.run(run())
+    assert all(output.shape == (3,) for output in outputs)
+    numpy.testing.assert_allclose(
+        numpy.stack(outputs), model.predict(X), rtol=1e-5, atol=1e-6
+    )
+
+
+def test_batcher_deadline(model):
+    # A lone request is predicted once it has waited max_latency_ms.
+    async def run():
+        batcher = Batcher(model, 100, 1.0)
+        output = await asyncio.wait_for(batcher.predict(make_items(1)[0]), 5)
+        await batcher.close()
+        return output, batcher.n_batches
+
+    output, n_batches = asyncio.run(run())
+    assert output.shape == (4,)
+    assert n_batches == 1
+
+
+def test_batcher_errors(model):
+    async def run():
+        batcher = Batcher(model, 4, 1.0)
+        with pytest.raises(ValueError):
+            await batcher.predict(numpy.zeros((2, 5), dtype="f"))
+        # The batcher keeps serving requests after an error.
+        output = await batcher.predict(make_items(1)[0])
+        await batcher.close()
+        return output
+
+    assert asyncio.run(run()).shape == (4,)
+    with pytest.raises(ValueError):
+        Batcher(model, 0)
+
+
+def test_batcher_closed(model):
+    async def run():
+        batcher = Batcher(model, 4, 1.0)
+        await batcher.predict(make_items(1)[0])
+        await batcher.close()
+        with pytest.raises(ValueError):
+            await batcher.predict(make_items(1)[0])
+
+    asyncio.run(run())
+
+
+def test_batcher_runner_error(model):
+    def start_batch(requests):
+        raise KeyError("runner failed")
+
+    async def run():
+        batcher = Batcher(model, 2, 1000.0)
+        batcher._start_batch = start_batch
+        requests = [batcher.predict(item) for item in make_items(3)]
+        # The queued requests receive the error instead of waiting forever.
+        results = await asyncio.wait_for(
+            asyncio.gather(*requests, return_exceptions=True), 5
+        )
+        assert all(isinstance(result, KeyError) for result in results)
+        with pytest.raises(ValueError):
+            await batcher.predict(make_items(1)[0])
+        await batcher.close()
+
+    asyncio.run(run())
@@ -0,0 +1,40 @@
+import numpy
+from thinc.api import Linear, Relu, chain, model_summary
+
+
+def test_model_summary():
+    model = chain(Relu(4, 3), Linear(2, 4))
+    X = numpy.ones((5, 3), dtype="f")
+    model.initialize(X=X)
+    forward = model.layers[0]._func
+    summary = model_summary(model, X)
+    assert [node.name for node in summary.nodes] == ["relu>>linear", "relu", "linear"]
+    assert [node.depth for node in summary.nodes] == [0, 1, 1]
+    root, relu, linear = summary.nodes
+    assert relu.n_params == 4 * 3 + 4
+    assert linear.n_params == 2 * 4 + 2
+    assert summary.n_params == relu.n_params + linear.n_params
+    assert linear.input_shape == (5, 4)
+    assert linear.output_shape == (5, 2)
+    assert linear.forward_flops >= 2 * 5 * 2 * 4
+    assert linear.backward_flops >= 2 * 2 * 5 * 2 * 4
+    assert summary.forward_flops == relu.forward_flops + linear.forward_flops
+    # The chain returns the output of the last layer, which isn't counted twice.
+    assert root.activation_bytes == 0
+    assert linear.activation_bytes == 5 * 2 * 4
+    assert summary.activation_bytes == 5 * 4 * 4 + 5 * 2 * 4
+    assert summary.inference_peak_bytes == 5 * 3 * 4 + 5 * 4 * 4
+    assert "relu>>linear" in str(summary)
+    # The model itself isn't changed.
+    assert not any(node.grad_names for node in model.walk())
+    assert model.layers[0]._func is forward
+    assert model.layers[0].ops is model.ops
+
+
+def test_model_summary_uninitialized():
+    model = Linear(2)
+    X = numpy.ones((5, 3), dtype="f")
+    summary = model_summary(model, X, backward=False)
+    assert summary.n_params == 3 * 2 + 2
+    assert summary.backward_flops == 0
+    assert model.has_param("W") is None
@@ -899,6 +899,47 @@ class Ragged:
         return self._get_cumsums()
 
 
+@dataclass
+class RowSparse:
+    """A gradient for a 2d table where only some rows are non-zero, such as the
+    gradient of an embedding table. The rows are stored as an array of row
+    indices and an array with one row of values per index. Indices may repeat,
+    in which case the values for the same row are summed.
+    """
+
+    indices: Ints1d
+    values: Floats2d
+    shape: Tuple[int, int]
+
+    def __len__(self) -> int:
+        return self.indices.shape[0]
+
+    def copy(self) -> "RowSparse":
+        return RowSparse(self.indices.copy(), self.values.copy(), self.shape)
+
+    def append(self, other: "RowSparse") -> None:
+        """Add the rows of another gradient for the same table."""
+        xp = get_array_module(self.values)
+        self.indices = xp.concatenate((self.indices, other.indices))
+        self.values = xp.concatenate((self.values, other.values))
+
+    def clear(self) -> None:
+        """Remove all rows, e.g. once the gradient has been applied."""
+        self.indices = self.indices[:0]
+        self.values = self.values[:0]
+
+    def to_dense(self) -> Floats2d:
+        xp = get_array_module(self.values)
+        dense = xp.zeros(self.shape, dtype=self.values.dtype)
+        if xp is numpy:
+            numpy.add.at(dense, self.indices, self.values)
+        else:  # pragma: no cover
+            import cupyx
+
+            cupyx.scatter_add(dense, self.indices, self.values)
+        return dense
+
+
 _P = TypeVar("_P", bound=Sequence)
 
 
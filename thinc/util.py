@@ -71,10 +71,28 @@ def gpu_is_available():
         return False
 
 
+# The numpy Generator used by CPU kernels that need random numbers, such as
+# NumpyOps.dropout. It's reseeded by fix_random_seed. The legacy global
+# RandomState is used instead with numpy < 1.17.
+_numpy_rng: Any = (
+    numpy.random.default_rng() if hasattr(numpy.random, "default_rng") else None
+)
+
+
+def get_numpy_rng() -> Any:
+    """Get the numpy Generator for the CPU kernels, or the numpy.random module
+    if numpy.random.Generator isn't available.
+    """
+    return _numpy_rng if _numpy_rng is not None else numpy.random
+
+
 def fix_random_seed(seed: int = 0) -> None:  # pragma: no cover
     """Set the random seed across random, numpy.random and cupy.random."""
+    global _numpy_rng
     random.seed(seed)
     numpy.random.seed(seed)
+    if _numpy_rng is not None:
+        _numpy_rng = numpy.random.default_rng(seed)
     if has_torch:
         torch.manual_seed(seed)
     if has_cupy and gpu_is_available():